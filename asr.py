@@ -1,4 +1,8 @@
 import argparse
+import glob
+import os
+
+import numpy as np
 from funasr import AutoModel
 
 def format_time_ms(ms):
@@ -10,52 +14,48 @@ def format_time_ms(ms):
     mmm = int(ms % 1000)
     return f"{h:02d}:{m:02d}:{s:02d},{mmm:03d}"
 
-def save_as_srt(res, output_file, gap_threshold=300):
-    text = res[0]['text']
-    timestamps = res[0]['timestamp'] # 字符级时间戳 [[start, end], ...]
-    
+PUNCTUATION = "，。！？；：,.;?! "
+
+def split_segments(text, timestamps, gap_threshold=300):
+    """
+    按字符级时间戳分句：相邻两个字符的间隔超过 gap_threshold (ms) 时断句。
+    标点和空格不消耗时间戳，归入前一句；没有时间戳的多余字符被丢弃。
+    时间戳以数组整体计算，不再逐字符循环。
+    """
+    chars = np.array(list(text), dtype=object)
+    is_punct = np.isin(chars, list(PUNCTUATION))
+    ts = np.asarray(timestamps, dtype=np.int64).reshape(-1, 2)
+    # 每个时间戳对应的字符下标
+    char_pos = np.flatnonzero(~is_punct)[:len(ts)]
+    ts = ts[:len(char_pos)]
+    if len(char_pos) == 0:
+        return []
+    keep = is_punct.copy()
+    keep[char_pos] = True
+
+    # 第 k 个字符与第 k-1 个字符的间隔超过阈值则在其前断句
+    new_seg = np.zeros(len(chars), dtype=np.int64)
+    new_seg[char_pos[1:]] = (ts[1:, 0] - ts[:-1, 1]) > gap_threshold
+    seg_ids = np.cumsum(new_seg)
+    ts_seg_ids = seg_ids[char_pos]
+    first = np.searchsorted(ts_seg_ids, np.arange(ts_seg_ids[-1] + 1), side="left")
+    last = np.searchsorted(ts_seg_ids, np.arange(ts_seg_ids[-1] + 1), side="right") - 1
+    bounds = np.append(np.flatnonzero(new_seg), len(chars))
+
     segments = []
-    current_chars = []
-    current_start = None
-    previous_end = None
-    
-    ts_idx = 0
-    # 遍历文本
-    for char in text:
-        # 如果是标点符号或空格，直接加入当前缓存，不触发分句，也不消耗时间戳
-        if char in "，。！？；：,.;?! ":
-            current_chars.append(char)
-            continue
-        
-        # 如果是普通字符，获取其时间戳
-        if ts_idx < len(timestamps):
-            start, end = timestamps[ts_idx]
-            
-            # 核心逻辑：如果当前字符开始时间与上一个字符结束时间间隔超过阈值，则分句
-            if previous_end is not None and (start - previous_end) > gap_threshold:
-                if current_chars:
-                    segments.append({
-                        'text': "".join(current_chars).strip(),
-                        'start': current_start,
-                        'end': previous_end
-                    })
-                    current_chars = []
-                    current_start = start # 新句子的开始时间
-            
-            if current_start is None:
-                current_start = start
-            
-            current_chars.append(char)
-            previous_end = end
-            ts_idx += 1
-
-    # 处理最后剩余的字符
-    if current_chars:
+    begin = 0
+    for i, stop in enumerate(bounds):
+        seg_chars = chars[begin:stop][keep[begin:stop]]
         segments.append({
-            'text': "".join(current_chars).strip(),
-            'start': current_start,
-            'end': previous_end
+            'text': "".join(seg_chars).strip(),
+            'start': int(ts[first[i], 0]),
+            'end': int(ts[last[i], 1])
         })
+        begin = stop
+    return segments
+
+def save_as_srt(res, output_file, gap_threshold=300):
+    segments = split_segments(res[0]['text'], res[0]['timestamp'], gap_threshold)  # 字符级时间戳 [[start, end], ...]
 
     # 写入文件
     with open(output_file, "w", encoding="utf-8") as f:
@@ -66,13 +66,49 @@ def save_as_srt(res, output_file, gap_threshold=300):
     print(f"SRT 文件已保存至: {output_file}")
 
 
+# 目录模式默认只取 .wav：数据目录中原始 .m4a 与 demucs 分离出的同名人声 .wav 并存，
+# 都取会把同一段音频转录两次并写入同一个 <name>.srt
+DEFAULT_EXTENSIONS = (".wav",)
+
+def collect_inputs(paths, extensions=DEFAULT_EXTENSIONS):
+    """展开输入：文件原样保留，目录取其中扩展名在 extensions 中的音频文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(extensions)))
+        else:
+            files.append(path)
+    return files
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="ASR to SRT Converter")
-    parser.add_argument("input_file", type=str, help="Input audio file path")
-    parser.add_argument("--output", type=str, default="output.srt", help="Output SRT file path")
+    parser.add_argument("inputs", type=str, nargs="+", help="Input audio files or directories")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output SRT file path for a single input (default: output.srt); "
+                             "with several inputs each SRT is written next to its audio as <name>.srt")
+    parser.add_argument("--output_dir", type=str, default=None, help="Write <name>.srt files to this directory")
     parser.add_argument("--threshold", type=int, default=800, help="Gap threshold in ms (default: 800)")
+    parser.add_argument("--batch_files", type=int, default=8, help="Number of files per model.generate call")
+    parser.add_argument("--ext", type=str, default=",".join(DEFAULT_EXTENSIONS),
+                        help="Comma-separated audio extensions picked from input directories (default: .wav)")
     args = parser.parse_args()
 
+    extensions = tuple("." + ext.strip().lower().lstrip(".") for ext in args.ext.split(",") if ext.strip())
+    input_files = collect_inputs(args.inputs, extensions)
+    if not input_files:
+        parser.error("no audio files found")
+
+    def output_path(audio_path):
+        if len(input_files) == 1 and args.output_dir is None:
+            return args.output or "output.srt"
+        name = os.path.splitext(os.path.basename(audio_path))[0] + ".srt"
+        return os.path.join(args.output_dir or os.path.dirname(audio_path), name)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # 模型只加载一次，所有文件共用
     model = AutoModel(
         model="paraformer-zh", 
         model_revision="v2.0.4",
@@ -81,8 +117,12 @@ if __name__ == "__main__":
         punc_model="ct-punc-c", 
         punc_model_revision="v2.0.4",
     )
-    res = model.generate(
-        input=args.input_file, 
-        batch_size_s=300, 
-    )
-    save_as_srt(res, args.output, gap_threshold=args.threshold)
\ No newline at end of file
+    for i in range(0, len(input_files), args.batch_files):
+        batch = input_files[i:i + args.batch_files]
+        res = model.generate(
+            input=batch, 
+            batch_size_s=300, 
+        )
+        assert len(res) == len(batch), f"expected {len(batch)} results, got {len(res)}"
+        for audio_path, item in zip(batch, res):
+            save_as_srt([item], output_path(audio_path), gap_threshold=args.threshold)
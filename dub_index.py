@@ -1,5 +1,4 @@
 import re
-import os
 import argparse
 from pydub import AudioSegment
 from indextts.infer_v2 import IndexTTS2
@@ -56,24 +55,29 @@ def srt_time_to_ms(time_str):
     return total_ms
 
 
-def generate_audio_for_text(text, model, duration):
-    wav_path = f"tmp_{os.getpid()}_{abs(hash(text)) % (10**8)}.wav"
-    model.infer(
+def generate_audio_for_text(text, model, duration, use_emo_text=False):
+    # 不落盘：直接取回内存中的 int16 音频
+    sampling_rate, wav_data = model.infer(
         spk_audio_prompt=PROMPT_AUDIO_PATH,
         text=text,
-        output_path=wav_path,
+        output_path=None,
+        use_emo_text=use_emo_text,
         verbose=False,
     )
-    sound = AudioSegment.from_wav(wav_path)
+    sound = AudioSegment(
+        data=wav_data.tobytes(),
+        sample_width=wav_data.dtype.itemsize,
+        frame_rate=sampling_rate,
+        channels=wav_data.shape[1],
+    )
     target_len_ms = int(duration)
     orig_len_ms = len(sound)
     playback_speed = orig_len_ms / target_len_ms
     adjusted_sound = sound.speedup(playback_speed=playback_speed)
-    os.remove(wav_path)
     return adjusted_sound
 
 
-def align_and_merge_audio(subtitles, model):
+def align_and_merge_audio(subtitles, model, use_emo_text=False):
     merged = AudioSegment.silent(duration=0, frame_rate=SAMPLE_RATE)
     for i, sub in enumerate(subtitles):
         start_ms = sub["start_ms"]
@@ -88,7 +92,7 @@ def align_and_merge_audio(subtitles, model):
             if i + 1 < len(subtitles)
             else float("inf")
         )
-        seg = generate_audio_for_text(text, model, subtitle_duration)
+        seg = generate_audio_for_text(text, model, subtitle_duration, use_emo_text)
         if threshold == float("inf"):
             continue
         if len(seg) >= threshold:
@@ -118,6 +122,9 @@ def main():
     parser.add_argument(
         "--model_dir", default="checkpoints", help="IndexTTS2 模型目录"
     )
+    parser.add_argument(
+        "--use_emo_text", action="store_true", help="根据字幕文本推断情感（QwenEmotion）"
+    )
     args = parser.parse_args()
 
     model = IndexTTS2(
@@ -126,14 +133,22 @@ def main():
         use_fp16=False,
         use_cuda_kernel=True,
         use_deepspeed=False,
+        lazy_load=True,
+        background_warmup=True,
     )
 
     print(f"📖 解析字幕文件: {args.srt}")
     subtitles = parse_srt(args.srt)
     print(f"✅ 共 {len(subtitles)} 条字幕\n")
 
+    # 并行预处理全部字幕文本，结果进入分词器缓存，合成时不再逐条归一化
+    model.tokenizer.parallel_encode([sub["text"] for sub in subtitles])
+    if args.use_emo_text:
+        # 批量推断全部字幕的情感，结果进入 QwenEmotion 缓存，合成时不再逐条生成
+        model.qwen_emo.batch_inference([sub["text"] for sub in subtitles])
+
     print("🎙️  开始生成并对齐音频...")
-    merged_audio = align_and_merge_audio(subtitles, model)
+    merged_audio = align_and_merge_audio(subtitles, model, args.use_emo_text)
 
     print(f"\n💾 保存音频文件: {args.output_file}")
     merged_audio.export(args.output_file, format="wav")
@@ -7,9 +7,16 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root / "src"))
 
 import contextlib
-from typing import Dict, Optional
+import copy
+import json
+import math
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
 
 import argbind
+import numpy as np
 import torch
 from tensorboardX import SummaryWriter
 from torch.optim import AdamW
@@ -33,6 +40,317 @@ from voxcpm.training import (
     build_dataloader,
     load_audio_text_datasets,
 )
+from voxcpm.training.data import DEFAULT_AUDIO_COLUMN, DEFAULT_REF_AUDIO_COLUMN, HFVoxCPMDataset
+from voxcpm.training.packers import AudioFeatureProcessingPacker
+
+
+# ---------------------------------------------------------------------- #
+# Pre-encoded audio-VAE latents
+#   The clips are fixed, so their VAE latents are encoded once into
+#   memory-mapped .npy shards; training then reads latents directly and
+#   the VAE is dropped from device memory.
+# ---------------------------------------------------------------------- #
+LATENT_INDEX_COLUMN = "latent_idx"
+
+
+def latent_cache_key(manifest: str, sample_rate: int, pretrained_path: str) -> dict:
+    stat = os.stat(manifest)
+    return {
+        "manifest": os.path.abspath(manifest),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "sample_rate": sample_rate,
+        "pretrained_path": os.path.abspath(pretrained_path),
+    }
+
+
+@torch.no_grad()
+def build_latent_cache(ds, audio_vae, config, cache_dir: Path, key: dict, device, tracker=None,
+                       shard_frames: int = 1 << 20):
+    """
+    Encode `audio` (and `ref_audio` if present) of every sample in `ds` with the audio VAE, exactly as
+    `AudioFeatureProcessingPacker.encode_audio` does during training, and write the latents [T, D] to
+    `cache_dir` as float32 .npy shards of about `shard_frames` frames.
+
+    `index.npy` holds one row per sample: (shard, offset, frames) of the target audio followed by the same
+    for the reference audio (frames 0 when absent). `meta.json` is written last and marks a complete cache;
+    an existing cache with the same `key` is reused.
+    """
+    meta_path = cache_dir / "meta.json"
+    if meta_path.exists():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            if json.load(f).get("key") == key:
+                return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale in cache_dir.glob("latents_*.npy"):
+        stale.unlink()
+    if meta_path.exists():
+        meta_path.unlink()
+
+    audio_vae.to(device)
+    packer = AudioFeatureProcessingPacker(
+        dataset_cnt=1,
+        max_len=config.max_length,
+        patch_size=config.patch_size,
+        feat_dim=config.feat_dim,
+        audio_vae=audio_vae,
+    )
+    columns = [c for c in (DEFAULT_AUDIO_COLUMN, DEFAULT_REF_AUDIO_COLUMN) if c in ds.column_names]
+    audio_ds = ds.select_columns(columns)
+    index = np.zeros((len(audio_ds), 6), dtype=np.int64)
+    buffer: List[np.ndarray] = []
+    state = {"shard": 0, "frames": 0}
+
+    def flush():
+        if buffer:
+            np.save(cache_dir / f"latents_{state['shard']:05d}.npy", np.concatenate(buffer, axis=0))
+            buffer.clear()
+            state["shard"] += 1
+            state["frames"] = 0
+
+    def add(audio) -> tuple:
+        wav = torch.tensor(audio["array"], dtype=torch.float32, device=device)
+        feat = packer.encode_audio(wav)[0].float().cpu().numpy()  # [T, D]
+        if state["frames"] + feat.shape[0] > shard_frames:
+            flush()
+        entry = (state["shard"], state["frames"], feat.shape[0])
+        buffer.append(feat)
+        state["frames"] += feat.shape[0]
+        return entry
+
+    start = time.perf_counter()
+    for i in range(len(audio_ds)):
+        item = audio_ds[i]
+        index[i, :3] = add(item[DEFAULT_AUDIO_COLUMN])
+        ref = item.get(DEFAULT_REF_AUDIO_COLUMN)
+        if ref is not None and len(ref["array"]) > 0:
+            index[i, 3:] = add(ref)
+        else:
+            index[i, 3:] = (-1, 0, 0)
+        if tracker is not None and (i + 1) % 1000 == 0:
+            tracker.print(f"Encoded {i + 1} / {len(audio_ds)} clips ({time.perf_counter() - start:.1f}s)")
+    flush()
+    np.save(cache_dir / "index.npy", index)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "num_samples": len(audio_ds), "num_shards": state["shard"],
+                   "has_ref_audio": DEFAULT_REF_AUDIO_COLUMN in columns}, f, indent=2)
+
+
+class LatentCache:
+    """Read-only view of a cache written by `build_latent_cache`; shards are memory-mapped on first use."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.has_ref_audio = meta["has_ref_audio"]
+        self.num_shards = meta["num_shards"]
+        self.index = np.load(self.cache_dir / "index.npy")
+        self._shards = None
+
+    def __getstate__(self):
+        # memory maps are reopened in every dataloader worker instead of being pickled
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def _get(self, shard: int, offset: int, frames: int) -> np.ndarray:
+        if frames == 0:
+            return None
+        if self._shards is None:
+            self._shards = [
+                np.load(self.cache_dir / f"latents_{i:05d}.npy", mmap_mode="r") for i in range(self.num_shards)
+            ]
+        return self._shards[shard][offset:offset + frames]
+
+    def audio(self, idx: int) -> np.ndarray:
+        return self._get(*self.index[idx, :3])
+
+    def ref_audio(self, idx: int) -> Optional[np.ndarray]:
+        return self._get(*self.index[idx, 3:])
+
+    def sample_lengths(self, ds, patch_size: int) -> List[int]:
+        """Exact packed sequence lengths, same formula as `compute_sample_lengths` without decoding audio."""
+        lengths = []
+        for text_ids, idx in zip(ds["text_ids"], ds[LATENT_INDEX_COLUMN]):
+            t_seq = math.ceil(int(self.index[idx, 2]) / patch_size)
+            ref_seq = math.ceil(int(self.index[idx, 5]) / patch_size)
+            lengths.append(len(text_ids) + t_seq + ref_seq + (4 if ref_seq > 0 else 2))
+        return lengths
+
+
+class LatentVoxCPMDataset(HFVoxCPMDataset):
+    """`HFVoxCPMDataset` yielding cached VAE latents [T, D] in place of waveforms."""
+
+    def __init__(self, dataset, latent_cache: LatentCache):
+        super().__init__(dataset)
+        self.latent_cache = latent_cache
+        self.has_ref_audio = latent_cache.has_ref_audio
+
+    def __getitem__(self, idx: int):
+        item = self.dataset[idx]
+        latent_idx = item[LATENT_INDEX_COLUMN]
+        sample = {
+            "text_ids": item["text_ids"],
+            "audio_latents": self.latent_cache.audio(latent_idx),
+            "dataset_id": item.get("dataset_id", 0),
+            "is_prompt": item.get("is_prompt", False),
+        }
+        if self.has_ref_audio:
+            sample["ref_audio_latents"] = self.latent_cache.ref_audio(latent_idx)
+        return sample
+
+    @staticmethod
+    def pad_latents(latents: List[Optional[np.ndarray]], feat_dim: int) -> torch.Tensor:
+        # rows of -100 mark padding, like the -100 samples `AudioFeatureProcessingPacker` strips from waveforms
+        seqs = [
+            torch.from_numpy(np.array(x, dtype=np.float32)) if x is not None else torch.zeros((0, feat_dim))
+            for x in latents
+        ]
+        return torch.nn.utils.rnn.pad_sequence(seqs, batch_first=True, padding_value=-100.0)
+
+    @classmethod
+    def collate_fn(cls, batch: List[Dict]):
+        text_tensors = [torch.tensor(sample["text_ids"], dtype=torch.int32) for sample in batch]
+        feat_dim = batch[0]["audio_latents"].shape[-1]
+        result = {
+            "text_tokens": cls.pad_sequences(text_tensors, pad_value=-100),
+            "audio_tokens": cls.pad_latents([s["audio_latents"] for s in batch], feat_dim),
+            "task_ids": torch.ones(len(batch), dtype=torch.int32),
+            "dataset_ids": torch.tensor([s["dataset_id"] for s in batch], dtype=torch.int32),
+            "is_prompts": [bool(s.get("is_prompt", False)) for s in batch],
+        }
+        if "ref_audio_latents" in batch[0]:
+            result["ref_audio_tokens"] = cls.pad_latents([s["ref_audio_latents"] for s in batch], feat_dim)
+        return result
+
+
+class LatentFeatureProcessingPacker(AudioFeatureProcessingPacker):
+    """Packer whose "audio tokens" are cached VAE latents [T, D], so no VAE is needed."""
+
+    def encode_audio(self, feats: torch.Tensor):
+        return feats.unsqueeze(0)  # [1, T, D]
+
+
+class LatentBatchProcessor(BatchProcessor):
+    """`BatchProcessor` for batches from `LatentVoxCPMDataset`."""
+
+    def __init__(self, *, config, dataset_cnt: int, device: torch.device, hop_length: int):
+        self.device = device
+        self.dataset_cnt = dataset_cnt
+        self.audio_vae = None
+        self.packer = LatentFeatureProcessingPacker(
+            dataset_cnt=dataset_cnt,
+            max_len=config.max_length,
+            patch_size=config.patch_size,
+            feat_dim=config.feat_dim,
+            audio_vae=SimpleNamespace(hop_length=hop_length),
+        )
+
+
+def build_latent_dataloader(hf_dataset, latent_cache: LatentCache, *, accelerator, batch_size: int,
+                            num_workers: int, drop_last: bool = False):
+    return accelerator.prepare_dataloader(
+        LatentVoxCPMDataset(hf_dataset, latent_cache),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        shuffle=True,
+        collate_fn=LatentVoxCPMDataset.collate_fn,
+        drop_last=drop_last,
+    )
+
+
+# ---------------------------------------------------------------------- #
+# Token-budget dynamic batching
+# ---------------------------------------------------------------------- #
+class TokenBudgetBatchSampler(torch.utils.data.Sampler):
+    """
+    Length-bucketed dynamic batches. Every epoch the samples are shuffled, sorted by length inside pools
+    of `bucket_size` samples and packed greedily while ``batch_size * longest_sample <= max_batch_tokens``,
+    then the batch order is shuffled and the batches are dealt round-robin to `num_replicas` ranks, every
+    rank getting the same number of batches. A sample longer than `max_batch_tokens` forms a batch alone.
+
+    Like DistributedSampler, all ranks must share `seed` and call `set_epoch` at every epoch boundary.
+    """
+
+    def __init__(self, lengths: List[int], max_batch_tokens: int, num_replicas: int = 1, rank: int = 0,
+                 shuffle: bool = True, seed: int = 0, bucket_size: int = 1024):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_batch_tokens = max_batch_tokens
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.bucket_size = bucket_size
+        self.epoch = 0
+        self._cache = None  # (epoch, batches of this rank, padding efficiency over all ranks)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _pack(self, indices: np.ndarray) -> List[List[int]]:
+        batches, batch, longest = [], [], 0
+        for idx in indices.tolist():
+            length = int(self.lengths[idx])
+            if batch and (len(batch) + 1) * max(longest, length) > self.max_batch_tokens:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(idx)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _epoch_batches(self):
+        if self._cache is not None and self._cache[0] == self.epoch:
+            return self._cache
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            pool = order[start:start + self.bucket_size]
+            batches.extend(self._pack(pool[np.argsort(self.lengths[pool], kind="stable")]))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        num_batches = len(batches) // self.num_replicas * self.num_replicas
+        batches = batches[:num_batches]
+        real = sum(int(self.lengths[b].sum()) for b in batches)
+        padded = sum(len(b) * int(self.lengths[b].max()) for b in batches)
+        self._cache = (self.epoch, batches[self.rank::self.num_replicas], real / max(padded, 1))
+        return self._cache
+
+    @property
+    def padding_efficiency(self) -> float:
+        """Real / padded tokens of the current epoch, over all ranks."""
+        return self._epoch_batches()[2]
+
+    def __iter__(self):
+        return iter(self._epoch_batches()[1])
+
+    def __len__(self):
+        return len(self._epoch_batches()[1])
+
+
+def build_dynamic_dataloader(hf_dataset, lengths: List[int], *, accelerator, max_batch_tokens: int,
+                             num_workers: int, latent_cache: Optional[LatentCache] = None, seed: int = 42):
+    if latent_cache is not None:
+        dataset, collate_fn = LatentVoxCPMDataset(hf_dataset, latent_cache), LatentVoxCPMDataset.collate_fn
+    else:
+        dataset, collate_fn = HFVoxCPMDataset(hf_dataset), HFVoxCPMDataset.collate_fn
+    batch_sampler = TokenBudgetBatchSampler(
+        lengths,
+        max_batch_tokens,
+        num_replicas=accelerator.world_size,
+        rank=accelerator.rank,
+        seed=seed,
+    )
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_sampler=batch_sampler,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+        pin_memory=True,
+    )
 
 
 @argbind.bind(without_prefix=True)
@@ -53,6 +371,10 @@ def train(
     warmup_steps: int = 1_000,
     max_steps: int = 100_000,
     max_batch_tokens: int = 0,
+    latent_cache_dir: str = "",  # If set, pre-encode audio-VAE latents here and train without the VAE
+    dynamic_batching: bool = False,  # If True, pack variable-size batches up to max_batch_tokens
+    async_save: bool = True,  # Write periodic checkpoints on a background thread
+    keep_last_n: int = 0,  # Keep only the newest N step_* checkpoints (0 keeps all)
     save_path: str = "checkpoints",
     tensorboard: str = "",
     lambdas: Dict[str, float] = {"loss/diff": 1.0, "loss/stop": 1.0},
@@ -103,22 +425,61 @@ def train(
     dataset_cnt = int(max(train_ds["dataset_id"])) + 1 if "dataset_id" in train_ds.column_names else 1
     num_train_samples = len(train_ds)
 
+    # ------------------------------------------------------------------ #
+    # Optional: pre-encode VAE latents (rank 0 writes, the others wait)
+    # and drop the audio columns so the dataloader never decodes audio
+    # ------------------------------------------------------------------ #
+    train_cache = val_cache = None
+    if latent_cache_dir:
+        cache_root = Path(latent_cache_dir)
+        caches = []
+        for split, ds, manifest in (("train", train_ds, train_manifest), ("val", val_ds, val_manifest)):
+            if ds is None:
+                caches.append(None)
+                continue
+            if accelerator.rank == 0:
+                key = latent_cache_key(manifest, sample_rate, pretrained_path)
+                build_latent_cache(ds, base_model.audio_vae, base_model.config, cache_root / split, key,
+                                   accelerator.device, tracker)
+            accelerator.barrier()
+            caches.append(LatentCache(cache_root / split))
+        train_cache, val_cache = caches
+
+        def use_latents(ds):
+            ds = ds.add_column(LATENT_INDEX_COLUMN, list(range(len(ds))))
+            return ds.remove_columns([c for c in (DEFAULT_AUDIO_COLUMN, DEFAULT_REF_AUDIO_COLUMN) if c in ds.column_names])
+
+        train_ds = use_latents(train_ds)
+        if val_ds is not None:
+            val_ds = use_latents(val_ds)
+
     # ------------------------------------------------------------------ #
     # Optional: filter samples by estimated token count to avoid OOM
     # Enabled when max_batch_tokens > 0:
     #   max_sample_len = max_batch_tokens // batch_size
+    #   (or max_batch_tokens with dynamic_batching, where batches are
+    #   packed up to max_batch_tokens instead of holding batch_size samples)
     #   Samples exceeding this length will be dropped
     # ------------------------------------------------------------------ #
+    if dynamic_batching and not (max_batch_tokens and max_batch_tokens > 0):
+        raise ValueError("max_batch_tokens is required when dynamic_batching=True")
+    train_lengths = None
     if max_batch_tokens and max_batch_tokens > 0:
         from voxcpm.training.data import compute_sample_lengths
 
-        audio_vae_fps = base_model.audio_vae.sample_rate / base_model.audio_vae.hop_length
-        est_lengths = compute_sample_lengths(
-            train_ds,
-            audio_vae_fps=audio_vae_fps,
-            patch_size=base_model.config.patch_size,
-        )
-        max_sample_len = max_batch_tokens // batch_size if batch_size > 0 else max(est_lengths)
+        if train_cache is not None:
+            est_lengths = train_cache.sample_lengths(train_ds, patch_size=base_model.config.patch_size)
+        else:
+            audio_vae_fps = base_model.audio_vae.sample_rate / base_model.audio_vae.hop_length
+            est_lengths = compute_sample_lengths(
+                train_ds,
+                audio_vae_fps=audio_vae_fps,
+                patch_size=base_model.config.patch_size,
+            )
+        if dynamic_batching:
+            max_sample_len = max_batch_tokens
+        else:
+            max_sample_len = max_batch_tokens // batch_size if batch_size > 0 else max(est_lengths)
         keep_indices = [i for i, L in enumerate(est_lengths) if L <= max_sample_len]
 
         if len(keep_indices) < len(train_ds) and accelerator.rank == 0:
@@ -128,33 +489,78 @@ def train(
                 f"(max_batch_tokens={max_batch_tokens})."
             )
         train_ds = train_ds.select(keep_indices)
+        train_lengths = [est_lengths[i] for i in keep_indices]
 
-    train_loader = build_dataloader(
-        train_ds,
-        accelerator=accelerator,
-        batch_size=batch_size,
-        num_workers=num_workers,
-        drop_last=True,
-    )
-    val_loader = (
-        build_dataloader(
-            val_ds,
+    if dynamic_batching:
+        train_loader = build_dynamic_dataloader(
+            train_ds,
+            train_lengths,
+            accelerator=accelerator,
+            max_batch_tokens=max_batch_tokens,
+            num_workers=num_workers,
+            latent_cache=train_cache,
+        )
+    elif train_cache is not None:
+        train_loader = build_latent_dataloader(
+            train_ds,
+            train_cache,
             accelerator=accelerator,
             batch_size=batch_size,
             num_workers=num_workers,
-            drop_last=False,
+            drop_last=True,
+        )
+    else:
+        train_loader = build_dataloader(
+            train_ds,
+            accelerator=accelerator,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            drop_last=True,
         )
-        if val_ds is not None
-        else None
-    )
 
-    batch_processor = BatchProcessor(
-        config=base_model.config,
-        audio_vae=base_model.audio_vae,
-        dataset_cnt=dataset_cnt,
-        device=accelerator.device,
-    )
-    del base_model.audio_vae
+    if train_cache is not None:
+        val_loader = (
+            build_latent_dataloader(
+                val_ds,
+                val_cache,
+                accelerator=accelerator,
+                batch_size=batch_size,
+                num_workers=num_workers,
+                drop_last=False,
+            )
+            if val_ds is not None
+            else None
+        )
+        batch_processor = LatentBatchProcessor(
+            config=base_model.config,
+            dataset_cnt=dataset_cnt,
+            device=accelerator.device,
+            hop_length=base_model.audio_vae.hop_length,
+        )
+        # The VAE is not needed anymore: free it from device memory
+        del base_model.audio_vae
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    else:
+        val_loader = (
+            build_dataloader(
+                val_ds,
+                accelerator=accelerator,
+                batch_size=batch_size,
+                num_workers=num_workers,
+                drop_last=False,
+            )
+            if val_ds is not None
+            else None
+        )
+
+        batch_processor = BatchProcessor(
+            config=base_model.config,
+            audio_vae=base_model.audio_vae,
+            dataset_cnt=dataset_cnt,
+            device=accelerator.device,
+        )
+        del base_model.audio_vae
     model = accelerator.prepare_model(base_model)
     unwrapped_model = accelerator.unwrap(model)
     unwrapped_model.train()
@@ -197,15 +603,18 @@ def train(
     # Resume tracker for signal handler to read current step
     resume = {"step": start_step}
 
+    checkpoint_saver = AsyncCheckpointSaver(save_dir, pretrained_path, hf_model_id, distribute, keep_last_n=keep_last_n)
+
     # Register signal handler to save checkpoint on termination (SIGTERM/SIGINT)
-    def _signal_handler(signum, frame, _model=model, _optim=optimizer, _sched=scheduler, _save_dir=save_dir, _pretrained=pretrained_path, _hf_id=hf_model_id, _dist=distribute, _resume=resume):
+    def _signal_handler(signum, frame, _model=model, _optim=optimizer, _sched=scheduler, _saver=checkpoint_saver, _resume=resume):
         try:
             cur_step = int(_resume.get("step", start_step))
         except Exception:
             cur_step = start_step
         print(f"Signal {signum} received. Saving checkpoint at step {cur_step} ...")
         try:
-            save_checkpoint(_model, _optim, _sched, _save_dir, cur_step, _pretrained, _hf_id, _dist)
+            # finishes a pending background write first
+            _saver.save(_model, _optim, _sched, cur_step, blocking=True)
             print("Checkpoint saved. Exiting.")
         except Exception as e:
             print(f"Error saving checkpoint on signal: {e}")
@@ -217,6 +626,20 @@ def train(
     # Manual epoch management instead of itertools.cycle to support DistributedSampler.set_epoch()
     grad_accum_steps = max(int(grad_accum_steps), 1)
     data_epoch = 0
+    # TokenBudgetBatchSampler is the loader's batch_sampler; DistributedSampler is its sampler
+    batch_sampler = getattr(train_loader, 'batch_sampler', None)
+    dynamic_sampler = batch_sampler if isinstance(batch_sampler, TokenBudgetBatchSampler) else None
+
+    def report_padding_efficiency():
+        if dynamic_sampler is not None:
+            tracker.print(
+                f"Data epoch {data_epoch}: {len(dynamic_sampler)} batches per rank, "
+                f"padding efficiency {dynamic_sampler.padding_efficiency:.2%}"
+            )
+            if writer is not None:
+                writer.add_scalar("train/padding_efficiency", dynamic_sampler.padding_efficiency, data_epoch)
+
+    report_padding_efficiency()
     train_iter = iter(train_loader)
 
     def get_next_batch():
@@ -227,12 +650,17 @@ def train(
         except StopIteration:
             data_epoch += 1
             # Key: set DistributedSampler epoch to ensure different data order each epoch
-            sampler = getattr(train_loader, 'sampler', None)
-            if hasattr(sampler, 'set_epoch'):
-                sampler.set_epoch(data_epoch)
+            for sampler in (getattr(train_loader, 'sampler', None), dynamic_sampler):
+                if hasattr(sampler, 'set_epoch'):
+                    sampler.set_epoch(data_epoch)
+            report_padding_efficiency()
             train_iter = iter(train_loader)
             return next(train_iter)
 
+    # Optimizer steps per second between two logs, to compare data pipelines (e.g. with / without latent_cache_dir)
+    last_log_time = time.perf_counter()
+    last_log_step = start_step
+
     with tracker.live():
         for step in range(start_step, num_iters):
             # update resume step so signal handler can save current progress
@@ -291,19 +719,26 @@ def train(
                 loss_values = {k: v.item() if isinstance(v, torch.Tensor) else float(v) for k, v in loss_dict.items()}
                 loss_values["lr"] = float(optimizer.param_groups[0]["lr"])
                 # Approximate epoch: seen samples / total samples (considering grad_accum and batch_size)
-                epoch = (step * grad_accum_steps * batch_size) / max(1, num_train_samples)
+                if dynamic_sampler is not None:
+                    epoch = (step * grad_accum_steps) / max(1, len(dynamic_sampler))
+                else:
+                    epoch = (step * grad_accum_steps * batch_size) / max(1, num_train_samples)
                 loss_values["epoch"] = float(epoch)
                 loss_values["grad_norm"] = float(grad_norm)
+                now = time.perf_counter()
+                if step > last_log_step:
+                    loss_values["steps_per_sec"] = (step - last_log_step) / (now - last_log_time)
+                last_log_time, last_log_step = now, step
                 tracker.log_metrics(loss_values, split="train")
 
             if val_loader is not None and step % valid_interval == 0 and step != 0:
                 validate(model, val_loader, batch_processor, accelerator, tracker, lambdas)
 
             if step % save_interval == 0 and accelerator.rank == 0:
-                save_checkpoint(model, optimizer, scheduler, save_dir, step, pretrained_path, hf_model_id, distribute)
+                checkpoint_saver.save(model, optimizer, scheduler, step, blocking=not async_save)
 
     if accelerator.rank == 0:
-        save_checkpoint(model, optimizer, scheduler, save_dir, num_iters, pretrained_path, hf_model_id, distribute)
+        checkpoint_saver.save(model, optimizer, scheduler, num_iters, blocking=True)
     if writer:
         writer.close()
 
@@ -416,84 +851,174 @@ def load_checkpoint(model, optimizer, scheduler, save_dir: Path):
     return 0
 
 
-def save_checkpoint(model, optimizer, scheduler, save_dir: Path, step: int, pretrained_path: str = None, hf_model_id: str = "", distribute: bool = False):
+def _to_cpu(obj):
+    """Recursively copy every tensor in `obj` to CPU memory, so it can be written while training goes on."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def snapshot_checkpoint(model, optimizer, scheduler, pretrained_path: str = None, hf_model_id: str = "", distribute: bool = False) -> dict:
     """
-    Save checkpoint with different strategies for full finetune vs LoRA:
-    - Full finetune: save non-vae weights to model.safetensors (or pytorch_model.bin if safetensors unavailable)
-    - LoRA: save only lora weights to lora_weights.safetensors (or lora_weights.ckpt if safetensors unavailable)
+    Copy everything `write_checkpoint` needs to CPU memory:
+    - Full finetune: non-vae weights
+    - LoRA: only lora weights, plus the LoRA config and base model
     """
-    import shutil
-    
-    save_dir.mkdir(parents=True, exist_ok=True)
-    tag = "latest" if step == 0 else f"step_{step:07d}"
-    folder = save_dir / tag
-    folder.mkdir(parents=True, exist_ok=True)
-    
     unwrapped = model.module if hasattr(model, "module") else model
     full_state = unwrapped.state_dict()
     lora_cfg = unwrapped.lora_config
-    
+
+    snapshot = {"lora_info": None, "pretrained_path": pretrained_path}
     if lora_cfg is not None:
         # LoRA finetune: save only lora_A/lora_B weights
-        state_dict = {k: v for k, v in full_state.items() if "lora_" in k}
-        if SAFETENSORS_AVAILABLE:
-            save_file(state_dict, folder / "lora_weights.safetensors")
-        else:
-            torch.save({"state_dict": state_dict}, folder / "lora_weights.ckpt")
-        
-        # Save LoRA config and base model path to a separate JSON file
+        snapshot["state_dict"] = _to_cpu({k: v for k, v in full_state.items() if "lora_" in k})
         # If distribute=True, save hf_model_id; otherwise save local pretrained_path
-        import json
         base_model_to_save = hf_model_id if distribute else (str(pretrained_path) if pretrained_path else None)
-        lora_info = {
+        snapshot["lora_info"] = {
             "base_model": base_model_to_save,
-            "lora_config": lora_cfg.model_dump() if hasattr(lora_cfg, "model_dump") else vars(lora_cfg),
+            "lora_config": lora_cfg.model_dump() if hasattr(lora_cfg, "model_dump") else dict(vars(lora_cfg)),
         }
-        with open(folder / "lora_config.json", "w", encoding="utf-8") as f:
-            json.dump(lora_info, f, indent=2, ensure_ascii=False)
     else:
-        # Full finetune: save non-vae weights to model.safetensors
-        state_dict = {k: v for k, v in full_state.items() if not k.startswith("audio_vae.")}
+        snapshot["state_dict"] = _to_cpu({k: v for k, v in full_state.items() if not k.startswith("audio_vae.")})
+    snapshot["optimizer"] = _to_cpu(optimizer.state_dict())
+    snapshot["scheduler"] = _to_cpu(scheduler.state_dict())
+    return snapshot
+
+
+def write_checkpoint(snapshot: dict, save_dir: Path, step: int, keep_last_n: int = 0):
+    """
+    Write a `snapshot_checkpoint` snapshot to `save_dir/step_XXXXXXX`:
+    - Full finetune: model.safetensors (or pytorch_model.bin if safetensors unavailable) + config files
+    - LoRA: lora_weights.safetensors (or lora_weights.ckpt if safetensors unavailable) + lora_config.json
+
+    Files go to a hidden temporary folder that is renamed once complete, so a crash never leaves a
+    partial `step_*` folder; then `latest` is repointed and all but the `keep_last_n` newest
+    checkpoints are removed (0 keeps all).
+    """
+    import shutil
+
+    save_dir.mkdir(parents=True, exist_ok=True)
+    tag = f"step_{step:07d}"
+    folder = save_dir / tag
+    tmp_folder = save_dir / f".{tag}.tmp"
+    if tmp_folder.exists():
+        shutil.rmtree(tmp_folder)
+    tmp_folder.mkdir(parents=True)
+
+    state_dict = snapshot["state_dict"]
+    if snapshot["lora_info"] is not None:
+        if SAFETENSORS_AVAILABLE:
+            save_file(state_dict, tmp_folder / "lora_weights.safetensors")
+        else:
+            torch.save({"state_dict": state_dict}, tmp_folder / "lora_weights.ckpt")
+        # Save LoRA config and base model path to a separate JSON file
+        with open(tmp_folder / "lora_config.json", "w", encoding="utf-8") as f:
+            json.dump(snapshot["lora_info"], f, indent=2, ensure_ascii=False)
+    else:
         if SAFETENSORS_AVAILABLE:
-            save_file(state_dict, folder / "model.safetensors")
+            save_file(state_dict, tmp_folder / "model.safetensors")
         else:
-            torch.save({"state_dict": state_dict}, folder / "pytorch_model.bin")
-        
+            torch.save({"state_dict": state_dict}, tmp_folder / "pytorch_model.bin")
+
         # Copy config files from pretrained path
-        if pretrained_path:
-            pretrained_dir = Path(pretrained_path)
+        if snapshot["pretrained_path"]:
+            pretrained_dir = Path(snapshot["pretrained_path"])
             files_to_copy = ["config.json", "audiovae.pth", "tokenizer.json", "special_tokens_map.json", "tokenizer_config.json"]
             for fname in files_to_copy:
                 src = pretrained_dir / fname
                 if src.exists():
-                    shutil.copy2(src, folder / fname)
-    
-    torch.save(optimizer.state_dict(), folder / "optimizer.pth")
-    torch.save(scheduler.state_dict(), folder / "scheduler.pth")
+                    shutil.copy2(src, tmp_folder / fname)
+
+    torch.save(snapshot["optimizer"], tmp_folder / "optimizer.pth")
+    torch.save(snapshot["scheduler"], tmp_folder / "scheduler.pth")
 
-    # Update (or create) a `latest` symlink pointing to the most recent checkpoint folder
+    if folder.exists():
+        shutil.rmtree(folder)
+    os.replace(tmp_folder, folder)
+
+    # Update (or create) a `latest` symlink pointing to the most recent checkpoint folder.
+    # The link is relative to save_dir and swapped in with a rename, so `latest` is never missing.
     latest_link = save_dir / "latest"
     try:
-        if latest_link.exists() or latest_link.is_symlink():
-            # remove existing link or directory
-            if latest_link.is_dir() and not latest_link.is_symlink():
-                shutil.rmtree(latest_link)
-            else:
-                latest_link.unlink()
-        # Create a symlink pointing to the new folder
-        os.symlink(str(folder), str(latest_link))
+        tmp_link = save_dir / ".latest.tmp"
+        if tmp_link.is_symlink() or tmp_link.exists():
+            tmp_link.unlink()
+        os.symlink(tag, str(tmp_link))
+        if latest_link.is_dir() and not latest_link.is_symlink():
+            shutil.rmtree(latest_link)
+        os.replace(tmp_link, latest_link)
     except Exception:
         # If symlink creation fails (e.g., on Windows or permission issues), fall back to copying
         try:
-            if latest_link.exists():
-                if latest_link.is_dir():
-                    shutil.rmtree(latest_link)
-                else:
-                    latest_link.unlink()
-            shutil.copytree(folder, latest_link)
+            tmp_copy = save_dir / ".latest_copy.tmp"
+            if tmp_copy.exists():
+                shutil.rmtree(tmp_copy)
+            shutil.copytree(folder, tmp_copy)
+            if latest_link.is_dir() and not latest_link.is_symlink():
+                shutil.rmtree(latest_link)
+            elif latest_link.exists() or latest_link.is_symlink():
+                latest_link.unlink()
+            os.replace(tmp_copy, latest_link)
         except Exception:
             print(f"Warning: failed to update latest checkpoint link at {latest_link}")
 
+    # Retention: keep the newest keep_last_n step folders
+    if keep_last_n and keep_last_n > 0:
+        step_folders = sorted(d for d in save_dir.iterdir() if d.is_dir() and not d.is_symlink() and d.name.startswith("step_"))
+        for old in step_folders[:-keep_last_n]:
+            if old != folder:
+                shutil.rmtree(old, ignore_errors=True)
+
+
+def save_checkpoint(model, optimizer, scheduler, save_dir: Path, step: int, pretrained_path: str = None, hf_model_id: str = "", distribute: bool = False, keep_last_n: int = 0):
+    """
+    Save checkpoint with different strategies for full finetune vs LoRA, blocking until it is on disk.
+    See `write_checkpoint` for the layout.
+    """
+    write_checkpoint(snapshot_checkpoint(model, optimizer, scheduler, pretrained_path, hf_model_id, distribute), save_dir, step, keep_last_n)
+
+
+class AsyncCheckpointSaver:
+    """
+    Non-blocking `save_checkpoint`: the training thread only snapshots the states to CPU memory, the
+    files are written by a background thread. At most one write is in flight; a new `save` first waits
+    for the previous one, which bounds the extra host memory to one snapshot.
+    """
+
+    def __init__(self, save_dir: Path, pretrained_path: str = None, hf_model_id: str = "", distribute: bool = False, keep_last_n: int = 0):
+        self.save_dir = save_dir
+        self.pretrained_path = pretrained_path
+        self.hf_model_id = hf_model_id
+        self.distribute = distribute
+        self.keep_last_n = keep_last_n
+        self._thread: Optional[threading.Thread] = None
+
+    def _write(self, snapshot: dict, step: int):
+        try:
+            write_checkpoint(snapshot, self.save_dir, step, self.keep_last_n)
+        except Exception as e:
+            print(f"Error saving checkpoint at step {step}: {e}")
+
+    def save(self, model, optimizer, scheduler, step: int, blocking: bool = False):
+        # wait before snapshotting, so the previous snapshot is released before the next one is taken
+        self.wait()
+        snapshot = snapshot_checkpoint(model, optimizer, scheduler, self.pretrained_path, self.hf_model_id, self.distribute)
+        if blocking:
+            self._write(snapshot, step)
+            return
+        self._thread = threading.Thread(target=self._write, args=(snapshot, step), name=f"checkpoint-{step}", daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """Block until the pending write (if any) is on disk."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
 
 if __name__ == "__main__":
     from voxcpm.training.config import load_yaml_config
@@ -1,9 +1,24 @@
-from .accel_engine import AccelInferenceEngine  # noqa: F401
-from .attention import (  # noqa: F401
-    Attention,
-    get_forward_context,
-    reset_forward_context,
-    set_forward_context,
-)
-from .gpt2_accel import GPT2AccelAttention, GPT2AccelModel  # noqa: F401
+import importlib
+
 from .kv_manager import KVCacheManager, Seq  # noqa: F401
+
+# attribute -> submodule; these need flash_attn, so they are only imported on first use and
+# `indextts.accel.kv_manager` stays importable without it
+_LAZY_ATTRIBUTES = {
+    "AccelInferenceEngine": ".accel_engine",
+    "Attention": ".attention",
+    "get_forward_context": ".attention",
+    "reset_forward_context": ".attention",
+    "set_forward_context": ".attention",
+    "GPT2AccelAttention": ".gpt2_accel",
+    "GPT2AccelModel": ".gpt2_accel",
+}
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
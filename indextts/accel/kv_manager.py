@@ -1,8 +1,5 @@
-import hashlib
-import pickle
 from collections import deque
-from copy import copy
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 import torch
 
@@ -13,30 +10,54 @@ class KVCacheBlock:
         self.ref_cnt = 0
         self._block_hash = None
         self.token_ids = []
+        # (block_id, version) of the block this one was hashed after, None for a first block
+        self.parent: Optional[Tuple[int, int]] = None
+        # bumped on every reuse, so a stale `parent` of a child block no longer matches
+        self.version = 0
 
     @property
-    def block_hash(self) -> Optional[bytes]:
+    def block_hash(self) -> Optional[int]:
         return self._block_hash
 
-    def update(self, block_hash: bytes, token_ids: List[int]):
+    @property
+    def key(self) -> Tuple[int, int]:
+        return self.block_id, self.version
+
+    def update(self, block_hash: int, token_ids: List[int], parent: Optional[Tuple[int, int]] = None):
         self._block_hash = block_hash
         self.token_ids = token_ids
+        self.parent = parent
 
     def reset(self):
         self.ref_cnt = 1
         self._block_hash = None
         self.token_ids = []
+        self.parent = None
+        self.version += 1
+
+
+def hash_block(token_ids: Sequence[int], parent_hash: Optional[int] = None) -> int:
+    """Chained hash of one full block: the parent block hash folded with the
+    block tokens. It is only a 64-bit lookup key, so a hit is not
+    trusted on its own: KVCacheManager.allocate also compares the block
+    tokens and the parent block the cached block was hashed after, which
+    makes a reused prefix exact even when two prefixes collide."""
+    return hash((parent_hash if parent_hash is not None else 0, tuple(token_ids)))
 
 
 class Seq:
-    def __init__(self, token_ids: List[int], block_size: int = 256):
-        self.token_ids = copy(token_ids)
-        self.last_token = token_ids[-1] if token_ids else 0
+    def __init__(self, token_ids: Sequence[int], block_size: int = 256):
+        self.token_ids = list(token_ids)
+        self.last_token = self.token_ids[-1] if self.token_ids else 0
         self.num_tokens = len(self.token_ids)
-        self.num_prompt_tokens = len(token_ids)
+        self.num_prompt_tokens = self.num_tokens
         self.num_cached_tokens = 0
         self.block_table: List[int] = []
         self.block_size = block_size
+        # hashes of the full blocks, extended as blocks fill up
+        self.block_hashes: List[int] = []
+        for _ in range(self.num_tokens // block_size):
+            self._hash_next_block()
 
     def __len__(self):
         return self.num_tokens
@@ -62,10 +83,25 @@ class Seq:
         end = start + self.block_size
         return self.token_ids[start:end]
 
+    def get_block_hash(self, block_idx: int) -> Optional[int]:
+        """Hash of block `block_idx`, or None if the block is not full yet."""
+        if block_idx < len(self.block_hashes):
+            return self.block_hashes[block_idx]
+        return None
+
+    def _hash_next_block(self):
+        block_idx = len(self.block_hashes)
+        parent_hash = self.block_hashes[-1] if self.block_hashes else None
+        self.block_hashes.append(
+            hash_block(self.get_block_tokens(block_idx), parent_hash)
+        )
+
     def append_token(self, token_id: int):
         self.token_ids.append(token_id)
         self.last_token = token_id
         self.num_tokens += 1
+        if self.num_tokens % self.block_size == 0:
+            self._hash_next_block()
 
 
 class KVCacheManager:
@@ -86,7 +122,7 @@ class KVCacheManager:
         self.dtype = dtype
 
         self.blocks: List[KVCacheBlock] = [KVCacheBlock(i) for i in range(num_blocks)]
-        self.block_hash_to_id: Dict[bytes, int] = {}
+        self.block_hash_to_id: Dict[int, int] = {}
         self.free_block_ids: deque = deque(range(num_blocks))
         self.used_block_ids: Set[int] = set()
 
@@ -105,14 +141,9 @@ class KVCacheManager:
 
     @classmethod
     def compute_block_hash(
-        cls, token_ids: List[int], parent_hash: Optional[bytes] = None
-    ) -> bytes:
-        hash_input = []
-        if parent_hash is not None:
-            hash_input.append(parent_hash)
-        hash_input.extend(token_ids)
-        input_bytes = pickle.dumps(tuple(hash_input), protocol=pickle.HIGHEST_PROTOCOL)
-        return hashlib.sha256(input_bytes).digest()
+        cls, token_ids: Sequence[int], parent_hash: Optional[int] = None
+    ) -> int:
+        return hash_block(token_ids, parent_hash)
 
     def _allocate_block(self, block_id: int) -> KVCacheBlock:
         block = self.blocks[block_id]
@@ -130,19 +161,24 @@ class KVCacheManager:
     def allocate(self, sequence: Seq):
         assert not sequence.block_table, "Sequence already has allocated blocks"
 
-        parent_hash = None
         cache_miss = False
 
+        parent = None
         for i in range(sequence.num_blocks):
             token_ids = sequence.get_block_tokens(i)
-            block_hash = (
-                self.compute_block_hash(token_ids, parent_hash)
-                if len(token_ids) == self.block_size
+            block_hash = sequence.get_block_hash(i)
+            block_id = (
+                self.block_hash_to_id.get(block_hash)
+                if block_hash is not None
                 else None
             )
-            block_id = self.block_hash_to_id.get(block_hash) if block_hash else None
 
-            if block_id is None or self.blocks[block_id].token_ids != token_ids:
+            # a hit needs the same tokens after the same (already verified) parent block
+            if (
+                block_id is None
+                or self.blocks[block_id].token_ids != token_ids
+                or self.blocks[block_id].parent != parent
+            ):
                 cache_miss = True
 
             if cache_miss:
@@ -158,9 +194,9 @@ class KVCacheManager:
                     block = self._allocate_block(block_id)
 
             if block_hash is not None:
-                block.update(block_hash, token_ids)
+                block.update(block_hash, token_ids, parent)
                 self.block_hash_to_id[block_hash] = block_id
-                parent_hash = block_hash
+            parent = block.key
 
             sequence.block_table.append(block_id)
 
@@ -177,22 +213,19 @@ class KVCacheManager:
     def append_to_seq(self, sequence: Seq):
         block_table = sequence.block_table
         last_block = self.blocks[block_table[-1]]
+        num_block_tokens = sequence.num_tokens % self.block_size
 
-        if len(sequence) % self.block_size == 1:
+        if num_block_tokens == 1:
             assert last_block.block_hash is not None
             block_id = self.free_block_ids[0]
             self._allocate_block(block_id)
             block_table.append(block_id)
-        elif len(sequence) % self.block_size == 0:
+        elif num_block_tokens == 0:
             assert last_block.block_hash is None
             token_ids = sequence.get_block_tokens(sequence.num_blocks - 1)
-            parent_hash = (
-                self.blocks[block_table[-2]].block_hash
-                if len(block_table) > 1
-                else None
-            )
-            block_hash = self.compute_block_hash(token_ids, parent_hash)
-            last_block.update(block_hash, token_ids)
+            block_hash = sequence.block_hashes[-1]
+            parent = self.blocks[block_table[-2]].key if len(block_table) > 1 else None
+            last_block.update(block_hash, token_ids, parent)
             self.block_hash_to_id[block_hash] = last_block.block_id
         else:
             assert last_block.block_hash is None
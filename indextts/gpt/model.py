@@ -1,4 +1,5 @@
 import functools
+import inspect
 
 import torch
 import torch.nn as nn
@@ -9,6 +10,7 @@ from transformers import GPT2Config, LogitsProcessorList
 from indextts.gpt.transformers_gpt2 import GPT2PreTrainedModel, GPT2Model
 
 # from transformers import GPT2Config, GPT2PreTrainedModel, LogitsProcessorList
+from transformers.cache_utils import StaticCache
 from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
@@ -43,7 +45,7 @@ class ResBlock(nn.Module):
 
 
 class GPT2InferenceModel(GPT2PreTrainedModel):
-    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False):
+    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False, static_kv_cache=False):
         super().__init__(config)
         # Note: the argument named `text_pos_emb` here actually represents the mel position embedding
         self.transformer = gpt
@@ -52,6 +54,13 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.final_norm = norm
         self.lm_head = nn.Sequential(norm, linear)
         self.kv_cache = kv_cache
+        # write keys/values into a preallocated `StaticCache` instead of growing them with torch.cat,
+        # only possible if the transformers GPT2Model takes `cache_position`
+        self.static_kv_cache = kv_cache and static_kv_cache and \
+            "cache_position" in inspect.signature(gpt.forward).parameters
+        self.static_cache_length = None
+        self._static_cache = None
+        self._static_cache_key = None
 
         # Model parallel
         self.model_parallel = False
@@ -87,12 +96,38 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def set_static_cache_length(self, max_length):
+        """Size of the static kv cache for the next `generate` call, i.e. its `max_length`."""
+        self.static_cache_length = max_length
+
+    def reset_static_cache(self, batch_size, prefix_length, device):
+        """Return an empty `StaticCache` for a new generation, reusing the previous buffers when they fit."""
+        max_length = max(self.static_cache_length or self.config.n_positions, prefix_length + 1)
+        dtype = self.embeddings.weight.dtype
+        key = (batch_size, max_length, dtype, str(device))
+        if self._static_cache is not None and self._static_cache_key == key:
+            self._static_cache.reset()
+        else:
+            self._static_cache = StaticCache(config=self.config, max_batch_size=batch_size, max_cache_len=max_length,
+                                             device=device, dtype=dtype)
+            self._static_cache_key = key
+        return self._static_cache
+
+    def clear_static_cache(self):
+        self._static_cache = None
+        self._static_cache_key = None
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
             past_key_values = None
+        has_past = past_key_values is not None
+        use_static_cache = self.kv_cache and self.static_kv_cache
+        if use_static_cache and not has_past:
+            # first step of a new generation: the prompt fills the rewound buffers in one go
+            past_key_values = self.reset_static_cache(input_ids.shape[0], input_ids.shape[1], input_ids.device)
         # only last token for inputs_ids if past is defined in kwargs
-        if past_key_values:
+        if has_past:
             input_ids = input_ids[:, -1].unsqueeze(-1)
             if token_type_ids is not None:
                 token_type_ids = token_type_ids[:, -1].unsqueeze(-1)
@@ -104,13 +139,19 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             # create position_ids on the fly for batch generation
             position_ids = attention_mask.long().cumsum(-1) - 1
             position_ids.masked_fill_(attention_mask == 0, 0)
-            if past_key_values:
+            if has_past:
                 position_ids = position_ids[:, -1].unsqueeze(-1)
         else:
             position_ids = None
+        cache_position = None
+        if use_static_cache and attention_mask is not None:
+            # slots of the static cache written by this step
+            total_length = attention_mask.shape[1]
+            cache_position = torch.arange(total_length - input_ids.shape[1], total_length, device=input_ids.device)
         return {
             "input_ids": input_ids,
             "past_key_values": past_key_values,
+            "cache_position": cache_position,
             "use_cache": kwargs.get("use_cache"),
             "position_ids": position_ids,
             "attention_mask": attention_mask,
@@ -133,6 +174,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             output_attentions=None,
             output_hidden_states=None,
             return_dict=None,
+            cache_position=None,
     ):
         assert self.cached_mel_emb is not None
         assert inputs_embeds is None  # Not supported by this inference model.
@@ -155,9 +197,15 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             emb = torch.cat([mel_emb, text_emb], dim=1)
         else:
             emb = self.embeddings(input_ids)
-            emb = emb + self.text_pos_embedding.get_fixed_embedding(
-                attention_mask.shape[1] - mel_len, attention_mask.device
-            )
+            if cache_position is not None:
+                # same mel positions as the uncached forward above: [start_mel_token] is at 0
+                emb = emb + self.text_pos_embedding.emb(cache_position - mel_len).unsqueeze(0)
+            else:
+                emb = emb + self.text_pos_embedding.get_fixed_embedding(
+                    attention_mask.shape[1] - mel_len, attention_mask.device
+                )
+        # only passed for the static cache, older transformers GPT2Model do not take it
+        cache_kwargs = {} if cache_position is None else {"cache_position": cache_position}
         transformer_outputs = self.transformer(
             inputs_embeds=emb,
             past_key_values=past_key_values,
@@ -171,6 +219,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             output_attentions=output_attentions,
             output_hidden_states=output_hidden_states,
             return_dict=return_dict,
+            **cache_kwargs,
         )
         hidden_states = transformer_outputs[0]
 
@@ -390,7 +439,7 @@ class UnifiedVoice(nn.Module):
         for module in embeddings:
             module.weight.data.normal_(mean=0.0, std=.02)
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, static_kv_cache=False):
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -410,6 +459,7 @@ class UnifiedVoice(nn.Module):
             self.final_norm,
             self.mel_head,
             kv_cache=kv_cache,
+            static_kv_cache=static_kv_cache,
         )
         if use_deepspeed and half and torch.cuda.is_available():
             import deepspeed
@@ -464,13 +514,14 @@ class UnifiedVoice(nn.Module):
                 text_input_tokens[b, actual_end:] = self.stop_text_token
         return text_input_tokens
 
-    def get_logits(self, speech_conditioning_inputs, first_inputs, first_head, second_inputs=None, second_head=None, get_attns=False, return_latent=False):
+    def get_logits(self, speech_conditioning_inputs, first_inputs, first_head, second_inputs=None, second_head=None, get_attns=False, return_latent=False,
+                   attention_mask=None):
         if second_inputs is not None:
             emb = torch.cat([speech_conditioning_inputs, first_inputs, second_inputs], dim=1)
         else:
             emb = torch.cat([speech_conditioning_inputs, first_inputs], dim=1)
 
-        gpt_out = self.gpt(inputs_embeds=emb, return_dict=True, output_attentions=get_attns)
+        gpt_out = self.gpt(inputs_embeds=emb, attention_mask=attention_mask, return_dict=True, output_attentions=get_attns)
         if get_attns:
             return gpt_out.attentions
 
@@ -525,7 +576,7 @@ class UnifiedVoice(nn.Module):
 
     def forward(self, speech_conditioning_latent, text_inputs, text_lengths, mel_codes, wav_lengths,
                 cond_mel_lengths=None, types=None, text_first=True, raw_mels=None, return_attentions=False,
-                return_latent=False, clip_inputs=False):
+                return_latent=False, clip_inputs=False, mask_text_padding=False):
         """
         Forward pass that uses both text and voice in either text conditioning mode or voice conditioning mode
         (actuated by `text_first`).
@@ -540,6 +591,8 @@ class UnifiedVoice(nn.Module):
         If return_attentions is specified, only logits are returned.
         If return_latent is specified, loss & logits are not computed or returned. Only the predicted latents are returned.
         If clip_inputs is True, the inputs will be clipped to the smallest input size across each input modality.
+        If mask_text_padding is True, the stop tokens padding the text of shorter items are hidden from attention, so
+        a padded batch gives the same outputs as running the items one by one.
         """
 
         speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent, cond_mel_lengths)
@@ -576,9 +629,20 @@ class UnifiedVoice(nn.Module):
         mel_emb = self.mel_embedding(mel_inp)
         mel_emb = mel_emb + self.mel_pos_embedding(mel_codes)
 
+        attention_mask = None
+        if mask_text_padding and text_first:
+            # keep [start_text_token] + text + [stop_text_token] of each item, hide the remaining stop tokens
+            text_mask = torch.arange(text_emb.shape[1], device=text_emb.device)[None, :] < (text_lengths[:, None] + 2)
+            attention_mask = torch.cat([
+                text_mask.new_ones((text_mask.shape[0], conds.shape[1])),
+                text_mask,
+                text_mask.new_ones((text_mask.shape[0], mel_emb.shape[1])),
+            ], dim=1).long()
+
         if text_first:
             # print(f"conds: {conds.shape}, text_emb: {text_emb.shape}, mel_emb: {mel_emb.shape}")
-            text_logits, mel_logits = self.get_logits(conds, text_emb, self.text_head, mel_emb, self.mel_head, get_attns=return_attentions, return_latent=return_latent)
+            text_logits, mel_logits = self.get_logits(conds, text_emb, self.text_head, mel_emb, self.mel_head, get_attns=return_attentions, return_latent=return_latent,
+                                                      attention_mask=attention_mask)
             if return_latent:
                 return mel_logits[:, :-2]  # Despite the name, these are not logits. Strip off the two tokens added by this forward pass.
         else:
@@ -700,6 +764,7 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
+        self.inference_model.set_static_cache_length(max_length)
         output = self.inference_model.generate(inputs, 
                                             bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
                                             eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
@@ -1,3 +1,4 @@
+import copy
 import functools
 
 import torch
@@ -19,6 +20,41 @@ from indextts.utils.arch_util import AttentionBlock
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
+def _warp_logits(logits, top_k=None, top_p=None, temperature=1.0):
+    """Temperature, top-k and top-p filtering, in the order `generate()` applies its logits warpers."""
+    if temperature is not None and temperature != 1.0:
+        logits = logits / temperature
+    if top_k is not None and top_k > 0:
+        top_k = min(top_k, logits.size(-1))
+        kth_logits = torch.topk(logits, top_k)[0][..., -1, None]
+        logits = logits.masked_fill(logits < kth_logits, -float("inf"))
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits, descending=False)
+        cumulative_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        sorted_to_remove = cumulative_probs <= (1 - top_p)
+        sorted_to_remove[..., -1:] = False  # keep at least one token
+        to_remove = sorted_to_remove.scatter(1, sorted_indices, sorted_to_remove)
+        logits = logits.masked_fill(to_remove, -float("inf"))
+    return logits
+
+
+def _next_token_probs(logits, seen, do_sample=True, top_k=None, top_p=None, temperature=1.0, repetition_penalty=1.0):
+    """Next-token distribution after the repetition penalty and logits warpers, one-hot for greedy search."""
+    if repetition_penalty is not None and repetition_penalty != 1.0:
+        penalized = torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty)
+        logits = torch.where(seen, penalized, logits)
+    if not do_sample:
+        return F.one_hot(logits.argmax(dim=-1), logits.size(-1)).to(logits.dtype)
+    return F.softmax(_warp_logits(logits, top_k=top_k, top_p=top_p, temperature=temperature), dim=-1)
+
+
+def _crop_past(past_key_values, length, num_layers=None):
+    """Keep the first `length` cached positions (of the first `num_layers` layers) of a kv cache."""
+    if not isinstance(past_key_values, tuple):
+        past_key_values = past_key_values.to_legacy_cache()
+    return tuple((k[:, :, :length], v[:, :, :length]) for k, v in past_key_values[:num_layers])
+
+
 def null_position_embeddings(range, dim):
     return torch.zeros((range.shape[0], range.shape[1], dim), device=range.device)
 
@@ -57,6 +93,9 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        # (draft_layers, GPT2InferenceModel) used by `speculative_generate`, kept out of the module tree
+        self._draft_model = None
+        self.speculative_stats = None
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -87,6 +126,180 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    @torch.no_grad()
+    def fast_generate(self, input_ids, attention_mask, max_length, stop_token, do_sample=True, top_k=None,
+                      top_p=None, temperature=1.0, repetition_penalty=1.0, num_return_sequences=1,
+                      logits_processor=None):
+        """
+        Beam-free decoding loop used instead of `generate()`: top-k / top-p / temperature sampling (or greedy
+        search when `do_sample=False`), repetition penalty and early stop once every sequence emitted `stop_token`.
+        The logits warpers follow the transformers implementations, so a seeded run matches `generate()` with
+        `num_beams=1`.
+
+        Returns:
+            (b * num_return_sequences, L) token ids including the prompt, right padded with `stop_token`.
+        """
+        if num_return_sequences > 1:
+            input_ids = input_ids.repeat_interleave(num_return_sequences, dim=0)
+            attention_mask = attention_mask.repeat_interleave(num_return_sequences, dim=0)
+        batch_size, prompt_len = input_ids.shape
+        sequences = input_ids.new_full((batch_size, max_length), stop_token)
+        sequences[:, :prompt_len] = input_ids
+        # the attention mask only grows by ones, every step uses a view of this buffer
+        full_attention_mask = attention_mask.new_ones((batch_size, max_length))
+        full_attention_mask[:, :prompt_len] = attention_mask
+        unfinished = torch.ones(batch_size, dtype=torch.bool, device=input_ids.device)
+        use_penalty = repetition_penalty is not None and repetition_penalty != 1.0
+        seen = None  # [b, vocab] tokens already in the sequence, for the repetition penalty
+        past_key_values = None
+        cur_len = prompt_len
+        while cur_len < max_length:
+            model_inputs = self.prepare_inputs_for_generation(
+                sequences[:, :cur_len],
+                past_key_values=past_key_values,
+                attention_mask=full_attention_mask[:, :cur_len],
+                use_cache=True,
+            )
+            outputs = self(**model_inputs, return_dict=True)
+            past_key_values = outputs.past_key_values
+            logits = outputs.logits[:, -1, :].float()
+            if seen is None:
+                seen = torch.zeros_like(logits, dtype=torch.bool)
+                seen.scatter_(1, input_ids, True)
+            if use_penalty:
+                penalized = torch.where(logits < 0, logits * repetition_penalty, logits / repetition_penalty)
+                logits = torch.where(seen, penalized, logits)
+            if logits_processor:
+                logits = logits_processor(sequences[:, :cur_len], logits)
+            if do_sample:
+                logits = _warp_logits(logits, top_k=top_k, top_p=top_p, temperature=temperature)
+                next_tokens = torch.multinomial(F.softmax(logits, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(logits, dim=-1)
+            next_tokens.masked_fill_(~unfinished, stop_token)
+            sequences[:, cur_len] = next_tokens
+            seen.scatter_(1, next_tokens.unsqueeze(1), True)
+            cur_len += 1
+            unfinished &= next_tokens != stop_token
+            if not unfinished.any():
+                break
+        return sequences[:, :cur_len]
+
+    def get_draft_model(self, draft_layers):
+        """
+        Inference model running only the first `draft_layers` transformer blocks (plus the final norms and
+        head), sharing all weights with this model. Its kv cache equals the first layers of the full cache.
+        """
+        if self._draft_model is not None and self._draft_model[0] == draft_layers:
+            return self._draft_model[1]
+        num_layers = len(self.transformer.h)
+        if not 0 < draft_layers < num_layers:
+            raise ValueError(f"`draft_layers` must be in [1, {num_layers - 1}], but is {draft_layers}")
+        draft_gpt = copy.copy(self.transformer)
+        draft_gpt._modules = self.transformer._modules.copy()
+        draft_gpt.h = nn.ModuleList(self.transformer.h[:draft_layers])
+        draft_gpt.config = copy.copy(self.transformer.config)
+        draft_gpt.config.n_layer = draft_layers
+        draft = GPT2InferenceModel(
+            self.config, draft_gpt, self.text_pos_embedding, self.embeddings, self.final_norm, self.lm_head[1],
+            kv_cache=True,
+        )
+        self._draft_model = (draft_layers, draft)
+        return draft
+
+    @torch.no_grad()
+    def speculative_generate(self, input_ids, attention_mask, max_length, stop_token, draft_layers,
+                             num_draft_tokens=4, do_sample=True, top_k=None, top_p=None, temperature=1.0,
+                             repetition_penalty=1.0):
+        """
+        Speculative decoding of a single sequence: the model truncated to its first `draft_layers` blocks
+        proposes `num_draft_tokens` tokens, the full model scores them in one forward pass and keeps them
+        with the usual min(1, p/q) acceptance rule, resampling the first rejected one from max(0, p - q).
+        The sampled sequence follows the same distribution as `fast_generate`; greedy search (`do_sample=False`)
+        gives identical tokens.
+
+        The accepted / proposed draft token counts are left in `self.speculative_stats`.
+
+        Returns:
+            (1, L) token ids including the prompt.
+        """
+        assert input_ids.shape[0] == 1, "speculative decoding only supports a single sequence"
+        draft = self.get_draft_model(draft_layers)
+        draft.store_mel_emb(self.cached_mel_emb)
+        next_token_probs = functools.partial(
+            _next_token_probs, do_sample=do_sample, top_k=top_k, top_p=top_p, temperature=temperature,
+            repetition_penalty=repetition_penalty,
+        )
+        prompt_len = input_ids.shape[1]
+        sequences = input_ids.new_full((1, max_length), stop_token)
+        sequences[:, :prompt_len] = input_ids
+        full_attention_mask = attention_mask.new_ones((1, max_length))
+        full_attention_mask[:, :prompt_len] = attention_mask
+
+        outputs = self(input_ids, attention_mask=attention_mask, use_cache=True, return_dict=True)
+        past_key_values = outputs.past_key_values
+        logits = outputs.logits[:, -1, :].float()
+        seen = torch.zeros_like(logits, dtype=torch.bool)
+        seen.scatter_(1, input_ids, True)
+        # `token` is the newest token: already in `sequences` but not yet in the kv cache
+        token = torch.multinomial(next_token_probs(logits, seen), num_samples=1)
+        sequences[:, prompt_len] = token
+        cur_len = prompt_len + 1
+        proposed = accepted = 0
+        while token.item() != stop_token and cur_len < max_length:
+            seen.scatter_(1, token, True)
+            num_draft = min(num_draft_tokens, max_length - cur_len - 1)
+            # draft: the first layers of the full kv cache are exactly the draft model's cache
+            draft_past = _crop_past(past_key_values, cur_len - 1, draft_layers)
+            draft_tokens, draft_probs, step_seen = [], [], [seen]
+            last = token
+            for i in range(num_draft):
+                outputs = draft(last, past_key_values=draft_past, attention_mask=full_attention_mask[:, :cur_len + i],
+                                use_cache=True, return_dict=True)
+                draft_past = outputs.past_key_values
+                q = next_token_probs(outputs.logits[:, -1, :].float(), step_seen[-1])
+                last = torch.multinomial(q, num_samples=1)
+                draft_tokens.append(last)
+                draft_probs.append(q)
+                step_seen.append(step_seen[-1].scatter(1, last, True))
+
+            # verify: one full forward over the newest token and every draft token
+            outputs = self(torch.cat([token] + draft_tokens, dim=1), past_key_values=past_key_values,
+                           attention_mask=full_attention_mask[:, :cur_len + num_draft], use_cache=True,
+                           return_dict=True)
+            logits = outputs.logits[0].float()
+            num_accepted, token, finished = 0, None, False
+            for i in range(num_draft):
+                p = next_token_probs(logits[i:i + 1], step_seen[i])
+                q = draft_probs[i]
+                x = draft_tokens[i]
+                r = torch.rand((), device=p.device) if do_sample else 1.0
+                if p[0, x] >= r * q[0, x]:
+                    num_accepted += 1
+                    if x.item() == stop_token:
+                        finished = True
+                        break
+                    continue
+                residual = (p - q).clamp_min(0)
+                token = torch.multinomial(residual if residual.sum() > 0 else p, num_samples=1)
+                break
+            if token is None and not finished:
+                token = torch.multinomial(next_token_probs(logits[num_draft:], step_seen[num_draft]), num_samples=1)
+            proposed += num_draft
+            accepted += num_accepted
+
+            if num_accepted > 0:
+                sequences[:, cur_len:cur_len + num_accepted] = torch.cat(draft_tokens[:num_accepted], dim=1)
+                seen = step_seen[num_accepted]
+            past_key_values = _crop_past(outputs.past_key_values, cur_len + num_accepted)
+            cur_len += num_accepted
+            if finished:
+                break
+            sequences[:, cur_len] = token
+            cur_len += 1
+        self.speculative_stats = (accepted, proposed)
+        return sequences[:, :cur_len]
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -142,7 +355,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         )
         # Create embedding
         mel_len = self.cached_mel_emb.shape[1]
-        if input_ids.shape[1] != 1:
+        if input_ids.shape[1] != 1 and past_key_values is None:
             text_inputs = input_ids[:, mel_len:]
             text_emb = self.embeddings(text_inputs)
             text_emb = text_emb + self.text_pos_embedding(text_emb)
@@ -153,6 +366,13 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             else:  # this outcome only occurs once per loop in most cases
                 mel_emb = self.cached_mel_emb
             emb = torch.cat([mel_emb, text_emb], dim=1)
+        elif input_ids.shape[1] != 1:
+            # several new tokens on top of the kv cache (speculative verification), embedded at the same
+            # positions as feeding them one at a time
+            emb = self.embeddings(input_ids)
+            total_len = attention_mask.shape[1]
+            positions = torch.arange(total_len - input_ids.shape[1] + 1, total_len + 1, device=input_ids.device)
+            emb = emb + self.text_pos_embedding.emb(positions - mel_len).unsqueeze(0)
         else:
             emb = self.embeddings(input_ids)
             emb = emb + self.text_pos_embedding.get_fixed_embedding(
@@ -695,8 +915,17 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
 
+    def get_duration_emb(self, batch_size, device):
+        """
+        Duration embeddings placed after the conditioning latent, (b, 2, d): [half speed][normal speed]
+        """
+        use_speed = torch.zeros(batch_size, dtype=torch.long, device=device)
+        return torch.stack((self.speed_emb(torch.ones_like(use_speed)), self.speed_emb(use_speed)), dim=1)
+
     def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, fast_sampling=False,
+                         speculative_draft_layers=0, speculative_draft_tokens=4, speech_conditioning_latent=None,
+                         duration_emb=None, **hf_generate_kwargs):
         """
         Args:
             speech_condition: (b, d, frames) or (d, frames)
@@ -704,6 +933,14 @@ class UnifiedVoice(nn.Module):
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
+            fast_sampling: decode with `GPT2InferenceModel.fast_generate` instead of `generate()`; beam search
+                settings (`num_beams`, `length_penalty`) are ignored
+            speculative_draft_layers: if > 0, decode with `GPT2InferenceModel.speculative_generate`, drafting with
+                the first `speculative_draft_layers` GPT layers; needs a single sequence without typical sampling
+            speculative_draft_tokens: number of tokens drafted per verification step
+            speech_conditioning_latent: precomputed `get_conditioning()` output of `speech_condition`, skips the
+                conditioning encoder when the same prompt is reused across segments
+            duration_emb: precomputed `get_duration_emb()` output
             hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
         """
 
@@ -716,7 +953,8 @@ class UnifiedVoice(nn.Module):
         if emo_cond_lengths is None:
             emo_cond_lengths = torch.tensor([emo_speech_condition.shape[-1]], device=speech_condition.device) 
 
-        speech_conditioning_latent = self.get_conditioning(speech_condition.transpose(1,2), cond_lengths)
+        if speech_conditioning_latent is None:
+            speech_conditioning_latent = self.get_conditioning(speech_condition.transpose(1,2), cond_lengths)
         if emo_vec is None:
             print('compute emo vec')
             emo_vec = self.get_emo_conditioning(emo_speech_condition.transpose(1,2), emo_cond_lengths)
@@ -725,10 +963,9 @@ class UnifiedVoice(nn.Module):
         else:
             print('Use the specified emotion vector')
 
-        tmp = torch.zeros(text_inputs.size(0)).to(text_inputs.device)
-        duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
-        duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
-        conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        if duration_emb is None:
+            duration_emb = self.get_duration_emb(text_inputs.size(0), text_inputs.device)
+        conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb), 1)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
@@ -756,7 +993,11 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
-        
+        use_speculative = speculative_draft_layers > 0
+        if use_speculative and (inputs.shape[0] != 1 or num_return_sequences != 1 or typical_sampling):
+            print(">> speculative decoding needs a single sequence without typical sampling, disabled")
+            use_speculative = False
+
         # Use accel engine if available (single sequence only)
         if self.accel_engine is not None and num_return_sequences == 1:
             output = self.accel_engine.generate(
@@ -769,6 +1010,37 @@ class UnifiedVoice(nn.Module):
                 tts_mel_embedding=self.inference_model.embeddings,  # mel_embedding layer
                 tts_text_pos_embedding=self.inference_model.text_pos_embedding,  # text_pos_embedding layer
             )
+        elif use_speculative:
+            output = self.inference_model.speculative_generate(
+                inputs,
+                attention_mask,
+                max_length=max_length,
+                stop_token=self.stop_mel_token,
+                draft_layers=speculative_draft_layers,
+                num_draft_tokens=speculative_draft_tokens,
+                do_sample=hf_generate_kwargs.get("do_sample", True),
+                top_k=hf_generate_kwargs.get("top_k"),
+                top_p=hf_generate_kwargs.get("top_p"),
+                temperature=hf_generate_kwargs.get("temperature", 1.0),
+                repetition_penalty=hf_generate_kwargs.get("repetition_penalty", 1.0),
+            )
+            accepted, proposed = self.inference_model.speculative_stats
+            print(f">> speculative decoding accepted {accepted}/{proposed} draft tokens "
+                  f"({accepted / max(proposed, 1):.1%})")
+        elif fast_sampling:
+            output = self.inference_model.fast_generate(
+                inputs,
+                attention_mask,
+                max_length=max_length,
+                stop_token=self.stop_mel_token,
+                do_sample=hf_generate_kwargs.get("do_sample", True),
+                top_k=hf_generate_kwargs.get("top_k"),
+                top_p=hf_generate_kwargs.get("top_p"),
+                temperature=hf_generate_kwargs.get("temperature", 1.0),
+                repetition_penalty=hf_generate_kwargs.get("repetition_penalty", 1.0),
+                num_return_sequences=num_return_sequences,
+                logits_processor=logits_processor,
+            )
         else:
             output = self.inference_model.generate(inputs, 
                                                 bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
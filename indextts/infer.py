@@ -19,6 +19,7 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from indextts.BigVGAN.models import BigVGAN as Generator
 from indextts.gpt.model import UnifiedVoice
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.common import remove_long_silence
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 
 from indextts.utils.front import TextNormalizer, TextTokenizer
@@ -27,7 +28,7 @@ from indextts.utils.front import TextNormalizer, TextTokenizer
 class IndexTTS:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=True, device=None,
-            use_cuda_kernel=None,
+            use_cuda_kernel=None, kv_cache=True, cpu_num_threads=None,
     ):
         """
         Args:
@@ -36,6 +37,9 @@ class IndexTTS:
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            kv_cache (bool): whether to use kv-cached GPT decoding in fp32 (CPU/MPS), with preallocated static caches.
+                Set to False to fall back to re-running attention over the whole prefix at every step.
+            cpu_num_threads (None | int): number of intra-op threads used on CPU; None keeps torch's default.
         """
         if device is not None:
             self.device = device
@@ -58,6 +62,10 @@ class IndexTTS:
             self.use_fp16 = False
             self.use_cuda_kernel = False
             print(">> Be patient, it may take a while to run in CPU mode.")
+        if self.device == "cpu":
+            if cpu_num_threads:
+                torch.set_num_threads(cpu_num_threads)
+            print(f">> CPU threads: {torch.get_num_threads()}")
 
         self.cfg = OmegaConf.load(cfg_path)
         self.model_dir = model_dir
@@ -97,7 +105,7 @@ class IndexTTS:
 
             self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=True)
         else:
-            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=False, half=False)
+            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=kv_cache, half=False, static_kv_cache=True)
 
         if self.use_cuda_kernel:
             # preload the CUDA kernel for BigVGAN
@@ -136,68 +144,30 @@ class IndexTTS:
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
-
-    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        return remove_long_silence(codes, self.stop_mel_token, silent_token=silent_token,
+                                   max_consecutive=max_consecutive)
+
+    def bucket_segments(self, segments, bucket_max_size=4, bucket_max_tokens=None) -> List[List[Dict]]:
         """
         Segment data bucketing.
         if ``bucket_max_size=1``, return all segments in one bucket.
+        ``bucket_max_tokens`` limits the padded size of a bucket, i.e. ``len(bucket) * longest segment``,
+        so that short segments are batched more aggressively than long ones.
         """
         outputs: List[Dict] = []
         for idx, sent in enumerate(segments):
             outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
 
-        if len(outputs) > bucket_max_size:
+        def bucket_full(bucket, sent_len):
+            if len(bucket) >= bucket_max_size:
+                return True
+            if bucket_max_tokens is None:
+                return False
+            longest = max(sent_len, max(o["len"] for o in bucket))
+            return (len(bucket) + 1) * longest > bucket_max_tokens
+
+        if len(outputs) > bucket_max_size or (
+                bucket_max_tokens is not None and len(outputs) * max((o["len"] for o in outputs), default=0) > bucket_max_tokens):
             # split segments into buckets by segment length
             buckets: List[List[Dict]] = []
             factor = 1.5
@@ -211,7 +181,7 @@ class IndexTTS:
                     continue
                 if last_bucket is None \
                         or current_sent_len >= int(last_bucket_sent_len_median * factor) \
-                        or len(last_bucket) >= bucket_max_size:
+                        or bucket_full(last_bucket, current_sent_len):
                     # new bucket
                     buckets.append([sent])
                     last_bucket = buckets[-1]
@@ -235,14 +205,16 @@ class IndexTTS:
                 # print("only_ones:", [(o["idx"], o["len"]) for o in only_ones])
                 for i in range(len(out_buckets)):
                     b = out_buckets[i]
-                    if len(b) < bucket_max_size:
+                    if not bucket_full(b, only_ones[0]["len"]):
                         b.append(only_ones.pop(0))
                         if len(only_ones) == 0:
                             break
                 # combined all remaining sized 1 buckets
-                if len(only_ones) > 0:
-                    out_buckets.extend(
-                        [only_ones[i:i + bucket_max_size] for i in range(0, len(only_ones), bucket_max_size)])
+                while len(only_ones) > 0:
+                    b = [only_ones.pop(0)]
+                    while len(only_ones) > 0 and not bucket_full(b, only_ones[0]["len"]):
+                        b.append(only_ones.pop(0))
+                    out_buckets.append(b)
             return out_buckets
         return [outputs]
 
@@ -281,15 +253,17 @@ class IndexTTS:
 
     # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
     def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_segment=100,
-                   segments_bucket_max_size=4, **generation_kwargs):
+                   segments_bucket_max_size=16, segments_bucket_max_tokens=400, **generation_kwargs):
         """
         Args:
             ``max_text_tokens_per_segment``: 分句的最大token数，默认``100``，可以根据GPU硬件情况调整
                 - 越小，batch 越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越大，batch 越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
-            ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
+            ``segments_bucket_max_size``: 分句分桶的最大容量，默认``16``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``segments_bucket_max_tokens``: 每个桶的token预算（桶大小 x 最长分句token数），默认``400``
+                - 短句可以组成更大的batch，长句的batch更小；``None`` 表示只按 ``segments_bucket_max_size`` 分桶
         """
         print(">> starting fast inference...")
 
@@ -359,13 +333,15 @@ class IndexTTS:
         # text processing
         all_text_tokens: List[List[torch.Tensor]] = []
         self._set_gr_progress(0.1, "text processing...")
-        bucket_max_size = segments_bucket_max_size if self.device != "cpu" else 1
-        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        bucket_max_size = segments_bucket_max_size
+        segments_count = len(segments)
+        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size,
+                                            bucket_max_tokens=segments_bucket_max_tokens)
         bucket_count = len(all_segments)
         if verbose:
             print(">> segments bucket_count:", bucket_count,
                   "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_segments],
-                  "bucket_max_size:", bucket_max_size)
+                  "bucket_max_size:", bucket_max_size, "bucket_max_tokens:", segments_bucket_max_tokens)
         for segments in all_segments:
             temp_tokens: List[torch.Tensor] = []
             all_text_tokens.append(temp_tokens)
@@ -417,46 +393,47 @@ class IndexTTS:
 
         # gpt latent
         self._set_gr_progress(0.5, "gpt latents inference...")
-        all_idxs = []
-        all_latents = []
+        # indexed by segment idx, so no reordering is needed afterwards
+        all_latents: List[torch.Tensor] = [None] * segments_count
         has_warned = False
         for batch_codes, batch_tokens, batch_segments in zip(all_batch_codes, all_text_tokens, all_segments):
-            for i in range(batch_codes.shape[0]):
-                codes = batch_codes[i]  # [x]
-                if not has_warned and codes[-1] != self.stop_mel_token:
-                    warnings.warn(
-                        f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
-                        f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
-                        category=RuntimeWarning
-                    )
-                    has_warned = True
-                codes = codes.unsqueeze(0)  # [x] -> [1, x]
-                if verbose:
-                    print("codes:", codes.shape)
-                    print(codes)
-                codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
-                if verbose:
-                    print("fix codes:", codes.shape)
-                    print(codes)
-                    print("code_lens:", code_lens)
-                text_tokens = batch_tokens[i]
-                all_idxs.append(batch_segments[i]["idx"])
-                m_start_time = time.perf_counter()
-                with torch.no_grad():
-                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                        latent = \
-                            self.gpt(auto_conditioning, text_tokens,
-                                     torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
-                                     code_lens * self.gpt.mel_length_compression,
-                                     cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]],
-                                                                   device=text_tokens.device),
-                                     return_latent=True, clip_inputs=False)
-                        gpt_forward_time += time.perf_counter() - m_start_time
-                        all_latents.append(latent)
+            if not has_warned and (batch_codes[:, -1] != self.stop_mel_token).any():
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                    f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
+                    category=RuntimeWarning
+                )
+                has_warned = True
+            if verbose:
+                print("codes:", batch_codes.shape)
+                print(batch_codes)
+            codes, code_lens = self.remove_long_silence(batch_codes, silent_token=52, max_consecutive=30)
+            if verbose:
+                print("fix codes:", codes.shape)
+                print(codes)
+                print("code_lens:", code_lens)
+            batch_num = len(batch_tokens)
+            if batch_num > 1:
+                text_tokens = self.pad_tokens_cat(batch_tokens)
+            else:
+                text_tokens = batch_tokens[0]
+            text_lens = torch.tensor([t.shape[-1] for t in batch_tokens], device=text_tokens.device)
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    # one forward per bucket, the text padding is masked so each latent matches an unbatched forward
+                    latent = \
+                        self.gpt(auto_conditioning.expand(batch_num, -1, -1), text_tokens, text_lens, codes,
+                                 code_lens * self.gpt.mel_length_compression,
+                                 cond_mel_lengths=cond_mel_lengths.expand(batch_num),
+                                 return_latent=True, clip_inputs=False, mask_text_padding=batch_num > 1)
+                    gpt_forward_time += time.perf_counter() - m_start_time
+            for i, seg in enumerate(batch_segments):
+                all_latents[seg["idx"]] = latent[i:i + 1, :int(code_lens[i])]
         del all_batch_codes, all_text_tokens, all_segments
         # bigvgan chunk
         chunk_size = 2
-        all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
+        assert all(l is not None for l in all_latents), "every segment should have a latent after bucketing"
         if verbose:
             print(">> all_latents:", len(all_latents))
             print("  latents length:", [l.shape[1] for l in all_latents])
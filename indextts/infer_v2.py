@@ -4,11 +4,12 @@ from subprocess import CalledProcessError
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
 import json
 import re
+import threading
 import time
-import librosa
+import wave
+from collections import OrderedDict
 import torch
 import torchaudio
-from torch.nn.utils.rnn import pad_sequence
 
 import warnings
 
@@ -18,12 +19,16 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from omegaconf import OmegaConf
 
 from indextts.gpt.model_v2 import UnifiedVoice
-from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
+from indextts.utils.maskgct_utils import SEMANTIC_LAYER, build_semantic_model, build_semantic_codec
+from indextts.utils.audio_ingest import AudioIngest
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.common import remove_long_silence, stop_token_lengths
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.quantization import QUANT_MODES, quantize_with_cache
 
 from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
 from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.s2mel.modules.bigvgan.chunked import ChunkedVocoder
 from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 from indextts.s2mel.modules.audio import mel_spectrogram
 
@@ -36,9 +41,41 @@ import random
 import torch.nn.functional as F
 
 class IndexTTS2:
+    # attribute -> loader method; each loader sets every attribute mapped to it
+    _LAZY_COMPONENTS = {
+        "qwen_emo": "_load_qwen_emo",
+        "gpt": "_load_gpt",
+        "extract_features": "_load_semantic_model",
+        "semantic_model": "_load_semantic_model",
+        "semantic_mean": "_load_semantic_model",
+        "semantic_std": "_load_semantic_model",
+        "semantic_codec": "_load_semantic_codec",
+        "s2mel": "_load_s2mel",
+        "campplus_model": "_load_campplus",
+        "bigvgan": "_load_bigvgan",
+        "chunked_vocoder": "_load_bigvgan",
+        "normalizer": "_load_text_frontend",
+        "tokenizer": "_load_text_frontend",
+        "emo_matrix": "_load_emo_matrices",
+        "spk_matrix": "_load_emo_matrices",
+        "emo_lookup": "_load_emo_matrices",
+    }
+    # components needed by every inference call; QwenEmotion is only needed for `use_emo_text`
+    _WARMUP_LOADERS = (
+        "_load_text_frontend",
+        "_load_gpt",
+        "_load_semantic_model",
+        "_load_semantic_codec",
+        "_load_s2mel",
+        "_load_campplus",
+        "_load_bigvgan",
+        "_load_emo_matrices",
+    )
+
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False
+            use_cuda_kernel=None, use_cpu_kernel=None, use_deepspeed=False, use_accel=False, use_torch_compile=False,
+            quantize=None, quant_groupsize=128, lazy_load=False, background_warmup=False, emo_text_cache_file=None
     ):
         """
         Args:
@@ -47,9 +84,23 @@ class IndexTTS2:
             use_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            use_cpu_kernel (None | bool): whether to use BigVGan fused activation C++ kernel, only for CPU device.
+                Enabled by default on CPU.
             use_deepspeed (bool): whether to use DeepSpeed or not.
             use_accel (bool): whether to use acceleration engine for GPT2 or not.
             use_torch_compile (bool): whether to use torch.compile for optimization or not.
+            quantize (None | str): weight-only quantization of the GPT blocks, mel_head and s2mel DiT linears,
+                "int8" or "int4". Cuts the weight memory of these layers about 4x / 8x; on CPU int8 runs at about
+                fp32 speed while int4 is slower (tests/benchmark_quantization.py). Quantized weights are cached
+                in `model_dir/quantized`.
+            quant_groupsize (int): number of input features sharing one scale/zero for "int4".
+            lazy_load (bool): load each sub-model on first use instead of in the constructor.
+                QwenEmotion is then only loaded when `use_emo_text` is requested.
+            background_warmup (bool): with `lazy_load`, load the sub-models needed by every inference
+                call in a background thread right away.
+            emo_text_cache_file (None | bool | str): JSONL file the QwenEmotion text -> emotion results are
+                persisted to. None uses the user cache dir (see `default_emo_text_cache_file`), False keeps
+                them in memory only.
         """
         if device is not None:
             self.device = device
@@ -72,26 +123,139 @@ class IndexTTS2:
             self.use_fp16 = False
             self.use_cuda_kernel = False
             print(">> Be patient, it may take a while to run in CPU mode.")
+        self.use_cpu_kernel = self.device == "cpu" and (use_cpu_kernel is None or use_cpu_kernel)
+
+        self._load_lock = threading.RLock()
+        self.load_times = {}  # loader name -> seconds spent loading
 
+        t0 = time.perf_counter()
         self.cfg = OmegaConf.load(cfg_path)
         self.model_dir = model_dir
         self.dtype = torch.float16 if self.use_fp16 else None
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
         self.use_accel = use_accel
+        self.use_deepspeed = use_deepspeed
         self.use_torch_compile = use_torch_compile
+        if quantize is not None and quantize not in QUANT_MODES:
+            raise ValueError(f"quantize must be one of {QUANT_MODES}, got {quantize!r}")
+        self.quantize = quantize
+        self.quant_groupsize = quant_groupsize
+        self.quant_cache_dir = os.path.join(self.model_dir, "quantized")
+        if self.quantize and self.use_accel:
+            print(">> use_accel is not supported with quantized weights, disabling it.")
+            self.use_accel = False
+        self.emo_num = list(self.cfg.emo_num)
+        self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
+        self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
+        self.glossary_path = os.path.join(self.model_dir, "glossary.yaml")
+        if emo_text_cache_file is None:
+            emo_text_cache_file = default_emo_text_cache_file(self.cfg.qwen_emo_path)
+        self.emo_text_cache_file = emo_text_cache_file or None
+
+        mel_fn_args = {
+            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
+            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
+            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
+            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
+            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
+            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
+            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
+            "center": False
+        }
+        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
 
-        self.qwen_emo = QwenEmotion(os.path.join(self.model_dir, self.cfg.qwen_emo_path))
+        # 缓存参考音频：
+        self.cache_spk_cond = None
+        self.cache_s2mel_style = None
+        self.cache_s2mel_prompt = None
+        self.cache_spk_audio_prompt = None
+        self.cache_emo_cond = None
+        self.cache_emo_audio_prompt = None
+        self.cache_mel = None
+        # 参考音频解码结果按文件内容哈希缓存，切换回之前的说话人时无需重新解码
+        self.audio_ingest = AudioIngest()
+        # GPT 条件（说话人 latent、情感向量、时长 embedding）按 (说话人, 情感, alpha) 缓存
+        self.cache_gpt_conds = None
+        self.cache_gpt_conds_key = None
+        self.cache_gpt_conds_time = 0.0
+        # 情感向量模式：每种情感下与说话人 style 最接近的情感行，按说话人参考音频缓存
+        self.cache_emo_rows = None
+        self.cache_emo_rows_key = None
 
-        self.gpt = UnifiedVoice(**self.cfg.gpt, use_accel=self.use_accel)
-        self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
-        load_checkpoint(self.gpt, self.gpt_path)
-        self.gpt = self.gpt.to(self.device)
+        # 进度引用显示（可选）
+        self.gr_progress = None
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.load_times["config"] = time.perf_counter() - t0
+
+        self._warmup_thread = None
+        if not lazy_load:
+            for loader in ("_load_qwen_emo",) + self._WARMUP_LOADERS:
+                self._run_loader(loader)
+            self.print_load_times()
+        elif background_warmup:
+            self._warmup_thread = threading.Thread(target=self.warmup, name="IndexTTS2-warmup", daemon=True)
+            self._warmup_thread.start()
+
+    def __getattr__(self, name):
+        # only reached when `name` is not set yet, i.e. the component has not been loaded
+        loader = type(self)._LAZY_COMPONENTS.get(name)
+        if loader is None or "_load_lock" not in self.__dict__:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self._run_loader(loader)
+        return self.__dict__[name]
+
+    def _run_loader(self, loader):
+        with self._load_lock:
+            if loader in self.load_times:
+                return
+            start = time.perf_counter()
+            getattr(self, loader)()
+            self.load_times[loader] = time.perf_counter() - start
+
+    def warmup(self, include_qwen_emo=False):
+        """
+        Load all sub-models needed by `infer`, plus QwenEmotion if `include_qwen_emo`.
+        Safe to call while another thread is already using or loading the model.
+        """
+        loaders = self._WARMUP_LOADERS + (("_load_qwen_emo",) if include_qwen_emo else ())
+        for loader in loaders:
+            self._run_loader(loader)
+
+    def wait_warmup(self):
+        if self._warmup_thread is not None:
+            self._warmup_thread.join()
+
+    def print_load_times(self):
+        """Print how long each sub-model took to load, slowest first."""
+        with self._load_lock:
+            load_times = dict(self.load_times)
+        print(">> Startup time breakdown:")
+        for name, seconds in sorted(load_times.items(), key=lambda x: x[1], reverse=True):
+            print(f"   {name.replace('_load_', ''):<16} {seconds:7.2f} seconds")
+        print(f"   {'total':<16} {sum(load_times.values()):7.2f} seconds")
+
+    def _load_qwen_emo(self):
+        qwen_emo_path = os.path.join(self.model_dir, self.cfg.qwen_emo_path)
+        self.qwen_emo = QwenEmotion(qwen_emo_path, cache_file=self.emo_text_cache_file)
+
+    def _load_gpt(self):
+        gpt = UnifiedVoice(**self.cfg.gpt, use_accel=self.use_accel)
+        if self.quantize:
+            gpt_quant_path = os.path.join(self.quant_cache_dir, f"gpt.{self.quantize}.pth")
+            from_cache = quantize_with_cache(
+                gpt, ["gpt.h", "mel_head"], self.quantize, gpt_quant_path, self.gpt_path,
+                groupsize=self.quant_groupsize, load_source=lambda model: load_checkpoint(model, self.gpt_path))
+            print(f">> GPT quantized to {self.quantize}", "(loaded from cache)" if from_cache else f"and cached to: {gpt_quant_path}")
+        else:
+            load_checkpoint(gpt, self.gpt_path)
+        gpt = gpt.to(self.device)
         if self.use_fp16:
-            self.gpt.eval().half()
+            gpt.eval().half()
         else:
-            self.gpt.eval()
+            gpt.eval()
         print(">> GPT weights restored from:", self.gpt_path)
 
+        use_deepspeed = self.use_deepspeed
         if use_deepspeed:
             try:
                 import deepspeed
@@ -99,34 +263,30 @@ class IndexTTS2:
                 use_deepspeed = False
                 print(f">> Failed to load DeepSpeed. Falling back to normal inference. Error: {e}")
 
-        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
-
-        if self.use_cuda_kernel:
-            # preload the CUDA kernel for BigVGAN
-            try:
-                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
-
-                print(">> Preload custom CUDA kernel for BigVGAN", activation1d.anti_alias_activation_cuda)
-            except Exception as e:
-                print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
-                print(f"{e!r}")
-                self.use_cuda_kernel = False
+        gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
+        self.gpt = gpt
 
+    def _load_semantic_model(self):
         self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
-        self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
-            os.path.join(self.model_dir, self.cfg.w2v_stat))
-        self.semantic_model = self.semantic_model.to(self.device)
-        self.semantic_model.eval()
-        self.semantic_mean = self.semantic_mean.to(self.device)
-        self.semantic_std = self.semantic_std.to(self.device)
-
+        # only the encoder layers up to the tapped hidden state are built
+        semantic_model, semantic_mean, semantic_std = build_semantic_model(
+            os.path.join(self.model_dir, self.cfg.w2v_stat), output_layer=SEMANTIC_LAYER)
+        semantic_model = semantic_model.to(self.device)
+        semantic_model.eval()
+        self.semantic_mean = semantic_mean.to(self.device)
+        self.semantic_std = semantic_std.to(self.device)
+        self.semantic_model = semantic_model
+
+    def _load_semantic_codec(self):
         semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
         semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
         safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
-        self.semantic_codec = semantic_codec.to(self.device)
-        self.semantic_codec.eval()
+        semantic_codec = semantic_codec.to(self.device)
+        semantic_codec.eval()
+        self.semantic_codec = semantic_codec
         print('>> semantic_codec weights restored from: {}'.format(semantic_code_ckpt))
 
+    def _load_s2mel(self):
         s2mel_path = os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
         s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
         s2mel, _, _, _ = load_checkpoint2(
@@ -137,150 +297,139 @@ class IndexTTS2:
             ignore_modules=[],
             is_distributed=False,
         )
-        self.s2mel = s2mel.to(self.device)
-        self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
-        
+        s2mel = s2mel.to(self.device)
+        # buffers grow with the utterance length up to this cap instead of being allocated for it up front
+        s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1,
+                                                   max_seq_length=self.cfg.s2mel.get("max_seq_length", 16384))
+        if self.quantize:
+            dit_quant_path = os.path.join(self.quant_cache_dir, f"s2mel_dit.{self.quantize}.pth")
+            from_cache = quantize_with_cache(
+                s2mel.models['cfm'].estimator, [""], self.quantize, dit_quant_path, s2mel_path,
+                groupsize=self.quant_groupsize)
+            print(f">> s2mel DiT quantized to {self.quantize}", "(loaded from cache)" if from_cache else f"and cached to: {dit_quant_path}")
+
         # Enable torch.compile optimization if requested
         if self.use_torch_compile:
             print(">> Enabling torch.compile optimization")
-            self.s2mel.enable_torch_compile()
+            s2mel.enable_torch_compile()
             print(">> torch.compile optimization enabled successfully")
-        
-        self.s2mel.eval()
+
+        s2mel.eval()
+        self.s2mel = s2mel
         print(">> s2mel weights restored from:", s2mel_path)
 
-        # load campplus_model
+    def _load_campplus(self):
         campplus_ckpt_path = hf_hub_download(
             "funasr/campplus", filename="campplus_cn_common.bin"
         )
         campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
         campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
-        self.campplus_model = campplus_model.to(self.device)
-        self.campplus_model.eval()
+        campplus_model = campplus_model.to(self.device)
+        campplus_model.eval()
+        self.campplus_model = campplus_model
         print(">> campplus_model weights restored from:", campplus_ckpt_path)
 
+    def _load_bigvgan(self):
+        if self.use_cuda_kernel:
+            # preload the CUDA kernel for BigVGAN
+            try:
+                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
+
+                print(">> Preload custom CUDA kernel for BigVGAN", activation1d.anti_alias_activation_cuda)
+            except Exception as e:
+                print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
+                print(f"{e!r}")
+                self.use_cuda_kernel = False
+        if self.use_cpu_kernel:
+            # build/load the fused CPU kernel for BigVGAN
+            try:
+                from indextts.s2mel.modules.bigvgan.alias_free_activation.cpu import activation1d
+
+                print(">> Preload fused CPU kernel for BigVGAN", activation1d.anti_alias_activation_cpu)
+            except Exception as e:
+                print(">> Failed to load fused CPU kernel for BigVGAN. Falling back to torch.")
+                print(f"{e!r}")
+                self.use_cpu_kernel = False
+
         bigvgan_name = self.cfg.vocoder.name
-        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
-        self.bigvgan = self.bigvgan.to(self.device)
-        self.bigvgan.remove_weight_norm()
-        self.bigvgan.eval()
+        vocoder = bigvgan.BigVGAN.from_pretrained(
+            bigvgan_name, use_cuda_kernel=self.use_cuda_kernel, use_cpu_kernel=self.use_cpu_kernel
+        )
+        vocoder = vocoder.to(self.device)
+        vocoder.remove_weight_norm()
+        vocoder.eval()
+        self.bigvgan = vocoder
+        # long mels are vocoded in overlapping windows so peak memory does not grow with the segment length
+        self.chunked_vocoder = ChunkedVocoder(vocoder, chunk_frames=self.cfg.vocoder.get("chunk_frames", 1024))
         print(">> bigvgan weights restored from:", bigvgan_name)
 
-        self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
-        self.normalizer = TextNormalizer(enable_glossary=True)
-        self.normalizer.load()
+    def _load_text_frontend(self):
+        normalizer = TextNormalizer(enable_glossary=True)
+        normalizer.load()
         print(">> TextNormalizer loaded")
-        self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
+        tokenizer = TextTokenizer(self.bpe_path, normalizer)
         print(">> bpe model loaded from:", self.bpe_path)
 
         # 加载术语词汇表（如果存在）
-        self.glossary_path = os.path.join(self.model_dir, "glossary.yaml")
         if os.path.exists(self.glossary_path):
-            self.normalizer.load_glossary_from_yaml(self.glossary_path)
+            normalizer.load_glossary_from_yaml(self.glossary_path)
             print(">> Glossary loaded from:", self.glossary_path)
+        self.normalizer = normalizer
+        self.tokenizer = tokenizer
 
+    def _load_emo_matrices(self):
         emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
-        self.emo_matrix = emo_matrix.to(self.device)
-        self.emo_num = list(self.cfg.emo_num)
+        emo_matrix = emo_matrix.to(self.device)
 
         spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
-        self.spk_matrix = spk_matrix.to(self.device)
-
-        self.emo_matrix = torch.split(self.emo_matrix, self.emo_num)
-        self.spk_matrix = torch.split(self.spk_matrix, self.emo_num)
-
-        mel_fn_args = {
-            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
-            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
-            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
-            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
-            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
-            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
-            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
-            "center": False
-        }
-        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
-
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
+        spk_matrix = spk_matrix.to(self.device)
 
-        # 进度引用显示（可选）
-        self.gr_progress = None
-        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.emo_matrix = torch.split(emo_matrix, self.emo_num)
+        self.spk_matrix = torch.split(spk_matrix, self.emo_num)
+        self.emo_lookup = EmotionMatrix(emo_matrix, spk_matrix, self.emo_num)
 
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
         vq_emb = self.semantic_model(
             input_features=input_features,
             attention_mask=attention_mask,
-            output_hidden_states=True,
         )
-        feat = vq_emb.hidden_states[17]  # (B, T, C)
+        feat = vq_emb.last_hidden_state  # hidden_states[17] of the full model, (B, T, C)
         feat = (feat - self.semantic_mean) / self.semantic_std
         return feat
 
+    @torch.no_grad()
+    def get_gpt_conditions(self, spk_cond_emb, emo_cond_emb, emo_alpha, cache_key):
+        """
+        Prompt-only GPT inputs shared by every text segment: the speaker conditioning latent, the emotion
+        vector merged with `emo_alpha` and the duration embeddings. They are computed once per `cache_key`.
+
+        Returns:
+            (speech_conditioning_latent, emovec, duration_emb), reused: bool
+        """
+        if self.cache_gpt_conds is not None and self.cache_gpt_conds_key == cache_key:
+            return self.cache_gpt_conds, True
+        self.cache_gpt_conds = None
+        t0 = time.perf_counter()
+        device_type = torch.device(self.device).type
+        cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=self.device)
+        emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=self.device)
+        with torch.amp.autocast(device_type, enabled=self.dtype is not None, dtype=self.dtype):
+            speech_conditioning_latent = self.gpt.get_conditioning(spk_cond_emb.transpose(1, 2), cond_lengths)
+            emovec = self.gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths, alpha=emo_alpha)
+            duration_emb = self.gpt.get_duration_emb(spk_cond_emb.size(0), self.device)
+        self.cache_gpt_conds = (speech_conditioning_latent, emovec, duration_emb)
+        self.cache_gpt_conds_key = cache_key
+        self.cache_gpt_conds_time = time.perf_counter() - t0
+        return self.cache_gpt_conds, False
+
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
         """
-        code_lens = []
-        codes_list = []
-        device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[
-                               k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
-        return codes, code_lens
+        return remove_long_silence(codes, self.stop_mel_token, silent_token=silent_token,
+                                   max_consecutive=max_consecutive)
 
     def interval_silence(self, wavs, sampling_rate=22050, interval_silence=200):
         """
@@ -319,23 +468,49 @@ class IndexTTS2:
 
         return wavs_list
 
+    def join_segments(self, wavs, sampling_rate=22050, interval_silence=200):
+        """
+        Join generated segments, with silences in between, into one int16 (channels, samples) tensor.
+        The output is allocated once and every segment is converted straight into it.
+        wavs: List[torch.tensor]
+        """
+        sil_dur = int(sampling_rate * interval_silence / 1000.0) if interval_silence > 0 else 0
+        total = sum(wav.size(-1) for wav in wavs) + sil_dur * max(len(wavs) - 1, 0)
+        out = torch.zeros(wavs[0].size(0), total, dtype=torch.int16)
+        offset = 0
+        for wav in wavs:
+            # float -> int16 truncates like `wav.type(torch.int16)`
+            out[:, offset:offset + wav.size(-1)].copy_(wav)
+            offset += wav.size(-1) + sil_dur
+        return out
+
+    def write_segments(self, file, wavs, sampling_rate=22050, interval_silence=200):
+        """
+        Write generated segments, with silences in between, as a 16-bit WAV to an open binary file object.
+        The header is written up front, so `file` does not need to be seekable, e.g. a pipe or socket.
+        wavs: List[torch.tensor]
+        """
+        channel_size = wavs[0].size(0)
+        sil_dur = int(sampling_rate * interval_silence / 1000.0) if interval_silence > 0 else 0
+        silence = bytes(2 * channel_size * sil_dur)
+        with wave.open(file, "wb") as f:
+            f.setnchannels(channel_size)
+            f.setsampwidth(2)
+            f.setframerate(sampling_rate)
+            f.setnframes(sum(wav.size(-1) for wav in wavs) + sil_dur * (len(wavs) - 1))
+            for i, wav in enumerate(wavs):
+                f.writeframesraw(wav.type(torch.int16).numpy().T.astype("<i2").tobytes())
+                if i < len(wavs) - 1:
+                    f.writeframesraw(silence)
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:
             self.gr_progress(value, desc=desc)
 
     def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
-        if not sr:
-            audio, sr = librosa.load(audio_path)
-        else:
-            audio, _ = librosa.load(audio_path,sr=sr)
-        audio = torch.tensor(audio).unsqueeze(0)
-        max_audio_samples = int(max_audio_length_seconds * sr)
-
-        if audio.shape[1] > max_audio_samples:
-            if verbose:
-                print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
-            audio = audio[:, :max_audio_samples]
-        return audio, sr
+        prompt = self.audio_ingest.load(audio_path, max_audio_length_seconds, verbose)
+        sr = sr or prompt.sample_rate
+        return prompt.resample(sr), sr
     
     def normalize_emo_vec(self, emo_vector, apply_bias=True):
         # apply biased emotion factors for better user experience,
@@ -354,6 +529,8 @@ class IndexTTS2:
         return emo_vector
 
     # 原始推理模式
+    # output_path: 文件路径；None 时在内存中返回 (sampling_rate, int16 ndarray[samples, channels])；
+    # 已打开的二进制文件对象时直接逐段写入 WAV
     def infer(self, spk_audio_prompt, text, output_path,
               emo_audio_prompt=None, emo_alpha=1.0,
               emo_vector=None,
@@ -432,9 +609,10 @@ class IndexTTS2:
                 self.cache_s2mel_prompt = None
                 self.cache_mel = None
                 torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
+            # one decode per prompt file, the resampling kernels are shared between calls
+            prompt_audio = self.audio_ingest.load(spk_audio_prompt, 15, verbose)
+            audio_22k = prompt_audio.resample(22050)
+            audio_16k = prompt_audio.resample(16000)
 
             inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
             input_features = inputs["input_features"]
@@ -472,12 +650,12 @@ class IndexTTS2:
         if emo_vector is not None:
             weight_vector = torch.tensor(emo_vector, device=self.device)
             if use_random:
-                random_index = [random.randint(0, x - 1) for x in self.emo_num]
+                emo_matrix = self.emo_lookup.rows(self.emo_lookup.random_rows())
             else:
-                random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
-
-            emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
-            emo_matrix = torch.cat(emo_matrix, 0)
+                if self.cache_emo_rows is None or self.cache_emo_rows_key != spk_audio_prompt:
+                    self.cache_emo_rows = self.emo_lookup.rows(self.emo_lookup.nearest_rows(style))
+                    self.cache_emo_rows_key = spk_audio_prompt
+                emo_matrix = self.cache_emo_rows
             emovec_mat = weight_vector.unsqueeze(1) * emo_matrix
             emovec_mat = torch.sum(emovec_mat, 0)
             emovec_mat = emovec_mat.unsqueeze(0)
@@ -499,6 +677,12 @@ class IndexTTS2:
         else:
             emo_cond_emb = self.cache_emo_cond
 
+        (speech_conditioning_latent, emovec, duration_emb), gpt_conds_reused = self.get_gpt_conditions(
+            spk_cond_emb, emo_cond_emb, emo_alpha, (spk_audio_prompt, emo_audio_prompt, emo_alpha))
+        if emo_vector is not None:
+            emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
+            # emovec = emovec_mat
+
         self._set_gr_progress(0.1, "text processing...")
         text_tokens_list = self.tokenizer.tokenize(text)
         segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens)
@@ -524,6 +708,7 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        fast_sampling = generation_kwargs.pop("fast_sampling", False)
         sampling_rate = 22050
 
         wavs = []
@@ -549,19 +734,7 @@ class IndexTTS2:
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
-                        spk_cond_emb,
-                        emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
-                    codes, speech_conditioning_latent = self.gpt.inference_speech(
+                    codes, _ = self.gpt.inference_speech(
                         spk_cond_emb,
                         text_tokens,
                         emo_cond_emb,
@@ -577,6 +750,9 @@ class IndexTTS2:
                         num_beams=num_beams,
                         repetition_penalty=repetition_penalty,
                         max_generate_length=max_mel_tokens,
+                        fast_sampling=fast_sampling,
+                        speech_conditioning_latent=speech_conditioning_latent,
+                        duration_emb=duration_emb,
                         **generation_kwargs
                     )
 
@@ -596,18 +772,8 @@ class IndexTTS2:
                 #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
                 #                     print(f"code len: {code_lens}")
 
-                code_lens = []
-                max_code_len = 0
-                for code in codes:
-                    if self.stop_mel_token not in code:
-                        code_len = len(code)
-                    else:
-                        len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0]
-                        code_len = len_[0].item() if len_.numel() > 0 else len(code)
-                    code_lens.append(code_len)
-                    max_code_len = max(max_code_len, code_len)
-                codes = codes[:, :max_code_len]
-                code_lens = torch.LongTensor(code_lens)
+                code_lens = stop_token_lengths(codes, self.stop_mel_token)
+                codes = codes[:, :int(code_lens.max())]
                 code_lens = code_lens.to(self.device)
                 if verbose:
                     print(codes, type(codes))
@@ -656,7 +822,7 @@ class IndexTTS2:
                     s2mel_time += time.perf_counter() - m_start_time
 
                     m_start_time = time.perf_counter()
-                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
+                    wav = self.chunked_vocoder(vc_target.float()).squeeze().unsqueeze(0)
                     print(wav.shape)
                     bigvgan_time += time.perf_counter() - m_start_time
                     wav = wav.squeeze(1)
@@ -674,9 +840,12 @@ class IndexTTS2:
         end_time = time.perf_counter()
 
         self._set_gr_progress(0.9, "saving audio...")
-        wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
-        wav = torch.cat(wavs, dim=1)
-        wav_length = wav.shape[-1] / sampling_rate
+        sil_dur = int(sampling_rate * interval_silence / 1000.0) if interval_silence > 0 else 0
+        wav_length = (sum(wav.size(-1) for wav in wavs) + sil_dur * (len(wavs) - 1)) / sampling_rate
+        # 条件只算一次：首次调用省下 (段数 - 1) 次，命中缓存时每段都省下
+        print(f">> gpt_cond_time: {0.0 if gpt_conds_reused else self.cache_gpt_conds_time:.2f} seconds "
+              f"({'reused' if gpt_conds_reused else 'computed once'}, "
+              f"saves {self.cache_gpt_conds_time:.3f} seconds per segment)")
         print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
         print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
         print(f">> s2mel_time: {s2mel_time:.2f} seconds")
@@ -686,7 +855,14 @@ class IndexTTS2:
         print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
 
         # save audio
-        wav = wav.cpu()  # to cpu
+        if hasattr(output_path, "write"):
+            # 直接写入已打开的文件对象（文件、管道、socket），不拼接整段音频
+            self.write_segments(output_path, wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+            if stream_return:
+                return None
+            yield output_path
+            return
+        wav = self.join_segments(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
         if output_path:
             # 直接保存音频到指定路径中
             if os.path.isfile(output_path):
@@ -694,7 +870,7 @@ class IndexTTS2:
                 print(">> remove old wav file:", output_path)
             if os.path.dirname(output_path) != "":
                 os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            torchaudio.save(output_path, wav, sampling_rate)
             print(">> wav file saved to:", output_path)
             if stream_return:
                 return None
@@ -702,9 +878,8 @@ class IndexTTS2:
         else:
             if stream_return:
                 return None
-            # 返回以符合Gradio的格式要求
-            wav_data = wav.type(torch.int16)
-            wav_data = wav_data.numpy().T
+            # 返回以符合Gradio的格式要求；numpy 数组与拼接缓冲区共享内存，不再复制
+            wav_data = wav.numpy().T
             yield (sampling_rate, wav_data)
 
 
@@ -716,10 +891,65 @@ def find_most_similar_cosine(query_vector, matrix):
     most_similar_index = torch.argmax(similarities)
     return most_similar_index
 
+class EmotionMatrix:
+    """
+    Rows of `emo_matrix` grouped by emotion (`emo_num` rows each) and the matching speaker rows of `spk_matrix`.
+    The speaker rows are normalized once, so finding the row closest to a speaker style in every group is
+    a single matrix-vector product and a masked argmax instead of one `find_most_similar_cosine` per group.
+    """
+
+    def __init__(self, emo_matrix, spk_matrix, emo_num):
+        device = emo_matrix.device
+        self.emo_matrix = emo_matrix
+        self.spk_matrix = F.normalize(spk_matrix.float(), dim=1)
+        self.emo_num = list(emo_num)
+        counts = torch.tensor(self.emo_num, device=device)
+        self.offsets = torch.cumsum(counts, 0) - counts
+        # (num_emotions, max_rows) table of row indices, padded slots point at row 0 and are masked out
+        slots = torch.arange(max(self.emo_num), device=device)
+        self.valid = slots.unsqueeze(0) < counts.unsqueeze(1)
+        self.index = (self.offsets.unsqueeze(1) + slots).masked_fill(~self.valid, 0)
+
+    def nearest_rows(self, style):
+        """Index of the most cosine-similar speaker row to `style` (1, dim) in every emotion group."""
+        similarities = self.spk_matrix @ F.normalize(style.float().reshape(-1), dim=0)
+        similarities = similarities[self.index].masked_fill(~self.valid, float("-inf"))
+        return similarities.argmax(dim=1) + self.offsets
+
+    def random_rows(self):
+        """Index of a random row in every emotion group."""
+        return self.offsets + torch.tensor([random.randint(0, x - 1) for x in self.emo_num], device=self.offsets.device)
+
+    def rows(self, index):
+        """(num_emotions, emo_dim) emotion rows for the indices returned by `nearest_rows`/`random_rows`."""
+        return self.emo_matrix[index]
+
+
+def default_emo_text_cache_file(qwen_emo_path):
+    """
+    `$XDG_CACHE_HOME/indextts/emo_text_cache.<model>.jsonl` (`~/.cache` if unset): outside the checkpoint
+    directory, which is often read-only or shared, and one file per QwenEmotion model.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    model_name = os.path.basename(os.path.normpath(qwen_emo_path))
+    return os.path.join(cache_home, "indextts", f"emo_text_cache.{model_name}.jsonl")
+
+
 class QwenEmotion:
-    def __init__(self, model_dir):
+    def __init__(self, model_dir, cache_size=4096, cache_file=None):
+        """
+        Args:
+            model_dir (str): path to the QwenEmotion model.
+            cache_size (int): number of text -> emotion results kept in memory (LRU), 0 disables the cache.
+            cache_file (None | str): JSONL file the results are also appended to and loaded from, so they
+                survive restarts. Malformed lines are skipped with a warning.
+        """
         self.model_dir = model_dir
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        # batched generation: left padding keeps the generated tokens of every row right after its prompt
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_dir,
             torch_dtype="float16",  # "auto"
@@ -753,6 +983,65 @@ class QwenEmotion:
         }
         self.max_score = 1.2
         self.min_score = 0.0
+        # the answer is a flat JSON object of the 8 emotion scores; twice its token count plus some slack
+        # bounds generation instead of letting a runaway answer decode up to the context length
+        sample = json.dumps({key: 0.95 for key in self.desired_vector_order}, ensure_ascii=False)
+        self.max_new_tokens = 2 * len(self.tokenizer(sample).input_ids) + 16
+
+        self.cache_size = cache_size
+        self.cache_file = cache_file
+        self._cache = OrderedDict()
+        if cache_file is not None and os.path.exists(cache_file):
+            self._load_cache_file()
+
+    def _load_cache_file(self):
+        skipped = 0
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                        text, emotions = item["text"], item["emotions"]
+                        if not isinstance(text, str) or not isinstance(emotions, dict):
+                            raise TypeError("unexpected value types")
+                    except (json.decoder.JSONDecodeError, KeyError, TypeError):
+                        skipped += 1  # e.g. a partially written line
+                        continue
+                    self._cache_put(text, emotions)
+        except OSError as e:
+            print(f">> Failed to read QwenEmotion cache {self.cache_file}: {e!r}")
+        if skipped:
+            warnings.warn(f"Skipped {skipped} malformed line(s) in QwenEmotion cache {self.cache_file}",
+                          category=RuntimeWarning)
+
+    def _cache_get(self, text):
+        emotions = self._cache.get(text)
+        if emotions is None:
+            return None
+        self._cache.move_to_end(text)
+        return dict(emotions)
+
+    def _cache_put(self, text, emotions):
+        if self.cache_size <= 0:
+            return
+        self._cache[text] = dict(emotions)
+        self._cache.move_to_end(text)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _save_to_cache_file(self, results):
+        if self.cache_file is None or not results:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            with open(self.cache_file, "a", encoding="utf-8") as f:
+                for text, emotions in results.items():
+                    f.write(json.dumps({"text": text, "emotions": emotions}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f">> Failed to write QwenEmotion cache {self.cache_file}: {e!r}")
+
+    def clear_cache(self):
+        self._cache.clear()
 
     def clamp_score(self, value):
         return max(self.min_score, min(self.max_score, value))
@@ -775,28 +1064,7 @@ class QwenEmotion:
 
         return emotion_dict
 
-    def inference(self, text_input):
-        start = time.time()
-        messages = [
-            {"role": "system", "content": f"{self.prompt}"},
-            {"role": "user", "content": f"{text_input}"}
-        ]
-        text = self.tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-            enable_thinking=False,
-        )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
-
-        # conduct text completion
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=32768,
-            pad_token_id=self.tokenizer.eos_token_id
-        )
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-
+    def parse(self, text_input, output_ids):
         # parsing thinking content
         try:
             # rindex finding 151668 (</think>)
@@ -829,6 +1097,59 @@ class QwenEmotion:
 
         return self.convert(content)
 
+    def batch_inference(self, text_inputs, batch_size=16):
+        """
+        Emotion dicts for many texts, in input order. Texts that are not cached are classified
+        `batch_size` at a time, each batch in a single left-padded `generate` call.
+        """
+        results = {}
+        missing = []
+        for text_input in text_inputs:
+            if text_input in results:
+                continue
+            emotions = self._cache_get(text_input)
+            if emotions is None:
+                missing.append(text_input)
+                results[text_input] = None
+            else:
+                results[text_input] = emotions
+
+        new_results = {}
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            texts = [
+                self.tokenizer.apply_chat_template(
+                    [
+                        {"role": "system", "content": f"{self.prompt}"},
+                        {"role": "user", "content": f"{text_input}"}
+                    ],
+                    tokenize=False,
+                    add_generation_prompt=True,
+                    enable_thinking=False,
+                )
+                for text_input in batch
+            ]
+            model_inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
+            model_inputs = model_inputs.to(self.model.device)
+
+            # conduct text completion
+            generated_ids = self.model.generate(
+                **model_inputs,
+                max_new_tokens=self.max_new_tokens,
+                pad_token_id=self.tokenizer.eos_token_id
+            )
+            generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:].tolist()
+            for text_input, output_ids in zip(batch, generated_ids):
+                emotions = self.parse(text_input, output_ids)
+                results[text_input] = new_results[text_input] = emotions
+                self._cache_put(text_input, emotions)
+        self._save_to_cache_file(new_results)
+
+        return [dict(results[text_input]) for text_input in text_inputs]
+
+    def inference(self, text_input):
+        return self.batch_inference([text_input])[0]
+
 
 if __name__ == "__main__":
     prompt_wav = "examples/voice_01.wav"
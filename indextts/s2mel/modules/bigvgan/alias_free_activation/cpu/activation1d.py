@@ -0,0 +1,72 @@
+import torch
+
+from ..torch.act import Activation1d as TorchActivation1d
+
+# load fused CPU kernel: this enables importing anti_alias_activation_cpu
+from ..cpu import load
+
+anti_alias_activation_cpu = load.load()
+
+
+class Activation1d(TorchActivation1d):
+    """
+    `Activation1d` that runs upsampling, snake and downsampling as a single fused CPU kernel without
+    materializing the 2x upsampled signal.
+
+    Assumes filter size 12, ratio 2 and replication padding on upsampling/downsampling, like the CUDA kernel.
+    Falls back to the torch implementation for other devices and when gradients are required.
+    """
+
+    def __init__(self, activation, up_ratio: int = 2, down_ratio: int = 2, up_kernel_size: int = 12,
+                 down_kernel_size: int = 12, fused: bool = True):
+        super().__init__(activation, up_ratio, down_ratio, up_kernel_size, down_kernel_size)
+        self.fused = fused and up_ratio == down_ratio == 2 and up_kernel_size == down_kernel_size == 12
+
+    def _snake_params(self):
+        alpha = self.act.alpha.detach()
+        # Snake uses the same parameter for alpha and beta
+        beta = self.act.beta.detach() if hasattr(self.act, "beta") else alpha
+        if self.act.alpha_logscale:
+            alpha, beta = torch.exp(alpha), torch.exp(beta)
+        return alpha, 1.0 / (beta + self.act.no_div_by_zero)
+
+    def forward(self, x):
+        if not self.fused or x.device.type != "cpu" or (torch.is_grad_enabled() and x.requires_grad):
+            return super().forward(x)
+        alpha, inv_beta = self._snake_params()
+        return anti_alias_activation_cpu.forward(
+            x, self.upsample.filter, self.downsample.lowpass.filter, alpha, inv_beta
+        )
+
+
+if __name__ == "__main__":
+    # vocoder benchmark on CPU: random-init BigVGAN from the bundled config with the torch activations
+    # vs the fused kernel, same weights, e.g.
+    #   python -m indextts.s2mel.modules.bigvgan.alias_free_activation.cpu.activation1d [frames]
+    import os
+    import sys
+    import time
+
+    from ...bigvgan import BigVGAN, load_hparams_from_json
+
+    torch.manual_seed(0)
+    h = load_hparams_from_json(os.path.join(os.path.dirname(__file__), "..", "..", "config.json"))
+    models = {}
+    for name, use_cpu_kernel in (("torch", False), ("fused", True)):
+        models[name] = BigVGAN(h, use_cpu_kernel=use_cpu_kernel).eval()
+        models[name].remove_weight_norm()
+    models["fused"].load_state_dict(models["torch"].state_dict())
+    mel = torch.randn(1, h.num_mels, int(sys.argv[1]) if len(sys.argv) > 1 else 200)
+    timings = {name: [] for name in models}
+    with torch.inference_mode():
+        wavs = {name: model(mel) for name, model in models.items()}
+        for _ in range(3):
+            for name, model in models.items():
+                t0 = time.perf_counter()
+                model(mel)
+                timings[name].append(time.perf_counter() - t0)
+    err = (wavs["fused"] - wavs["torch"]).abs().max().item()
+    print(f">> {mel.size(-1)} frames, {torch.get_num_threads()} threads, max abs diff {err:.2e}")
+    assert err < 1e-4, "fused output differs from the torch output"
+    for name, ts in timings.items():
+        print(f">> {name}: {min(ts):.3f}s")
@@ -0,0 +1,163 @@
+/* Fused anti-aliased activation (2x upsample -> snake -> 2x downsample) for CPU.
+ *
+ * Same contract as the CUDA kernel in ../cuda: filter size 12, ratio 2 and replication padding on
+ * both resampling steps, matching the torch implementation in ../torch. The upsampled signal is never
+ * materialized: every (batch, channel) row is processed in tiles of TILE output samples, the polyphase
+ * upsampler writes the 2x samples a tile needs into a small scratch buffer, the snake is applied in
+ * place and the downsampling filter reads them back.
+ */
+
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+namespace
+{
+    // Hard-coded hyperparameters, matching the torch implementation
+    constexpr int FILTER_SIZE = 12;
+    constexpr int HALF_FILTER_SIZE = 6;
+    constexpr int DOWNSAMPLE_REPLICATION_PAD_LEFT = 5;
+    // upsampled samples read by the downsampling filter around the 2 * TILE samples of a tile
+    constexpr int DOWNSAMPLE_HALO = FILTER_SIZE - 2;
+    // input samples read by the polyphase upsampler to the left of a phase sample
+    constexpr int UPSAMPLE_HALO = 3;
+    constexpr int64_t TILE = 1024;
+
+    template <typename scalar_t>
+    void anti_alias_activation_row(
+        scalar_t *dst,
+        const scalar_t *src,
+        int64_t seq_len,
+        const scalar_t *up_even,
+        const scalar_t *up_odd,
+        const scalar_t *down_ftr,
+        scalar_t alpha,
+        scalar_t inv_beta,
+        scalar_t *x_buf,
+        scalar_t *u_buf)
+    {
+        const int64_t up_len = 2 * seq_len;
+        for (int64_t o0 = 0; o0 < seq_len; o0 += TILE)
+        {
+            const int64_t o1 = std::min(o0 + TILE, seq_len);
+            // upsampled samples [u0, u1) read by outputs [o0, o1), before replication padding
+            const int64_t u0 = 2 * o0 - DOWNSAMPLE_REPLICATION_PAD_LEFT;
+            const int64_t u1 = 2 * o1 + DOWNSAMPLE_HALO - DOWNSAMPLE_REPLICATION_PAD_LEFT;
+            const int64_t n_lo = std::max<int64_t>(u0, 0);
+            const int64_t n_hi = std::min<int64_t>(u1, up_len);
+
+            // input samples, replication padded, so that x_buf[j] = src[i0 - UPSAMPLE_HALO + j]
+            const int64_t i0 = n_lo >> 1;
+            const int64_t i1 = (n_hi - 1) >> 1;
+            const int64_t x_len = i1 - i0 + 1 + 2 * UPSAMPLE_HALO;
+            for (int64_t j = 0; j < x_len; ++j)
+            {
+                const int64_t idx = std::min(std::max<int64_t>(i0 - UPSAMPLE_HALO + j, 0), seq_len - 1);
+                x_buf[j] = src[idx];
+            }
+
+            // polyphase upsampling: u[2i] reads src[i - 3 .. i + 2] and u[2i + 1] reads src[i - 2 .. i + 3]
+            scalar_t *u = u_buf - u0; // u[n] for n in [u0, u1)
+            for (int64_t i = i0; i <= i1; ++i)
+            {
+                const scalar_t *xe = x_buf + (i - i0);
+                const scalar_t *xo = x_buf + (i - i0) + 1;
+                scalar_t even = 0, odd = 0;
+                for (int m = 0; m < HALF_FILTER_SIZE; ++m)
+                {
+                    even += up_even[m] * xe[HALF_FILTER_SIZE - 1 - m];
+                    odd += up_odd[m] * xo[HALF_FILTER_SIZE - 1 - m];
+                }
+                if (2 * i >= n_lo)
+                    u[2 * i] = even;
+                if (2 * i + 1 < n_hi)
+                    u[2 * i + 1] = odd;
+            }
+
+            // snake: x + 1 / beta * sin(alpha * x)^2
+            for (int64_t n = n_lo; n < n_hi; ++n)
+            {
+                const scalar_t s = std::sin(u[n] * alpha);
+                u[n] += inv_beta * s * s;
+            }
+
+            // replication padding of the activated signal at the sequence edges
+            for (int64_t n = u0; n < n_lo; ++n)
+                u[n] = u[0];
+            for (int64_t n = n_hi; n < u1; ++n)
+                u[n] = u[up_len - 1];
+
+            // downsampling: 12-tap filter with stride 2
+            for (int64_t i = o0; i < o1; ++i)
+            {
+                const scalar_t *ui = u + 2 * i - DOWNSAMPLE_REPLICATION_PAD_LEFT;
+                scalar_t acc = 0;
+                for (int k = 0; k < FILTER_SIZE; ++k)
+                    acc += down_ftr[k] * ui[k];
+                dst[i] = acc;
+            }
+        }
+    }
+}
+
+torch::Tensor fwd_cpu(
+    torch::Tensor const &input,
+    torch::Tensor const &up_filter,
+    torch::Tensor const &down_filter,
+    torch::Tensor const &alpha,
+    torch::Tensor const &inv_beta)
+{
+    TORCH_CHECK(input.device().is_cpu() && input.dim() == 3, "input must be a [B, C, T] CPU tensor");
+    TORCH_CHECK(up_filter.numel() == FILTER_SIZE && down_filter.numel() == FILTER_SIZE,
+                "the fused kernel only supports filters of size ", FILTER_SIZE);
+    const int64_t batch_size = input.size(0);
+    const int64_t channels = input.size(1);
+    const int64_t seq_len = input.size(2);
+    TORCH_CHECK(alpha.numel() == channels && inv_beta.numel() == channels, "alpha/beta must have one value per channel");
+
+    auto src = input.contiguous();
+    auto output = torch::empty_like(src);
+    if (seq_len == 0)
+        return output;
+
+    AT_DISPATCH_FLOATING_TYPES(src.scalar_type(), "anti_alias_activation_cpu", [&] {
+        // upsampling by 2 scales the filter by the ratio; split its taps into the two output phases
+        auto up = up_filter.to(src.scalar_type()).contiguous().view(-1);
+        auto up_ptr = up.data_ptr<scalar_t>();
+        scalar_t up_even[HALF_FILTER_SIZE], up_odd[HALF_FILTER_SIZE];
+        for (int m = 0; m < HALF_FILTER_SIZE; ++m)
+        {
+            up_even[m] = 2 * up_ptr[1 + 2 * m];
+            up_odd[m] = 2 * up_ptr[2 * m];
+        }
+        auto down = down_filter.to(src.scalar_type()).contiguous();
+        auto alpha_c = alpha.to(src.scalar_type()).contiguous();
+        auto inv_beta_c = inv_beta.to(src.scalar_type()).contiguous();
+        const scalar_t *down_ptr = down.data_ptr<scalar_t>();
+        const scalar_t *alpha_ptr = alpha_c.data_ptr<scalar_t>();
+        const scalar_t *inv_beta_ptr = inv_beta_c.data_ptr<scalar_t>();
+        const scalar_t *src_ptr = src.data_ptr<scalar_t>();
+        scalar_t *dst_ptr = output.data_ptr<scalar_t>();
+
+        at::parallel_for(0, batch_size * channels, 1, [&](int64_t begin, int64_t end) {
+            std::vector<scalar_t> x_buf(TILE + 2 * UPSAMPLE_HALO + 8);
+            std::vector<scalar_t> u_buf(2 * TILE + DOWNSAMPLE_HALO + 8);
+            for (int64_t row = begin; row < end; ++row)
+            {
+                const int64_t c = row % channels;
+                anti_alias_activation_row<scalar_t>(
+                    dst_ptr + row * seq_len, src_ptr + row * seq_len, seq_len, up_even, up_odd, down_ptr,
+                    alpha_ptr[c], inv_beta_ptr[c], x_buf.data(), u_buf.data());
+            }
+        });
+    });
+    return output;
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m)
+{
+    m.def("forward", &fwd_cpu, "Anti-Alias Activation forward (CPU)");
+}
@@ -0,0 +1,29 @@
+import os
+import pathlib
+
+from torch.utils import cpp_extension
+
+
+def load():
+    # Build path, next to the sources like the CUDA kernel
+    srcpath = pathlib.Path(__file__).parent.absolute()
+    buildpath = srcpath / "build"
+    _create_build_dir(buildpath)
+
+    # -fopenmp lets at::parallel_for split the (batch, channel) rows over the intra-op threads
+    return cpp_extension.load(
+        name="anti_alias_activation_cpu",
+        sources=[srcpath / "anti_alias_activation_cpu.cpp"],
+        build_directory=buildpath,
+        extra_cflags=["-O3", "-ffast-math", "-fopenmp"],
+        extra_ldflags=["-fopenmp", "-lmvec"],
+        verbose=False,
+    )
+
+
+def _create_build_dir(buildpath):
+    try:
+        os.mkdir(buildpath)
+    except OSError:
+        if not os.path.isdir(buildpath):
+            print(f"Creation of the build directory {buildpath} failed")
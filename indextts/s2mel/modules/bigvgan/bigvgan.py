@@ -91,13 +91,19 @@ class AMPBlock1(torch.nn.Module):
             self.convs2
         )  # Total number of conv layers
 
-        # Select which Activation1d, lazy-load cuda version to ensure backward compatibility
+        # Select which Activation1d, lazy-load cuda/cpu versions to ensure backward compatibility
         if self.h.get("use_cuda_kernel", False):
             from .alias_free_activation.cuda.activation1d import (
                 Activation1d as CudaActivation1d,
             )
 
             Activation1d = CudaActivation1d
+        elif self.h.get("use_cpu_kernel", False):
+            from .alias_free_activation.cpu.activation1d import (
+                Activation1d as CpuActivation1d,
+            )
+
+            Activation1d = CpuActivation1d
         else:
             Activation1d = TorchActivation1d
 
@@ -191,13 +197,19 @@ class AMPBlock2(torch.nn.Module):
 
         self.num_layers = len(self.convs)  # Total number of conv layers
 
-        # Select which Activation1d, lazy-load cuda version to ensure backward compatibility
+        # Select which Activation1d, lazy-load cuda/cpu versions to ensure backward compatibility
         if self.h.get("use_cuda_kernel", False):
             from .alias_free_activation.cuda.activation1d import (
                 Activation1d as CudaActivation1d,
             )
 
             Activation1d = CudaActivation1d
+        elif self.h.get("use_cpu_kernel", False):
+            from .alias_free_activation.cpu.activation1d import (
+                Activation1d as CpuActivation1d,
+            )
+
+            Activation1d = CpuActivation1d
         else:
             Activation1d = TorchActivation1d
 
@@ -257,24 +269,32 @@ class BigVGAN(
     Args:
         h (AttrDict): Hyperparameters.
         use_cuda_kernel (bool): If set to True, loads optimized CUDA kernels for AMP. This should be used for inference only, as training is not supported with CUDA kernels.
+        use_cpu_kernel (bool): If set to True, loads the fused C++ anti-aliased activation for AMP on CPU. Other devices and inputs requiring gradients fall back to the torch implementation.
 
     Note:
         - The `use_cuda_kernel` parameter should be used for inference only, as training with CUDA kernels is not supported.
         - Ensure that the activation function is correctly specified in the hyperparameters (h.activation).
     """
 
-    def __init__(self, h: AttrDict, use_cuda_kernel: bool = False):
+    def __init__(self, h: AttrDict, use_cuda_kernel: bool = False, use_cpu_kernel: bool = False):
         super().__init__()
         self.h = h
         self.h["use_cuda_kernel"] = use_cuda_kernel
+        self.h["use_cpu_kernel"] = use_cpu_kernel
 
-        # Select which Activation1d, lazy-load cuda version to ensure backward compatibility
+        # Select which Activation1d, lazy-load cuda/cpu versions to ensure backward compatibility
         if self.h.get("use_cuda_kernel", False):
             from .alias_free_activation.cuda.activation1d import (
                 Activation1d as CudaActivation1d,
             )
 
             Activation1d = CudaActivation1d
+        elif self.h.get("use_cpu_kernel", False):
+            from .alias_free_activation.cpu.activation1d import (
+                Activation1d as CpuActivation1d,
+            )
+
+            Activation1d = CpuActivation1d
         else:
             Activation1d = TorchActivation1d
 
@@ -425,6 +445,7 @@ class BigVGAN(
             map_location: str = "cpu",  # Additional argument
             strict: bool = False,  # Additional argument
             use_cuda_kernel: bool = False,
+            use_cpu_kernel: bool = False,
             **model_kwargs,
     ):
         """Load Pytorch pretrained weights and return the loaded model."""
@@ -458,7 +479,7 @@ class BigVGAN(
             print(
                 f"[WARNING] For detail, see the official GitHub repository: https://github.com/NVIDIA/BigVGAN?tab=readme-ov-file#using-custom-cuda-kernel-for-synthesis"
             )
-        model = cls(h, use_cuda_kernel=use_cuda_kernel)
+        model = cls(h, use_cuda_kernel=use_cuda_kernel, use_cpu_kernel=use_cpu_kernel)
 
         # Download and load pretrained generator weight
         if os.path.isdir(model_id):
@@ -0,0 +1,154 @@
+"""
+Chunked BigVGAN vocoding with bounded memory.
+
+BigVGAN is fully convolutional, so an output frame only depends on a limited number of mel frames
+around it. `ChunkedVocoder` vocodes windows of `chunk_frames` mel frames padded with that much context
+on both sides and keeps only the samples of the window's own frames (overlap-save). The stitched
+waveform matches vocoding the whole mel at once up to floating point noise, while peak memory only
+depends on the window size. The same loop serves streaming: `feed()` mel to a `VocoderStream` as it
+is produced and each call returns the samples whose right context is complete.
+"""
+import math
+
+import torch
+from torch import nn
+
+from .bigvgan import AMPBlock1, AMPBlock2, BigVGAN
+
+
+def _conv_radius(conv: nn.Module) -> int:
+    return conv.dilation[0] * (conv.kernel_size[0] - 1) // 2
+
+
+def _activation_radius(act: nn.Module) -> int:
+    # anti-aliased activation: upsampling filter, pointwise snake, downsampling filter, in input samples
+    up, down = act.upsample, act.downsample
+    return up.kernel_size // (2 * up.ratio) + down.kernel_size // (2 * down.ratio) + 1
+
+
+def _block_radius(block: nn.Module) -> int:
+    # the convs of an AMP block run one after another, the residual path only narrows the field
+    if isinstance(block, AMPBlock1):
+        convs = list(block.convs1) + list(block.convs2)
+    elif isinstance(block, AMPBlock2):
+        convs = list(block.convs)
+    else:
+        raise TypeError(f"Unsupported resblock {type(block).__name__}")
+    return sum(_conv_radius(c) for c in convs) + sum(_activation_radius(a) for a in block.activations)
+
+
+def receptive_field_frames(model: BigVGAN) -> int:
+    """
+    Upper bound on the number of mel frames on each side that an output frame of `model` depends on.
+    """
+    frames = float(_conv_radius(model.conv_pre))
+    rate = 1  # output samples per mel frame at the current stage
+    for i, ups in enumerate(model.ups):
+        for up in ups:
+            frames += math.ceil(up.kernel_size[0] / up.stride[0]) / rate
+            rate *= up.stride[0]
+        blocks = model.resblocks[i * model.num_kernels:(i + 1) * model.num_kernels]
+        frames += max(_block_radius(b) for b in blocks) / rate
+    frames += (_activation_radius(model.activation_post) + _conv_radius(model.conv_post)) / rate
+    return math.ceil(frames)
+
+
+class ChunkedVocoder:
+    """
+    Vocode mels in windows of `chunk_frames` frames with `context_frames` of context on each side.
+
+    Only holds the vocoder and the window sizes, so one instance can be shared by concurrent callers;
+    the state of a stream lives in the `VocoderStream` returned by `stream()`.
+
+    Args:
+        vocoder: `BigVGAN` model, or any fully convolutional mel -> (B, 1, frames * hop_length) module
+            when `context_frames` and `hop_length` are given.
+        chunk_frames: mel frames emitted per window; a mel of at most `chunk_frames + context_frames`
+            frames is vocoded in a single call.
+        context_frames: context on each side, defaults to `receptive_field_frames(vocoder)`.
+        hop_length: output samples per mel frame, defaults to the product of the upsample rates.
+    """
+
+    def __init__(self, vocoder: nn.Module, chunk_frames: int = 1024, context_frames: int = None,
+                 hop_length: int = None):
+        assert chunk_frames > 0, "chunk_frames must be positive"
+        self.vocoder = vocoder
+        self.chunk_frames = chunk_frames
+        self.context_frames = receptive_field_frames(vocoder) if context_frames is None else context_frames
+        self.hop_length = math.prod(vocoder.h.upsample_rates) if hop_length is None else hop_length
+
+    def stream(self) -> "VocoderStream":
+        """Start a new stream: `feed()` mel as it is produced, then `flush()`."""
+        return VocoderStream(self)
+
+    def __call__(self, mel: torch.Tensor) -> torch.Tensor:
+        """
+        Vocode a whole mel (B, num_mels, frames) window by window, returns (B, 1, frames * hop_length).
+        """
+        stream = self.stream()
+        head = stream.feed(mel)
+        return torch.cat([head, stream.flush()], dim=-1)
+
+
+class VocoderStream:
+    """
+    Overlap-save state of one stream of a `ChunkedVocoder`.
+    """
+
+    def __init__(self, chunked: ChunkedVocoder):
+        self.chunked = chunked
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self._mel = None  # buffered mel, frame 0 is global frame `self._offset`
+        self._offset = 0
+        self._emitted = 0  # global index of the first frame whose samples were not returned yet
+
+    def _vocode(self, start: int, end: int) -> torch.Tensor:
+        # window with left context clipped at the start of the stream; the caller supplies the right context
+        context_frames, hop_length = self.chunked.context_frames, self.chunked.hop_length
+        left = max(start - context_frames, self._offset)
+        right = min(end + context_frames, self._offset + self._mel.size(-1))
+        wav = self.chunked.vocoder(self._mel[..., left - self._offset:right - self._offset])
+        return wav[..., (start - left) * hop_length:(end - left) * hop_length]
+
+    def feed(self, mel: torch.Tensor) -> torch.Tensor:
+        """
+        Append `mel` (B, num_mels, frames) to the stream.
+
+        Returns:
+            (B, 1, samples) waveform for every frame whose right context is complete; may be empty.
+        """
+        chunk_frames, context_frames = self.chunked.chunk_frames, self.chunked.context_frames
+        self._mel = mel if self._mel is None else torch.cat([self._mel, mel], dim=-1)
+        wavs = []
+        total = self._offset + self._mel.size(-1)
+        while self._emitted + chunk_frames + context_frames < total:
+            wavs.append(self._vocode(self._emitted, self._emitted + chunk_frames))
+            self._emitted += chunk_frames
+        # drop frames no future window needs
+        drop = max(self._emitted - context_frames - self._offset, 0)
+        if drop > 0:
+            self._mel = self._mel[..., drop:]
+            self._offset += drop
+        return self._cat(wavs, mel)
+
+    def flush(self) -> torch.Tensor:
+        """
+        Vocode the remaining frames of the stream and reset it.
+        """
+        mel, wavs = self._mel, []
+        if mel is not None and self._emitted < self._offset + mel.size(-1):
+            wavs.append(self._vocode(self._emitted, self._offset + mel.size(-1)))
+        self.reset()
+        return self._cat(wavs, mel)
+
+    @staticmethod
+    def _cat(wavs, mel):
+        if wavs:
+            return torch.cat(wavs, dim=-1)
+        if mel is None:
+            return torch.zeros((1, 1, 0))
+        return mel.new_zeros((mel.size(0), 1, 0))
+
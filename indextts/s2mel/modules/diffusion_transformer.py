@@ -181,9 +181,57 @@ class DiT(torch.nn.Module):
             self.style_in = nn.Linear(args.style_encoder.dim, args.DiT.hidden_dim)
 
     def setup_caches(self, max_batch_size, max_seq_length):
-        self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False)
+        # `max_seq_length` is a cap, the RoPE table is grown per utterance by `_prepare_inputs`; the DiT passes
+        # its own attention mask, so a causal mask is only built for causal models
+        self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False, causal=self.is_causal)
         
-    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False):
+    def prepare_inference(self, prompt_x, x_lens, style, cond, mask_content=False):
+        """
+        Precompute the inputs of `forward` that stay the same across diffusion steps of one utterance:
+        the projected condition, the concatenated prompt/condition/style features, the sequence mask and
+        the attention mask. Pass the result as `forward(x, t=t, session=session)` on every step.
+
+        Args follow `forward`; stack the null-condition branch for classifier-free guidance into the
+        batch beforehand.
+        """
+        class_dropout = not self.training and mask_content
+        return self._prepare_inputs(prompt_x, x_lens, style, cond, class_dropout)
+
+    def _prepare_inputs(self, prompt_x, x_lens, style, cond, class_dropout):
+        # cond_in_module = self.cond_embedder if self.content_type == 'discrete' else self.cond_projection
+        cond_in_module = self.cond_projection
+
+        B, _, T = prompt_x.size()
+        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
+        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
+
+        # everything after the first `in_channels` features of x_in, 80+512=592
+        cond_in = torch.cat([prompt_x, cond], dim=-1)
+        if self.transformer_style_condition and not self.style_as_token: # True and True
+            cond_in = torch.cat([cond_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 784]
+
+        if class_dropout: #False
+            cond_in = cond_in * 0 # 80维后全置为0
+
+        style_token = None
+        if self.style_as_token: # False
+            style_token = self.style_in(style)
+            style_token = torch.zeros_like(style_token) if class_dropout else style_token
+
+        seq_len = T + self.style_as_token + self.time_as_token
+        self.transformer.reserve_caches(seq_len)
+        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=seq_len).to(prompt_x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+        input_pos = self.input_pos[:seq_len]  # (T,) range（0，1863）
+        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, seq_len, 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
+        return {
+            "cond_in": cond_in,
+            "style_token": style_token,
+            "x_mask": x_mask,
+            "input_pos": input_pos,
+            "attn_mask": x_mask_expanded,
+        }
+
+    def forward(self, x, prompt_x=None, x_lens=None, t=None, style=None, cond=None, mask_content=False, session=None):
         """
             x (torch.Tensor): random noise
             prompt_x (torch.Tensor): reference mel + zero mel
@@ -196,47 +244,33 @@ class DiT(torch.nn.Module):
                 shape: (batch_size, 192)
             cond (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
+            session (dict): `prepare_inference()` output; when given, prompt_x, x_lens, style and cond are
+                not used
         
         """
-        class_dropout = False
-        if self.training and torch.rand(1) < self.class_dropout_prob:
-            class_dropout = True
-        if not self.training and mask_content:
-            class_dropout = True
-        # cond_in_module = self.cond_embedder if self.content_type == 'discrete' else self.cond_projection
-        cond_in_module = self.cond_projection
-
-        B, _, T = x.size()
-
+        if session is None:
+            class_dropout = False
+            if self.training and torch.rand(1) < self.class_dropout_prob:
+                class_dropout = True
+            if not self.training and mask_content:
+                class_dropout = True
+            session = self._prepare_inputs(prompt_x, x_lens, style, cond, class_dropout)
 
         t1 = self.t_embedder(t)  # (N, D) # t1 [2, 512]
-        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
 
         x = x.transpose(1, 2) # [2,1863,80]
-        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
 
-        x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
-        
-        if self.transformer_style_condition and not self.style_as_token: # True and True
-            x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
-            
-        if class_dropout: #False
-            x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
-            
+        x_in = torch.cat([x, session["cond_in"]], dim=-1) # 80+80+512+192=864 [2, 1863, 864]
         x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
         
         if self.style_as_token: # False
-            style = self.style_in(style)
-            style = torch.zeros_like(style) if class_dropout else style
-            x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
+            x_in = torch.cat([session["style_token"].unsqueeze(1), x_in], dim=1)
             
         if self.time_as_token: # False
             x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
             
-        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
-        input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
-        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, x_in.size(1), 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
-        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, x_mask_expanded) # [2, 1863, 512]
+        x_mask = session["x_mask"]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), session["input_pos"], session["attn_mask"]) # [2, 1863, 512]
         x_res = x_res[:, 1:] if self.time_as_token else x_res
         x_res = x_res[:, 1:] if self.style_as_token else x_res
         
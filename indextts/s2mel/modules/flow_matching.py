@@ -82,20 +82,23 @@ class BASECFM(torch.nn.Module, ABC):
         x[..., :prompt_len] = 0
         if self.zero_prompt_speech_token:
             mu[..., :prompt_len] = 0
+        # prompt, condition, style and masks are the same on every step, prepare them once
+        if inference_cfg_rate > 0:
+            # Stack original and CFG (null) inputs for batched processing
+            session = self.estimator.prepare_inference(
+                torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0), x_lens,
+                torch.cat([style, torch.zeros_like(style)], dim=0), torch.cat([mu, torch.zeros_like(mu)], dim=0),
+            )
+        else:
+            session = self.estimator.prepare_inference(prompt_x, x_lens, style, mu)
         for step in tqdm(range(1, len(t_span))):
             dt = t_span[step] - t_span[step - 1]
             if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
-                stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
-                stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
-                stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
                 stacked_x = torch.cat([x, x], dim=0)
                 stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
 
                 # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
+                stacked_dphi_dt = self.estimator(stacked_x, t=stacked_t, session=session)
 
                 # Split the output back into the original and CFG components
                 dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
@@ -103,7 +106,7 @@ class BASECFM(torch.nn.Module, ABC):
                 # Apply CFG formula
                 dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
             else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+                dphi_dt = self.estimator(x, t=t.unsqueeze(0), session=session)
 
             x = x + dt * dphi_dt
             t = t + dt
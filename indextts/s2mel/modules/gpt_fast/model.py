@@ -128,27 +128,42 @@ class Transformer(nn.Module):
 
         self.freqs_cis: Optional[Tensor] = None
         self.mask_cache: Optional[Tensor] = None
+        self.causal_mask: Optional[Tensor] = None
         self.max_batch_size = -1
         self.max_seq_length = -1
-
-    def setup_caches(self, max_batch_size, max_seq_length, use_kv_cache=True):
+        self.cache_seq_length = 0
+
+    def setup_caches(self, max_batch_size, max_seq_length, use_kv_cache=True, causal=True):
+        """
+        With `use_kv_cache`, the KV caches, RoPE table and causal mask are allocated for `max_seq_length` up front.
+        Otherwise `max_seq_length` only caps the sequence length: the RoPE table (and the causal mask if `causal`)
+        are grown by `reserve_caches()` to the longest sequence seen, and non-causal models that pass their own
+        mask never allocate a causal mask.
+        """
         if self.max_seq_length >= max_seq_length and self.max_batch_size >= max_batch_size:
             return
         head_dim = self.config.dim // self.config.n_head
         max_seq_length = find_multiple(max_seq_length, 8)
         self.max_seq_length = max_seq_length
         self.max_batch_size = max_batch_size
-        dtype = self.norm.project_layer.weight.dtype
-        device = self.norm.project_layer.weight.device
+        # read dtype/device from the norm weight, project_layer may hold quantized weights
+        dtype = self.norm.norm.weight.dtype
+        device = self.norm.norm.weight.device
 
         if not self.training and use_kv_cache:
             for b in self.layers:
                 b.attention.kv_cache = KVCache(max_batch_size, max_seq_length, self.config.n_local_heads, head_dim, dtype).to(device)
 
-        self.freqs_cis = precompute_freqs_cis(self.config.block_size, self.config.head_dim,
-                                              self.config.rope_base, dtype).to(device)
-        self.causal_mask = torch.tril(torch.ones(self.max_seq_length, self.max_seq_length, dtype=torch.bool)).to(device)
         self.use_kv_cache = use_kv_cache
+        self.causal = causal
+        self.freqs_cis = None
+        self.causal_mask = None
+        self.cache_seq_length = 0
+        if use_kv_cache:
+            self.freqs_cis = precompute_freqs_cis(self.config.block_size, self.config.head_dim,
+                                                  self.config.rope_base, dtype).to(device)
+            self.causal_mask = torch.tril(torch.ones(self.max_seq_length, self.max_seq_length, dtype=torch.bool)).to(device)
+            self.cache_seq_length = self.max_seq_length
         self.uvit_skip_connection = self.config.uvit_skip_connection
         if self.uvit_skip_connection:
             self.layers_emit_skip = [i for i in range(self.config.n_layer) if i < self.config.n_layer // 2]
@@ -157,6 +172,25 @@ class Transformer(nn.Module):
             self.layers_emit_skip = []
             self.layers_receive_skip = []
 
+    def reserve_caches(self, seq_length):
+        """
+        Grow the RoPE table (and causal mask) to cover `seq_length` positions, at least doubling so that
+        a run of increasing lengths only reallocates a few times. Call it outside of compiled regions.
+        """
+        assert self.max_seq_length > 0, "Caches must be initialized first"
+        if seq_length <= self.cache_seq_length:
+            return
+        if seq_length > self.max_seq_length:
+            raise ValueError(f"sequence length {seq_length} exceeds the cache limit max_seq_length={self.max_seq_length}")
+        seq_length = min(max(find_multiple(seq_length, 256), 2 * self.cache_seq_length), self.max_seq_length)
+        dtype = self.norm.norm.weight.dtype
+        device = self.norm.norm.weight.device
+        # rows of the table do not depend on its length, so growing it keeps existing positions bitwise equal
+        self.freqs_cis = precompute_freqs_cis(seq_length, self.config.head_dim, self.config.rope_base, dtype).to(device)
+        if self.causal:
+            self.causal_mask = torch.tril(torch.ones(seq_length, seq_length, dtype=torch.bool)).to(device)
+        self.cache_seq_length = seq_length
+
     def forward(self,
                 x: Tensor,
                 c: Tensor,
@@ -168,6 +202,7 @@ class Transformer(nn.Module):
                 ) -> Tensor:
         assert self.freqs_cis is not None, "Caches must be initialized first"
         if mask is None: # in case of non-causal model
+            assert self.causal_mask is not None, "a mask is required when caches are set up with causal=False"
             if not self.training and self.use_kv_cache:
                 mask = self.causal_mask[None, None, input_pos]
             else:
@@ -9,15 +9,15 @@ from pathlib import Path
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from tokenizer import get_tokenizer
 
 try:
+    from tokenizer import get_tokenizer
     from GPTQ import GenericGPTQRunner, InputRecorder
     from eval import get_task_dict, evaluate, lm_eval
 except:
     pass
 
-from model import Transformer
+from indextts.s2mel.modules.gpt_fast.model import Transformer, find_multiple
 
 ##### Quantization Primitives ######
 
@@ -312,7 +312,8 @@ class GPTQQuantHandler(QuantHandler):
 def replace_linear_weight_only_int8_per_channel(module):
     for name, child in module.named_children():
         if isinstance(child, nn.Linear):
-            setattr(module, name, WeightOnlyInt8Linear(child.in_features, child.out_features))
+            setattr(module, name, WeightOnlyInt8Linear(child.in_features, child.out_features,
+                                                       bias=child.bias is not None))
         else:
             replace_linear_weight_only_int8_per_channel(child)
 
@@ -344,15 +345,22 @@ class WeightOnlyInt8Linear(torch.nn.Module):
 
     def __init__(self, in_features: int, out_features: int, bias: bool = True,
                  device=None, dtype=None) -> None:
-        factory_kwargs = {'device': device, 'dtype': dtype}
+        factory_kwargs = {'device': device, 'dtype': dtype or torch.bfloat16}
         super().__init__()
         self.in_features = in_features
         self.out_features = out_features
-        self.register_buffer("weight", torch.empty((out_features, in_features), dtype=torch.int8))
-        self.register_buffer("scales", torch.ones(out_features, dtype=torch.bfloat16))
+        self.register_buffer("weight", torch.empty((out_features, in_features), dtype=torch.int8, device=device))
+        self.register_buffer("scales", torch.ones(out_features, **factory_kwargs))
+        if bias:
+            self.register_buffer("bias", torch.zeros(out_features, **factory_kwargs))
+        else:
+            self.bias = None
 
     def forward(self, input: torch.Tensor) -> torch.Tensor:
-        return F.linear(input, self.weight.to(dtype=input.dtype)) * self.scales
+        output = F.linear(input, self.weight.to(dtype=input.dtype)) * self.scales
+        if self.bias is not None:
+            output = output + self.bias
+        return output
 
 ##### weight only int4 per channel groupwise quantized code ######
 
@@ -421,8 +429,6 @@ class WeightOnlyInt4QuantHandler:
                 weight = mod.weight.data
                 if not _check_linear_int4_k(in_features, self.groupsize, self.inner_k_tiles):
                     if self.padding:
-                        from model import find_multiple
-                        import torch.nn.functional as F
                         print(f"warning: {fqn} is padded to satisfy in_features % 1024 == 0")
                         padded_in_features = find_multiple(in_features, 1024)
                         weight = F.pad(weight, pad=(0, padded_in_features - in_features))
@@ -444,7 +450,6 @@ class WeightOnlyInt4QuantHandler:
 
 class WeightOnlyInt4GPTQQuantHandler(GPTQQuantHandler):
     def __init__(self, mod, groupsize=128, inner_k_tiles=8, padding=True):
-        from model import find_multiple
         self.mod = mod
         self.groupsize = groupsize
         self.inner_k_tiles = inner_k_tiles
@@ -493,7 +498,6 @@ class WeightOnlyInt4Linear(torch.nn.Module):
         super().__init__()
         self.padding = padding
         if padding:
-            from model import find_multiple
             self.origin_in_features = in_features
             in_features = find_multiple(in_features, 1024)
 
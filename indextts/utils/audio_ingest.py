@@ -0,0 +1,95 @@
+"""
+Decoding and resampling of reference prompts.
+
+A prompt file is decoded once at `PROMPT_SAMPLE_RATE` and memoized by the hash of its content, so
+switching back to a voice that was used before, or using the same file as speaker and emotion
+reference, does not decode it again. The other rates IndexTTS2 needs are views resampled with
+torchaudio kernels that are built once per (source, target) rate pair.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import librosa
+import torch
+import torchaudio
+
+PROMPT_SAMPLE_RATE = 22050  # librosa's default decoding rate, used for the s2mel reference mel
+
+
+@lru_cache(maxsize=None)
+def get_resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    """
+    Shared `Resample` module, its sinc kernel is only computed on the first call for a rate pair.
+    """
+    return torchaudio.transforms.Resample(orig_freq, new_freq)
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PromptAudio:
+    """
+    Mono reference audio (1, samples) at `sample_rate`, with resampled views computed on first use.
+    """
+
+    def __init__(self, audio: torch.Tensor, sample_rate: int):
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self._views = {sample_rate: audio}
+
+    def resample(self, sample_rate: int) -> torch.Tensor:
+        view = self._views.get(sample_rate)
+        if view is None:
+            view = get_resampler(self.sample_rate, sample_rate)(self.audio)
+            self._views[sample_rate] = view
+        return view
+
+
+class AudioIngest:
+    """
+    LRU of decoded prompts keyed by (file content hash, max length), holding at most `max_entries` prompts.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: str, max_audio_length_seconds: float = None, verbose=False) -> PromptAudio:
+        """
+        Decode `path` to mono at `PROMPT_SAMPLE_RATE`, cut to `max_audio_length_seconds`, or return the
+        memoized prompt if a file with the same content was loaded before.
+        """
+        key = (file_digest(path), max_audio_length_seconds)
+        with self._lock:
+            prompt = self._entries.get(key)
+            if prompt is not None:
+                self._entries.move_to_end(key)
+                return prompt
+
+        audio, sr = librosa.load(path, sr=PROMPT_SAMPLE_RATE)
+        audio = torch.tensor(audio).unsqueeze(0)
+        if max_audio_length_seconds is not None:
+            max_audio_samples = int(max_audio_length_seconds * sr)
+            if audio.shape[1] > max_audio_samples:
+                if verbose:
+                    print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
+                audio = audio[:, :max_audio_samples]
+        prompt = PromptAudio(audio, sr)
+
+        with self._lock:
+            self._entries[key] = prompt
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return prompt
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -120,3 +120,48 @@ def safe_log(x: torch.Tensor, clip_val: float = 1e-7) -> torch.Tensor:
         Tensor: Element-wise logarithm of the input tensor with clipping applied.
     """
     return torch.log(torch.clip(x, min=clip_val))
+
+
+def stop_token_lengths(codes: torch.Tensor, stop_token: int) -> torch.Tensor:
+    """
+    Length of every sequence up to (excluding) its first `stop_token`, or the full length if it has none.
+
+    Args:
+        codes (Tensor): Batch of token ids (B, T).
+    Returns:
+        Tensor: Lengths (B,), int64.
+    """
+    is_stop = codes == stop_token
+    full_len = torch.full_like(codes[:, 0], codes.size(1), dtype=torch.long)
+    return torch.where(is_stop.any(dim=1), is_stop.int().argmax(dim=1), full_len)
+
+
+def remove_long_silence(codes: torch.Tensor, stop_token: int, silent_token: int = 52, max_consecutive: int = 30,
+                        max_silent_run: int = 10):
+    """
+    Trim every sequence at its first `stop_token` and, in sequences containing more than `max_consecutive`
+    `silent_token`s, keep only the first `max_silent_run` tokens of each run of silence.
+
+    Args:
+        codes (Tensor): Batch of mel codes (B, T).
+    Returns:
+        (codes, code_lens): codes clipped to the longest result (B, T'), right padded with `stop_token` if any
+        sequence was compressed; lengths (B,), int64.
+    """
+    code_lens = stop_token_lengths(codes, stop_token)
+    silent = codes == silent_token
+    compress = silent.sum(dim=1) > max_consecutive
+    if not compress.any():
+        return codes[:, :int(code_lens.max())], code_lens
+
+    positions = torch.arange(codes.size(1), device=codes.device).expand_as(codes)
+    # 1-based position of a silent token inside its run: distance to the last non-silent token before it
+    last_voiced = torch.where(silent, -1, positions).cummax(dim=1).values
+    keep = (~silent) | (positions - last_voiced <= max_silent_run) | (~compress).unsqueeze(1)
+    keep &= positions < code_lens.unsqueeze(1)
+    code_lens = keep.sum(dim=1)
+    new_positions = keep.long().cumsum(dim=1) - 1
+    out = codes.new_full((codes.size(0), int(code_lens.max())), stop_token)
+    rows = torch.arange(codes.size(0), device=codes.device).unsqueeze(1).expand_as(codes)
+    out[rows[keep], new_positions[keep]] = codes[keep]
+    return out, code_lens
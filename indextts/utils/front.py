@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
-from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import os
 import traceback
 import re
-from typing import List, Union, overload
+from typing import List, NamedTuple, Union, overload
 import warnings
 from indextts.utils.common import tokenize_by_CJK_char, de_tokenized_by_CJK_char
 from sentencepiece import SentencePieceProcessor
@@ -54,7 +56,12 @@ class TextNormalizer:
             "$": ".",
             **self.char_rep_map,
         }
+        self.char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
+        self.zh_char_rep_pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
         self.enable_glossary = enable_glossary
+        # 术语词汇表版本号，每次修改词汇表时递增，用于使下游缓存失效
+        self.glossary_version = 0
+        self._glossary_patterns = {}
         # 术语词汇表：用户可自定义专业术语的读法
         # 格式: {"原始术语": {"en": "英文读法", "zh": "中文读法"}}
         # "M.2": {"en": "M dot two", "zh": "M 二"},
@@ -73,10 +80,29 @@ class TextNormalizer:
         # }
         self.term_glossary = dict()
 
+    @property
+    def term_glossary(self):
+        return self._term_glossary
+
+    @term_glossary.setter
+    def term_glossary(self, glossary):
+        self._term_glossary = glossary
+        self._on_glossary_changed()
+
+    def _on_glossary_changed(self):
+        self.glossary_version += 1
+        self._glossary_patterns = {}
+
+    @property
+    def cache_key(self):
+        """
+        归一化结果依赖的状态，可作为缓存键的一部分
+        """
+        return (self.enable_glossary, self.glossary_version)
+
     def match_email(self, email):
         # 正则表达式匹配邮箱格式：数字英文@数字英文.英文
-        pattern = r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$"
-        return re.match(pattern, email) is not None
+        return TextNormalizer._EMAIL_RE.match(email) is not None
 
     PINYIN_TONE_PATTERN = r"(?<![a-z])((?:[bpmfdtnlgkhjqxzcsryw]|[zcs]h)?(?:[aeiouüv]|[ae]i|u[aio]|ao|ou|i[aue]|[uüv]e|[uvü]ang?|uai|[aeiuv]n|[aeio]ng|ia[no]|i[ao]ng)|ng|er)([1-5])"
     """
@@ -101,15 +127,25 @@ class TextNormalizer:
     # 匹配常见英语缩写 's，仅用于替换为 is，不匹配所有 's
     ENGLISH_CONTRACTION_PATTERN = r"(what|where|who|which|how|t?here|it|s?he|that|this)'s"
 
+    # 预编译的正则
+    _EMAIL_RE = re.compile(r"^[a-zA-Z0-9]+@[a-zA-Z0-9]+\.[a-zA-Z]+$")
+    _CHINESE_RE = re.compile(r"[\u4e00-\u9fff]")
+    _ALPHA_RE = re.compile(r"[a-zA-Z]")
+    _PINYIN_TONE_RE = re.compile(PINYIN_TONE_PATTERN, re.IGNORECASE)
+    _NAME_RE = re.compile(NAME_PATTERN, re.IGNORECASE)
+    _TECH_TERM_RE = re.compile(TECH_TERM_PATTERN)
+    _ENGLISH_CONTRACTION_RE = re.compile(ENGLISH_CONTRACTION_PATTERN, re.IGNORECASE)
+    _TECH_PLACEHOLDER_RE = re.compile(r"\s*<H>\s*")
+
 
     def use_chinese(self, s):
-        has_chinese = bool(re.search(r"[\u4e00-\u9fff]", s))
-        has_alpha = bool(re.search(r"[a-zA-Z]", s))
+        has_chinese = bool(TextNormalizer._CHINESE_RE.search(s))
+        has_alpha = bool(TextNormalizer._ALPHA_RE.search(s))
         is_email = self.match_email(s)
         if has_chinese or not has_alpha or is_email:
             return True
 
-        has_pinyin = bool(re.search(TextNormalizer.PINYIN_TONE_PATTERN, s, re.IGNORECASE))
+        has_pinyin = bool(TextNormalizer._PINYIN_TONE_RE.search(s))
         return has_pinyin
 
     def load(self):
@@ -142,7 +178,7 @@ class TextNormalizer:
             print("Error, text normalizer is not initialized !!!")
             return ""
         if self.use_chinese(text):
-            text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+            text = TextNormalizer._ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
             # 应用术语词汇表（优先级最高，在所有保护之前）
             if self.enable_glossary:
                 text = self.apply_glossary_terms(text, lang="zh")
@@ -162,11 +198,10 @@ class TextNormalizer:
             result = self.restore_pinyin_tones(result, pinyin_list)
             # 恢复技术术语
             result = self.restore_tech_terms(result, tech_list)
-            pattern = re.compile("|".join(re.escape(p) for p in self.zh_char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
+            result = self.zh_char_rep_pattern.sub(lambda x: self.zh_char_rep_map[x.group()], result)
         else:
             try:
-                text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
+                text = TextNormalizer._ENGLISH_CONTRACTION_RE.sub(r"\1 is", text)
                 # 应用术语词汇表（优先级最高，在所有保护之前）
                 if self.enable_glossary:
                     text = self.apply_glossary_terms(text, lang="en")
@@ -178,8 +213,7 @@ class TextNormalizer:
             except Exception:
                 result = text
                 print(traceback.format_exc())
-            pattern = re.compile("|".join(re.escape(p) for p in self.char_rep_map.keys()))
-            result = pattern.sub(lambda x: self.char_rep_map[x.group()], result)
+            result = self.char_rep_pattern.sub(lambda x: self.char_rep_map[x.group()], result)
         return result
 
     def correct_pinyin(self, pinyin: str):
@@ -201,8 +235,7 @@ class TextNormalizer:
         例如：克里斯托弗·诺兰 -> <n_a>
         """
         # 人名
-        name_pattern = re.compile(TextNormalizer.NAME_PATTERN, re.IGNORECASE)
-        original_name_list = re.findall(name_pattern, original_text)
+        original_name_list = TextNormalizer._NAME_RE.findall(original_text)
         if len(original_name_list) == 0:
             return (original_text, None)
         original_name_list = list(set("".join(n) for n in original_name_list))
@@ -236,8 +269,7 @@ class TextNormalizer:
         例如：GPT-5-nano -> GPT<H>5<H>nano，然后 5 被转换为 五
         最终恢复为：GPT-五-nano
         """
-        tech_pattern = re.compile(TextNormalizer.TECH_TERM_PATTERN)
-        original_tech_list = tech_pattern.findall(original_text)
+        original_tech_list = TextNormalizer._TECH_TERM_RE.findall(original_text)
         if len(original_tech_list) == 0:
             return (original_text, None)
 
@@ -264,7 +296,7 @@ class TextNormalizer:
 
         # 清理 <H> 周围可能的空格，然后恢复为连字符
         # 处理模式: " <H> " -> "-", " <H>" -> "-", "<H> " -> "-", "<H>" -> "-"
-        transformed_text = re.sub(r'\s*<H>\s*', '-', normalized_text)
+        transformed_text = TextNormalizer._TECH_PLACEHOLDER_RE.sub('-', normalized_text)
         return transformed_text
 
     def apply_glossary_terms(self, text, lang="zh"):
@@ -285,25 +317,33 @@ class TextNormalizer:
         if not self.term_glossary:
             return text
 
-        # 按术语长度降序排列，避免短术语先匹配导致长术语无法匹配
-        # 例如："PCIe 5.0" 应该在 "PCIe" 之前匹配
-        sorted_terms = sorted(self.term_glossary.keys(), key=len, reverse=True)
-        @lru_cache(maxsize=42)
-        def get_term_pattern(term: str):
-            return re.compile(re.escape(term), re.IGNORECASE)
         transformed_text = text
-        for term in sorted_terms:
-            term_value = self.term_glossary[term]
-            if isinstance(term_value, dict):
-                replacement = term_value.get(lang, term_value.get(lang, term))
-            else:
-                replacement = term_value
+        for pattern, replacement in self._get_glossary_patterns(lang):
             # 使用正则进行大小写不敏感的替换
-            pattern = get_term_pattern(term)
             transformed_text = pattern.sub(replacement, transformed_text)
 
         return transformed_text
 
+    def _get_glossary_patterns(self, lang):
+        """
+        按语言缓存编译好的术语正则及其读法，词汇表变化时重建
+        """
+        patterns = self._glossary_patterns.get(lang)
+        if patterns is None:
+            # 按术语长度降序排列，避免短术语先匹配导致长术语无法匹配
+            # 例如："PCIe 5.0" 应该在 "PCIe" 之前匹配
+            sorted_terms = sorted(self.term_glossary.keys(), key=len, reverse=True)
+            patterns = []
+            for term in sorted_terms:
+                term_value = self.term_glossary[term]
+                if isinstance(term_value, dict):
+                    replacement = term_value.get(lang, term_value.get(lang, term))
+                else:
+                    replacement = term_value
+                patterns.append((re.compile(re.escape(term), re.IGNORECASE), replacement))
+            self._glossary_patterns[lang] = patterns
+        return patterns
+
     def load_glossary(self, glossary_dict):
         """
         加载外部术语词汇表
@@ -318,7 +358,11 @@ class TextNormalizer:
             })
         """
         if glossary_dict and isinstance(glossary_dict, dict):
+            changed = any(self.term_glossary.get(term, None) != value or term not in self.term_glossary
+                          for term, value in glossary_dict.items())
             self.term_glossary.update(glossary_dict)
+            if changed:
+                self._on_glossary_changed()
 
     def load_glossary_from_yaml(self, glossary_path):
         """
@@ -362,8 +406,7 @@ class TextNormalizer:
         例如：xuan4 -> <pinyin_a>
         """
         # 声母韵母+声调数字
-        origin_pinyin_pattern = re.compile(TextNormalizer.PINYIN_TONE_PATTERN, re.IGNORECASE)
-        original_pinyin_list = re.findall(origin_pinyin_pattern, original_text)
+        original_pinyin_list = TextNormalizer._PINYIN_TONE_RE.findall(original_text)
         if len(original_pinyin_list) == 0:
             return (original_text, None)
         original_pinyin_list = list(set("".join(p) for p in original_pinyin_list))
@@ -396,10 +439,22 @@ class TextNormalizer:
         return transformed_text
 
 
+class EncodedText(NamedTuple):
+    """
+    单行文本的前端处理结果，可直接用于合成
+    """
+    tokens: List[str]
+    segments: List[List[str]]
+    segment_ids: List[List[int]]
+
+
 class TextTokenizer:
-    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None):
+    def __init__(self, vocab_file: str, normalizer: TextNormalizer = None, cache_size: int = 4096):
         self.vocab_file = vocab_file
         self.normalizer = normalizer
+        # LRU 缓存：(文本, out_type, 归一化器状态) -> 编码结果，cache_size=0 关闭缓存
+        self.cache_size = cache_size
+        self._encode_cache = OrderedDict()
 
         if self.vocab_file is None:
             raise ValueError("vocab_file is None")
@@ -481,27 +536,78 @@ class TextTokenizer:
     def tokenize(self, text: str) -> List[str]:
         return self.encode(text, out_type=str)
 
-    def encode(self, text: str, **kwargs):
-        if len(text) == 0:
-            return []
-        if len(text.strip()) == 1:
-            return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
-        # 预处理
+    def _cache_key(self, text: str, out_type):
+        normalizer_key = self.normalizer.cache_key if self.normalizer else None
+        return (text, out_type, normalizer_key)
+
+    def _cache_get(self, key):
+        ids = self._encode_cache.get(key)
+        if ids is None:
+            return None
+        self._encode_cache.move_to_end(key)
+        return list(ids)
+
+    def _cache_put(self, key, ids):
+        if self.cache_size <= 0:
+            return
+        self._encode_cache[key] = tuple(ids)
+        self._encode_cache.move_to_end(key)
+        while len(self._encode_cache) > self.cache_size:
+            self._encode_cache.popitem(last=False)
+
+    def clear_cache(self):
+        self._encode_cache.clear()
+
+    def preprocess(self, text: str) -> str:
+        """
+        归一化 + 预分词，得到送入 sentencepiece 的文本
+        """
         if self.normalizer:
             text = self.normalizer.normalize(text)
         if len(self.pre_tokenizers) > 0:
             for pre_tokenizer in self.pre_tokenizers:
                 text = pre_tokenizer(text)
-        return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
+        return text
 
-    def batch_encode(self, texts: List[str], **kwargs):
+    def encode(self, text: str, **kwargs):
+        if len(text) == 0:
+            return []
+        out_type = kwargs.pop("out_type", int)
+        if len(text.strip()) == 1:
+            return self.sp_model.Encode(text, out_type=out_type, **kwargs)
+        # 只缓存默认参数的编码结果
+        key = self._cache_key(text, out_type) if not kwargs else None
+        if key is not None:
+            ids = self._cache_get(key)
+            if ids is not None:
+                return ids
         # 预处理
-        if self.normalizer:
-            texts = [self.normalizer.normalize(text) for text in texts]
-        if len(self.pre_tokenizers) > 0:
-            for pre_tokenizer in self.pre_tokenizers:
-                texts = [pre_tokenizer(text) for text in texts]
-        return self.sp_model.Encode(texts, out_type=kwargs.pop("out_type", int), **kwargs)
+        ids = self.sp_model.Encode(self.preprocess(text), out_type=out_type, **kwargs)
+        if key is not None:
+            self._cache_put(key, ids)
+        return ids
+
+    def batch_encode(self, texts: List[str], **kwargs):
+        out_type = kwargs.pop("out_type", int)
+        if kwargs:
+            # 预处理
+            texts = [self.preprocess(text) for text in texts]
+            return self.sp_model.Encode(texts, out_type=out_type, **kwargs)
+        results = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            ids = self._cache_get(self._cache_key(text, out_type))
+            if ids is not None:
+                results[i] = ids
+            else:
+                missing.append(i)
+        if missing:
+            # 预处理
+            encoded = self.sp_model.Encode([self.preprocess(texts[i]) for i in missing], out_type=out_type)
+            for i, ids in zip(missing, encoded):
+                self._cache_put(self._cache_key(texts[i], out_type), ids)
+                results[i] = ids
+        return results
 
     def decode(self, ids: Union[List[int], int], do_lower_case=False, **kwargs):
         if isinstance(ids, int):
@@ -603,6 +709,104 @@ class TextTokenizer:
             tokenized, self.punctuation_marks_tokens, max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
         )
 
+    def encode_for_synthesis(self, text: str, max_text_tokens_per_segment=120, quick_streaming_tokens=0) -> EncodedText:
+        """
+        tokenize + split_segments + 转换为 token id
+        """
+        tokens = self.tokenize(text)
+        segments = self.split_segments(tokens, max_text_tokens_per_segment, quick_streaming_tokens=quick_streaming_tokens)
+        return EncodedText(tokens, segments, [self.convert_tokens_to_ids(seg) for seg in segments])
+
+    def parallel_encode(
+        self,
+        texts: List[str],
+        max_text_tokens_per_segment=120,
+        quick_streaming_tokens=0,
+        num_workers: int = None,
+        chunk_size: int = 64,
+    ) -> List[EncodedText]:
+        """
+        使用进程池并行完成大量文本的归一化、分词和分段，结果顺序与输入一致。
+        每个子进程只初始化一次归一化器和分词器；结果同时写入本进程的编码缓存，
+        之后对同一文本调用 tokenize 会直接命中缓存。
+
+        Args:
+            texts: 待处理的文本列表
+            max_text_tokens_per_segment: 每段最大 token 数
+            quick_streaming_tokens: 同 split_segments
+            num_workers: 进程数，默认 CPU 核数；<= 1 时在当前进程串行处理
+            chunk_size: 每个任务包含的文本数
+        """
+        results = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            tokens = self._cache_get(self._cache_key(text, str)) if len(text.strip()) > 1 else None
+            if tokens is not None:
+                segments = self.split_segments(tokens, max_text_tokens_per_segment, quick_streaming_tokens=quick_streaming_tokens)
+                results[i] = EncodedText(tokens, segments, [self.convert_tokens_to_ids(seg) for seg in segments])
+            else:
+                missing.setdefault(text, []).append(i)
+        if not missing:
+            return results
+
+        unique_texts = list(missing.keys())
+        num_workers = num_workers or os.cpu_count() or 1
+        num_workers = min(num_workers, (len(unique_texts) + chunk_size - 1) // chunk_size)
+        if num_workers <= 1:
+            encoded = [
+                self.encode_for_synthesis(text, max_text_tokens_per_segment, quick_streaming_tokens)
+                for text in unique_texts
+            ]
+        else:
+            normalizer = self.normalizer
+            initargs = (
+                self.vocab_file,
+                normalizer is not None,
+                normalizer.enable_glossary if normalizer else False,
+                dict(normalizer.term_glossary) if normalizer else {},
+            )
+            chunks = [
+                (unique_texts[i:i + chunk_size], max_text_tokens_per_segment, quick_streaming_tokens)
+                for i in range(0, len(unique_texts), chunk_size)
+            ]
+            # spawn: 避免 fork 继承父进程中的 CUDA / 线程状态
+            with ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_frontend_worker,
+                initargs=initargs,
+            ) as executor:
+                encoded = [item for chunk in executor.map(_frontend_worker_encode, chunks) for item in chunk]
+
+        for text, item in zip(unique_texts, encoded):
+            if len(text.strip()) > 1:
+                self._cache_put(self._cache_key(text, str), item.tokens)
+            for i in missing[text]:
+                results[i] = item
+        return results
+
+
+# 并行前端的子进程状态，每个进程初始化一次
+_worker_tokenizer: TextTokenizer = None
+
+
+def _init_frontend_worker(vocab_file, use_normalizer, enable_glossary, term_glossary):
+    global _worker_tokenizer
+    normalizer = None
+    if use_normalizer:
+        normalizer = TextNormalizer(enable_glossary=enable_glossary)
+        normalizer.load()
+        normalizer.term_glossary = term_glossary
+    _worker_tokenizer = TextTokenizer(vocab_file, normalizer, cache_size=0)
+
+
+def _frontend_worker_encode(args):
+    texts, max_text_tokens_per_segment, quick_streaming_tokens = args
+    return [
+        _worker_tokenizer.encode_for_synthesis(text, max_text_tokens_per_segment, quick_streaming_tokens)
+        for text in texts
+    ]
+
 
 if __name__ == "__main__":
     # 测试程序
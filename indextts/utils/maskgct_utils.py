@@ -2,7 +2,8 @@ import torch
 import librosa
 import json5
 from huggingface_hub import hf_hub_download
-from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertModel
+from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertConfig, Wav2Vec2BertModel
+from transformers.utils import logging as hf_logging
 import safetensors
 import numpy as np
 
@@ -84,8 +85,31 @@ class JsonHParams:
         return self.__dict__.__repr__()
 
 
-def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt'):
-    semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+# the semantic feature is the w2v-bert 2.0 hidden state after this many encoder layers
+SEMANTIC_LAYER = 17
+
+
+def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt', output_layer=None,
+                         model_id="facebook/w2v-bert-2.0"):
+    """
+    With `output_layer`, only the first `output_layer` encoder layers are built and loaded, and
+    `last_hidden_state` equals `hidden_states[output_layer]` of the full model.
+    `model_id` is a hub id or a local directory holding the w2v-bert checkpoint.
+    """
+    if output_layer is None:
+        semantic_model = Wav2Vec2BertModel.from_pretrained(model_id)
+    else:
+        config = Wav2Vec2BertConfig.from_pretrained(model_id)
+        config.num_hidden_layers = output_layer
+        config.add_adapter = False
+        config.use_intermediate_ffn_before_adapter = False
+        # the weights of the dropped layers are skipped, silence the "weights not used" report
+        verbosity = hf_logging.get_verbosity()
+        hf_logging.set_verbosity_error()
+        try:
+            semantic_model = Wav2Vec2BertModel.from_pretrained(model_id, config=config)
+        finally:
+            hf_logging.set_verbosity(verbosity)
     semantic_model.eval()
     stat_mean_var = torch.load(path_)
     semantic_mean = stat_mean_var["mean"]
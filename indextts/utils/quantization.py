@@ -0,0 +1,184 @@
+"""
+Weight-only int8 / int4 quantization for running the IndexTTS2 GPT and s2mel DiT on CPU.
+
+``nn.Linear`` and GPT2 ``Conv1D`` layers are swapped for modules holding integer weights that are
+dequantized on the fly. Converted state dicts are cached on disk, keyed by the source checkpoint,
+so the conversion only runs once per checkpoint.
+"""
+import os
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+from indextts.s2mel.modules.gpt_fast.quantize import (
+    WeightOnlyInt8Linear,
+    dynamically_quantize_per_channel,
+    get_group_qparams,
+    group_dequantize_tensor_from_qparams,
+    group_quantize_tensor_from_qparams,
+)
+
+QUANT_MODES = ("int8", "int4")
+
+
+class WeightOnlyInt4GroupLinear(nn.Module):
+    """
+    Linear layer with asymmetric int4 weights (two per byte) and a bf16 scale/zero per group of
+    `groupsize` input features. Unlike `WeightOnlyInt4Linear` it does not rely on the packed
+    int4 matmul kernels, so it runs on any device and keeps the bias.
+    """
+
+    def __init__(self, in_features: int, out_features: int, bias: bool = True, groupsize: int = 128,
+                 dtype=None) -> None:
+        super().__init__()
+        assert in_features % groupsize == 0, "require in_features % groupsize == 0"
+        self.in_features = in_features
+        self.out_features = out_features
+        self.groupsize = groupsize
+        self.register_buffer("weight", torch.empty((out_features, in_features // 2), dtype=torch.uint8))
+        self.register_buffer("scales", torch.ones((out_features, in_features // groupsize), dtype=torch.bfloat16))
+        self.register_buffer("zeros", torch.zeros((out_features, in_features // groupsize), dtype=torch.bfloat16))
+        if bias:
+            self.register_buffer("bias", torch.zeros(out_features, dtype=dtype or torch.float32))
+        else:
+            self.bias = None
+
+    @torch.no_grad()
+    def quantize_(self, weight: torch.Tensor):
+        scales, zeros = get_group_qparams(weight, n_bit=4, groupsize=self.groupsize)
+        w_int32 = group_quantize_tensor_from_qparams(weight, scales, zeros, n_bit=4, groupsize=self.groupsize)
+        w_uint8 = w_int32.to(torch.uint8)
+        self.weight.copy_(w_uint8[:, 0::2] | (w_uint8[:, 1::2] << 4))
+        self.scales.copy_(scales)
+        self.zeros.copy_(zeros)
+
+    def dequantize(self, dtype: torch.dtype) -> torch.Tensor:
+        w_int = torch.stack((self.weight & 0x0F, self.weight >> 4), dim=-1).reshape(self.out_features, -1)
+        return group_dequantize_tensor_from_qparams(
+            w_int.to(dtype), self.scales.to(dtype), self.zeros.to(dtype), n_bit=4, groupsize=self.groupsize
+        )
+
+    def forward(self, input: torch.Tensor) -> torch.Tensor:
+        return F.linear(input, self.dequantize(input.dtype), self.bias)
+
+
+def _linear_weight(module: nn.Module) -> torch.Tensor:
+    # Conv1D keeps its weight as [in_features, out_features]
+    if isinstance(module, Conv1D):
+        return module.weight.t()
+    return module.weight
+
+
+def _is_quantizable(module: nn.Module, mode: str, groupsize: int) -> bool:
+    if not isinstance(module, (nn.Linear, Conv1D)):
+        return False
+    if hasattr(module, "weight_g"):
+        # weight-normed layers recompute `weight` from weight_g / weight_v on every call
+        return False
+    if mode == "int4":
+        return _linear_weight(module).shape[1] % groupsize == 0
+    return True
+
+
+def _make_quantized_linear(module: nn.Module, mode: str, groupsize: int, quantize_weights: bool) -> nn.Module:
+    weight = _linear_weight(module).detach()
+    out_features, in_features = weight.shape
+    has_bias = module.bias is not None
+    dtype = weight.dtype
+    if mode == "int8":
+        qlinear = WeightOnlyInt8Linear(in_features, out_features, bias=has_bias, dtype=dtype)
+        if quantize_weights:
+            int8_weight, scales, _ = dynamically_quantize_per_channel(weight.float(), -128, 127, torch.int8)
+            qlinear.weight.copy_(int8_weight)
+            qlinear.scales.copy_(scales)
+    else:
+        qlinear = WeightOnlyInt4GroupLinear(in_features, out_features, bias=has_bias, groupsize=groupsize,
+                                            dtype=dtype)
+        if quantize_weights:
+            qlinear.quantize_(weight.float())
+    if quantize_weights and has_bias:
+        qlinear.bias.copy_(module.bias.detach())
+    return qlinear.to(weight.device)
+
+
+@torch.no_grad()
+def replace_linear_weight_only(module: nn.Module, mode: str = "int8", groupsize: int = 128,
+                               quantize_weights: bool = True) -> nn.Module:
+    """
+    Replace every quantizable linear layer below `module` in place.
+
+    With `quantize_weights=False` only the module structure is converted, ready for
+    `load_state_dict` from a cached quantized state dict.
+    """
+    assert mode in QUANT_MODES, f"Unsupported quantization mode: {mode}"
+    for name, child in module.named_children():
+        if _is_quantizable(child, mode, groupsize):
+            setattr(module, name, _make_quantized_linear(child, mode, groupsize, quantize_weights))
+        else:
+            replace_linear_weight_only(child, mode, groupsize, quantize_weights)
+    return module
+
+
+def _replace_targets(model: nn.Module, targets, mode: str, groupsize: int, quantize_weights: bool):
+    for target in targets:
+        if not target:
+            replace_linear_weight_only(model, mode, groupsize, quantize_weights)
+            continue
+        parent_name, _, name = target.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        child = getattr(parent, name)
+        if _is_quantizable(child, mode, groupsize):
+            setattr(parent, name, _make_quantized_linear(child, mode, groupsize, quantize_weights))
+        else:
+            replace_linear_weight_only(child, mode, groupsize, quantize_weights)
+
+
+def _source_key(source_path: str, mode: str, groupsize: int, targets) -> dict:
+    stat = os.stat(source_path)
+    return {
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime": int(stat.st_mtime),
+        "mode": mode,
+        "groupsize": groupsize,
+        "targets": list(targets),
+    }
+
+
+def quantize_with_cache(model: nn.Module, targets, mode: str, cache_path: str, source_path: str,
+                        groupsize: int = 128, load_source=None) -> bool:
+    """
+    Quantize the `targets` submodules of `model` in place, reusing `cache_path` when it was
+    produced from the same `source_path` checkpoint.
+
+    Args:
+        model: module whose full state dict is cached.
+        targets: dotted submodule names to quantize, e.g. ``["gpt.h", "mel_head"]``; "" is `model` itself.
+        mode: "int8" or "int4".
+        cache_path: file holding the quantized state dict of `model`.
+        source_path: float checkpoint the cache was derived from.
+        groupsize: input features per scale/zero group for int4.
+        load_source: optional callable loading the float weights into `model`, only called on a cache miss.
+    Returns:
+        True if the quantized weights were loaded from `cache_path`.
+    """
+    key = _source_key(source_path, mode, groupsize, targets)
+    if os.path.isfile(cache_path):
+        cached = torch.load(cache_path, map_location="cpu")
+        if cached.get("key") == key:
+            _replace_targets(model, targets, mode, groupsize, quantize_weights=False)
+            model.load_state_dict(cached["model"], strict=True)
+            return True
+        print(f">> Quantized cache {cache_path} is stale, re-quantizing")
+
+    if load_source is not None:
+        load_source(model)
+    _replace_targets(model, targets, mode, groupsize, quantize_weights=True)
+    if os.path.dirname(cache_path) != "":
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    torch.save({"key": key, "model": model.state_dict()}, tmp_path)
+    os.replace(tmp_path, cache_path)
+    return False
@@ -2,14 +2,20 @@ import os
 import re
 import json
 import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 import soundfile as sf
 from pydub import AudioSegment
 from tqdm import tqdm
 
 DATA = 'data/*.wav'
+OUTPUT = 'output'
 MIN_DURATION = 0.5  # seconds
 MAX_DURATION = 10.0  # seconds
 SAMPLE_RATE = 44100  # Hz
+PCM_SUBTYPES = {1: 'PCM_16', 2: 'PCM_16', 3: 'PCM_24', 4: 'PCM_32'}
 
 def parse_srt(srt_path):
     with open(srt_path, 'r', encoding='utf-8') as f:
@@ -32,42 +38,64 @@ def time_to_ms(t):
     s, ms = s.split('.')
     return (int(h)*3600 + int(m)*60 + int(s)) * 1000 + int(ms)
 
+def load_audio(path):
+    """解码并重采样整个文件一次，返回单声道 float32 样本数组和 soundfile 的 PCM 子类型"""
+    audio = AudioSegment.from_file(path).set_frame_rate(SAMPLE_RATE).set_channels(1)
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32) / float(1 << (8 * audio.sample_width - 1))
+    return samples, PCM_SUBTYPES[audio.sample_width]
+
+def process_file(audio_path, output_dir):
+    """切分一个音频文件，返回该文件的 manifest 行"""
+    base = os.path.splitext(os.path.basename(audio_path))[0]
+    srt_path = os.path.join(os.path.dirname(audio_path), f'{base}.srt')
+    if not os.path.exists(srt_path):
+        print(f"Warning: {srt_path} not found, skip {audio_path}")
+        return []
+    samples, subtype = load_audio(audio_path)
+    rows = []
+    for seg in parse_srt(srt_path)[1:]:  # skip the first segment
+        # 按样本下标切片，不再逐段解码 / 重采样
+        start = time_to_ms(seg['start']) * SAMPLE_RATE // 1000
+        end = time_to_ms(seg['end']) * SAMPLE_RATE // 1000
+        chunk = samples[start:end]
+        duration = len(chunk) / SAMPLE_RATE  # 秒
+        if duration < MIN_DURATION or duration > MAX_DURATION:
+            continue  # 跳过过短或过长的片段
+        out_wav = os.path.abspath(os.path.join(output_dir, f'{base}-{seg["index"]}.wav'))
+        sf.write(out_wav, chunk, SAMPLE_RATE, subtype=subtype)
+        rows.append({
+            "audio": out_wav,
+            "text": seg["text"],
+            "duration": duration
+        })
+    return rows
+
 def main():
-    os.makedirs('output', exist_ok=True)
+    parser = argparse.ArgumentParser(description="按 SRT 字幕切分音频，生成微调数据集")
+    parser.add_argument('--data', default=DATA, help="输入音频的 glob，同名 .srt 需在同一目录")
+    parser.add_argument('--output', default=OUTPUT, help="切分后的 wav 输出目录")
+    parser.add_argument('--manifest', default=None, help="manifest 路径，默认 <output>/segments.jsonl")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="并行处理的进程数")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest = args.manifest or os.path.join(args.output, 'segments.jsonl')
+    audio_files = sorted(glob.glob(args.data))
     jsonl_lines = []
-    mp3_files = glob.glob(DATA)
-    for mp3_path in tqdm(mp3_files, desc="Processing MP3 files"):
-        base = os.path.splitext(os.path.basename(mp3_path))[0]
-        srt_path = f'data/{base}.srt'
-        if not os.path.exists(srt_path):
-            print(f"Warning: {srt_path} not found, skip {mp3_path}")
-            continue
-        audio = AudioSegment.from_file(mp3_path)
-        segments = parse_srt(srt_path)
-        for seg in segments[1:]:  # skip the first segment
-            start_ms = time_to_ms(seg['start'])
-            end_ms = time_to_ms(seg['end'])
-            audio_chunk = audio[start_ms:end_ms]
-            audio_chunk = audio_chunk.set_frame_rate(SAMPLE_RATE).set_channels(1)
-            duration = len(audio_chunk) / 1000.0  # 秒
-            if duration < MIN_DURATION or duration > MAX_DURATION:
-                continue  # 跳过过短或过长的片段
-            out_wav = f'output/{base}-{seg["index"]}.wav'
-            audio_chunk.export(out_wav, format='wav')
-            # double check sample rate
-            data, sr = sf.read(out_wav)
-            if sr != SAMPLE_RATE:
-                sf.write(out_wav, data, SAMPLE_RATE)
-            jsonl_lines.append({
-                "audio": os.path.basename(out_wav),
-                "text": seg["text"],
-                "duration": duration
-            })
-    # 写入 jsonl
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(process_file, path, args.output): path for path in audio_files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing audio files"):
+            try:
+                jsonl_lines.extend(future.result())
+            except Exception as e:
+                print(f"Warning: failed to process {futures[future]}: {e}")
+    # 写入 jsonl，audio 为绝对路径，可直接作为 finetune.py 的 train_manifest
     jsonl_lines.sort(key=lambda x: x["audio"])
-    with open('output/segments.jsonl', 'w', encoding='utf-8') as f:
+    with open(manifest, 'w', encoding='utf-8') as f:
         for line in jsonl_lines:
             f.write(json.dumps(line, ensure_ascii=False) + '\n')
+    max_duration = max((line['duration'] for line in jsonl_lines), default=0.0)
+    print(f"Processed {len(jsonl_lines)} segments (max duration {max_duration:.2f}s) and saved to {manifest}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -22,23 +22,17 @@ for f in *.wav; do
   whisper "$f" --language Chinese --model turbo --output_format srt
 done
 
-# 使用 funasr 进行音频转录
-for f in *.wav; do
-  [ -e "$f" ] || continue
-  python asr.py "$f" --output "${f%.wav}.srt"
-done
+# 使用 funasr 进行音频转录（模型只加载一次，每个 wav 旁生成同名 .srt）
+python asr.py . --ext .wav
 
 cd ..
 
-# 切分音频文件
-python process.py
+# 切分音频文件（manifest 中为绝对路径，直接用于 finetune.yaml 的 train_manifest）
+python process.py --manifest data.jsonl
 
 # 保存数据集
 zip -r data.zip output
 
-# jsonl 文件加上路径
-python tmp.py
-
 python finetune.py --config_path finetune.yaml
 
 python ft_infer.py --ckpt_dir ./finetune/step_0002000 --text "直到现在，国内的体育圈——注意，我说的是体育圈，仍然处在封建主义阶段。" --output ft_test.wav
\ No newline at end of file
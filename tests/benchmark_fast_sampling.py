@@ -0,0 +1,103 @@
+"""
+CPU decoding speed of IndexTTS2 mel-token generation with beam search (the `infer` default, `num_beams=3`)
+and with the beam-free `fast_sampling` loop (`num_beams=1`), over a set of texts, with the `infer`
+sampling settings (top_p 0.8, top_k 30, temperature 0.8, repetition_penalty 10). Reports tokens/s and the
+output length of each text, e.g.
+
+    python -m tests.benchmark_fast_sampling --threads 1
+    python -m tests.benchmark_fast_sampling --model_dir checkpoints --threads 4
+
+Without `--model_dir` the GPT has random weights (`--layers`, `--dim`, `--heads`, by default the released
+width with fewer layers) and each text becomes random text tokens of the same length, so the output
+lengths say little; with `--model_dir` the released GPT and bpe model are loaded. The speech condition
+is random in both cases.
+"""
+import argparse
+import os
+import time
+
+import torch
+
+from tests.small_models import build_unified_voice, speech_inputs
+
+TEXTS = [
+    "Hello.",
+    "欢迎大家来体验indextts2。",
+    "The quick brown fox jumps over the lazy dog, twice.",
+    "欢迎大家来体验indextts2，并给予我们意见与反馈，谢谢大家。",
+    "It was a bright cold day in April, and the clocks were striking thirteen. Winston Smith slipped quickly "
+    "through the glass doors of Victory Mansions.",
+]
+
+
+def load_released(model_dir):
+    from omegaconf import OmegaConf
+
+    from indextts.gpt.model_v2 import UnifiedVoice
+    from indextts.utils.checkpoint import load_checkpoint
+    from indextts.utils.front import TextTokenizer
+
+    cfg = OmegaConf.load(os.path.join(model_dir, "config.yaml"))
+    model = UnifiedVoice(**cfg.gpt).eval()
+    load_checkpoint(model, os.path.join(model_dir, cfg.gpt_checkpoint))
+    model.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    tokenizer = TextTokenizer(os.path.join(model_dir, cfg.dataset["bpe_model"]))
+    return model, lambda text: torch.tensor([tokenizer.encode(text)], dtype=torch.int32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_dir", default=None, help="directory with config.yaml, gpt.pth and bpe.model")
+    parser.add_argument("--layers", type=int, default=6, help="the released GPT has 24")
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--max_mel_tokens", type=int, default=300)
+    parser.add_argument("--num_beams", type=int, default=3, help="beam width of the beam search run")
+    parser.add_argument("--texts", nargs="*", default=TEXTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.model_dir:
+        model, encode = load_released(args.model_dir)
+        description = f"released GPT from {args.model_dir}"
+    else:
+        max_text_tokens = max(len(text) for text in args.texts) + 8
+        model = build_unified_voice(layers=args.layers, model_dim=args.dim, heads=args.heads,
+                                    max_text_tokens=max_text_tokens, max_mel_tokens=args.max_mel_tokens + 8)
+        generator = torch.Generator().manual_seed(args.seed)
+        encode = lambda text: torch.randint(3, model.number_text_tokens - 1, (1, len(text)), generator=generator)
+        description = f"random GPT {args.layers}x{args.dim}"
+    cond, _, emo_cond = speech_inputs(model, cond_frames=150)
+    generation = dict(do_sample=True, top_p=0.8, top_k=30, temperature=0.8, repetition_penalty=10.0,
+                      max_generate_length=args.max_mel_tokens)
+    modes = (("beam", dict(num_beams=args.num_beams)), ("fast", dict(num_beams=1, fast_sampling=True)))
+    print(f">> {torch.get_num_threads()} threads, {description}, {len(args.texts)} texts, "
+          f"max {args.max_mel_tokens} mel tokens")
+
+    with torch.no_grad():
+        model.inference_speech(cond, encode(args.texts[0]), emo_cond, **dict(generation, max_generate_length=8))
+        totals = {name: [0, 0.0] for name, _ in modes}
+        for text in args.texts:
+            text_tokens = encode(text)
+            line = []
+            for name, kwargs in modes:
+                torch.manual_seed(args.seed)
+                t0 = time.perf_counter()
+                codes, _ = model.inference_speech(cond, text_tokens, emo_cond, **generation, **kwargs)
+                elapsed = time.perf_counter() - t0
+                totals[name][0] += codes.shape[-1]
+                totals[name][1] += elapsed
+                line.append(f"{name} {codes.shape[-1]} tokens in {elapsed:.2f}s ({codes.shape[-1] / elapsed:.1f}/s)")
+            print(f">> {text_tokens.shape[-1]:3d} text tokens: " + ", ".join(line))
+
+    for name, (tokens, seconds) in totals.items():
+        print(f">> {name}: {tokens} tokens in {seconds:.2f}s, {tokens / seconds:.2f} tokens/s")
+    print(f">> fast / beam: {totals['fast'][0] / totals['fast'][1] / (totals['beam'][0] / totals['beam'][1]):.2f}x "
+          f"tokens/s, {totals['fast'][1] / totals['beam'][1]:.2f}x total time")
+
+
+if __name__ == "__main__":
+    main()
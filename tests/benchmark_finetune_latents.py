@@ -0,0 +1,105 @@
+"""
+Batch preparation speed of `finetune.py` with raw audio encoded by the audio VAE on every step (the default)
+and with the pre-encoded latent cache (`latent_cache_dir`), on synthetic clips. The stand-in VAE is a
+random-init `voxcpm` `AudioVAE` with the default config, whose encoder costs as much as a trained one.
+A step is reading `--batch_size` samples, collating them and running the batch processor; the model
+forward / backward is the same for both pipelines and not included (`train` logs the optimizer steps/s of
+a real run), e.g.
+
+    python -m tests.benchmark_finetune_latents --threads 1
+    python -m tests.benchmark_finetune_latents --clips 256 --batch_size 16 --ref_audio --threads 4
+
+Both pipelines must produce the same batches.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from datasets import Dataset
+from voxcpm.modules.audiovae.audio_vae import AudioVAE
+from voxcpm.training.data import BatchProcessor, HFVoxCPMDataset
+
+import finetune
+
+
+def synthesize_dataset(clips, min_seconds, max_seconds, ref_audio, sample_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(clips):
+        row = {
+            "text_ids": rng.integers(1, 1000, int(rng.integers(10, 80))).tolist(),
+            "audio": {"array": rng.standard_normal(int(rng.uniform(min_seconds, max_seconds) * sample_rate),
+                                                   dtype=np.float32) * 0.1, "sampling_rate": sample_rate},
+            "dataset_id": 0,
+        }
+        if ref_audio:
+            ref = rng.standard_normal(int(rng.uniform(1, 3) * sample_rate), dtype=np.float32) * 0.1
+            row["ref_audio"] = {"array": ref, "sampling_rate": sample_rate}
+        rows.append(row)
+    return Dataset.from_list(rows)
+
+
+def run_steps(dataset, collate_fn, processor, batches):
+    outputs = []
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            outputs.append(processor(collate_fn([dataset[i] for i in batch])))
+    return time.perf_counter() - t0, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, default=32)
+    parser.add_argument("--min_seconds", type=float, default=2.0)
+    parser.add_argument("--max_seconds", type=float, default=10.0)
+    parser.add_argument("--ref_audio", action="store_true", help="add a 1-3 s reference clip to every sample")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    vae = AudioVAE().eval()
+    config = SimpleNamespace(max_length=4096, patch_size=2, feat_dim=vae.latent_dim)
+    ds = synthesize_dataset(args.clips, args.min_seconds, args.max_seconds, args.ref_audio, vae.sample_rate)
+    rng = np.random.default_rng(1)
+    batches = [rng.choice(args.clips, args.batch_size, replace=False).tolist() for _ in range(args.steps)]
+    print(f">> {torch.get_num_threads()} threads, {args.clips} clips of {args.min_seconds:g}-{args.max_seconds:g}s"
+          f"{' + reference clips' if args.ref_audio else ''}, {args.steps} steps of batch size {args.batch_size}")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        t0 = time.perf_counter()
+        finetune.build_latent_cache(ds, vae, config, Path(cache_dir), {"benchmark": True}, "cpu")
+        t_cache = time.perf_counter() - t0
+        latent_ds = ds.add_column(finetune.LATENT_INDEX_COLUMN, list(range(len(ds))))
+        latent_ds = latent_ds.remove_columns([c for c in ("audio", "ref_audio") if c in ds.column_names])
+        latent_cache = finetune.LatentCache(Path(cache_dir))
+
+        raw = BatchProcessor(config=config, audio_vae=vae, dataset_cnt=1, device="cpu")
+        latent = finetune.LatentBatchProcessor(config=config, dataset_cnt=1, device="cpu", hop_length=vae.hop_length)
+        t_raw, raw_batches = run_steps(HFVoxCPMDataset(ds), HFVoxCPMDataset.collate_fn, raw, batches)
+        t_latent, latent_batches = run_steps(finetune.LatentVoxCPMDataset(latent_ds, latent_cache),
+                                             finetune.LatentVoxCPMDataset.collate_fn, latent, batches)
+
+    max_diff = 0.0
+    for a, b in zip(raw_batches, latent_batches):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert a[key].shape == b[key].shape, key
+            max_diff = max(max_diff, (a[key].float() - b[key].float()).abs().max().item())
+    assert max_diff < 1e-5, f"latent batches differ from raw audio batches by {max_diff}"
+    print(f">> latent cache built in {t_cache:.2f}s ({args.clips / t_cache:.1f} clips/s, paid once per dataset)")
+    print(f">> raw audio + VAE: {args.steps / t_raw:.2f} steps/s ({t_raw / args.steps * 1000:.1f} ms/step)")
+    print(f">> latent cache: {args.steps / t_latent:.2f} steps/s ({t_latent / args.steps * 1000:.1f} ms/step)")
+    print(f">> speedup {t_raw / t_latent:.1f}x, batches match (max abs diff {max_diff:.1e})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+CPU decoding speed of the IndexTTS v1 GPT in fp32 with the kv cache off (the previous fp32 path) and on
+(static caches, as IndexTTS now sets it up on CPU / MPS). Random weights, by default at the released
+1.5 width with fewer layers (`--layers 24` for the full depth), e.g.
+
+    python -m tests.benchmark_gpt_kv_cache --tokens 300 --threads 1
+"""
+import argparse
+import time
+
+import torch
+
+from tests.small_models import build_unified_voice_v1, speech_inputs_v1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=6, help="the released 1.5 GPT has 24")
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--text_tokens", type=int, default=40)
+    parser.add_argument("--tokens", type=int, default=300, help="mel tokens to generate")
+    parser.add_argument("--num_beams", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = build_unified_voice_v1(layers=args.layers, model_dim=args.dim, heads=args.heads,
+                                   max_text_tokens=args.text_tokens + 8, max_mel_tokens=args.tokens + 8)
+    cond_mel, text = speech_inputs_v1(model, text_tokens=args.text_tokens)
+    # the stop token is masked so every run decodes exactly `--tokens` tokens
+    generation = dict(do_sample=False, num_beams=args.num_beams, max_generate_length=args.tokens,
+                      min_new_tokens=args.tokens, repetition_penalty=2.0)
+    print(f">> {torch.get_num_threads()} threads, GPT {args.layers}x{args.dim}, {args.text_tokens} text tokens, "
+          f"{args.tokens} mel tokens, num_beams={args.num_beams}")
+
+    results = {}
+    for name, kv_cache in (("no kv cache (before)", False), ("static kv cache", True)):
+        model.post_init_gpt2_config(use_deepspeed=False, kv_cache=kv_cache, half=False, static_kv_cache=True)
+        with torch.no_grad():
+            model.inference_speech(cond_mel, text, **dict(generation, max_generate_length=8, min_new_tokens=8))
+            t0 = time.perf_counter()
+            codes = model.inference_speech(cond_mel, text, **generation)
+            elapsed = time.perf_counter() - t0
+        results[name] = (codes, elapsed)
+        print(f">> {name}: {codes.shape[-1]} tokens in {elapsed:.2f}s, {codes.shape[-1] / elapsed:.2f} tokens/s")
+
+    (codes_before, t_before), (codes_after, t_after) = results.values()
+    print(f">> speedup {t_before / t_after:.2f}x, codes equal: {torch.equal(codes_before, codes_after)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Throughput of KVCacheManager bookkeeping: N sequences are allocated from a shared prompt prefix and
+then decoded M tokens each (append_token + append_to_seq), with the current chained 64-bit block
+hashes vs the previous pickle + SHA-256 hash of list token blocks, e.g.
+
+    python -m tests.benchmark_kv_manager --seqs 64 --appends 1024
+"""
+import argparse
+import hashlib
+import pickle
+import random
+import time
+from copy import copy
+
+import torch
+
+from indextts.accel.kv_manager import KVCacheManager, Seq
+
+
+class Sha256Seq(Seq):
+    """Seq as it was before: list tokens, no block hashes."""
+
+    def __init__(self, token_ids, block_size=256):
+        self.token_ids = copy(token_ids)
+        self.last_token = token_ids[-1] if token_ids else 0
+        self.num_tokens = len(self.token_ids)
+        self.num_prompt_tokens = len(token_ids)
+        self.num_cached_tokens = 0
+        self.block_table = []
+        self.block_size = block_size
+
+    def append_token(self, token_id):
+        self.token_ids.append(token_id)
+        self.last_token = token_id
+        self.num_tokens += 1
+
+
+class Sha256KVCacheManager(KVCacheManager):
+    """allocate/append_to_seq as they were before: every full block is pickled and SHA-256 hashed."""
+
+    @classmethod
+    def compute_block_hash(cls, token_ids, parent_hash=None):
+        hash_input = []
+        if parent_hash is not None:
+            hash_input.append(parent_hash)
+        hash_input.extend(token_ids)
+        input_bytes = pickle.dumps(tuple(hash_input), protocol=pickle.HIGHEST_PROTOCOL)
+        return hashlib.sha256(input_bytes).digest()
+
+    def allocate(self, sequence):
+        assert not sequence.block_table, "Sequence already has allocated blocks"
+        parent_hash = None
+        cache_miss = False
+        for i in range(sequence.num_blocks):
+            token_ids = sequence.get_block_tokens(i)
+            block_hash = (
+                self.compute_block_hash(token_ids, parent_hash)
+                if len(token_ids) == self.block_size
+                else None
+            )
+            block_id = self.block_hash_to_id.get(block_hash) if block_hash else None
+            if block_id is None or self.blocks[block_id].token_ids != token_ids:
+                cache_miss = True
+            if cache_miss:
+                block_id = self.free_block_ids[0]
+                block = self._allocate_block(block_id)
+            else:
+                sequence.num_cached_tokens += self.block_size
+                if block_id is not None and block_id in self.used_block_ids:
+                    block = self.blocks[block_id]
+                    block.ref_cnt += 1
+                else:
+                    block_id = self.free_block_ids[0]
+                    block = self._allocate_block(block_id)
+            if block_hash is not None:
+                block.update(block_hash, token_ids)
+                self.block_hash_to_id[block_hash] = block_id
+                parent_hash = block_hash
+            sequence.block_table.append(block_id)
+
+    def append_to_seq(self, sequence):
+        block_table = sequence.block_table
+        last_block = self.blocks[block_table[-1]]
+        if len(sequence) % self.block_size == 1:
+            assert last_block.block_hash is not None
+            block_id = self.free_block_ids[0]
+            self._allocate_block(block_id)
+            block_table.append(block_id)
+        elif len(sequence) % self.block_size == 0:
+            assert last_block.block_hash is None
+            token_ids = sequence.get_block_tokens(sequence.num_blocks - 1)
+            parent_hash = self.blocks[block_table[-2]].block_hash if len(block_table) > 1 else None
+            block_hash = self.compute_block_hash(token_ids, parent_hash)
+            last_block.update(block_hash, token_ids)
+            self.block_hash_to_id[block_hash] = last_block.block_id
+        else:
+            assert last_block.block_hash is None
+
+
+def run(manager_cls, seq_cls, prompts, appends, block_size):
+    blocks_per_seq = (max(len(p) for p in prompts) + appends) // block_size + 2
+    manager = manager_cls(num_layers=1, num_heads=1, head_dim=1, block_size=block_size,
+                          num_blocks=len(prompts) * blocks_per_seq, dtype=torch.float16)
+    rng = random.Random(0)
+    decoded = [[rng.randrange(8194) for _ in range(appends)] for _ in prompts]
+
+    t0 = time.perf_counter()
+    sequences = []
+    for prompt in prompts:
+        seq = seq_cls(prompt, block_size)
+        manager.allocate(seq)
+        sequences.append(seq)
+    t_allocate = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for step in range(appends):
+        for seq, tokens in zip(sequences, decoded):
+            seq.append_token(tokens[step])
+            manager.append_to_seq(seq)
+    t_append = time.perf_counter() - t0
+
+    cached = sum(seq.num_cached_tokens for seq in sequences)
+    for seq in sequences:
+        manager.remove_seq(seq)
+    return t_allocate, t_append, cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seqs", type=int, default=64, help="number of sequences (N)")
+    parser.add_argument("--appends", type=int, default=1024, help="decoded tokens per sequence (M)")
+    parser.add_argument("--prompt_len", type=int, default=600)
+    parser.add_argument("--shared_len", type=int, default=512, help="prompt prefix shared by all sequences")
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    shared = [rng.randrange(8194) for _ in range(args.shared_len)]
+    prompts = [shared + [rng.randrange(8194) for _ in range(args.prompt_len - args.shared_len)]
+               for _ in range(args.seqs)]
+
+    print(f">> {args.seqs} sequences x {args.appends} appends, prompt {args.prompt_len} tokens "
+          f"({args.shared_len} shared), block size {args.block_size}")
+    paths = {
+        "sha256 + list tokens (before)": (Sha256KVCacheManager, Sha256Seq),
+        "64-bit chained hash (now)": (KVCacheManager, Seq),
+    }
+    # interleaved, so that both paths see the same machine load
+    timings = {name: [] for name in paths}
+    for _ in range(args.runs):
+        for name, (manager_cls, seq_cls) in paths.items():
+            timings[name].append(run(manager_cls, seq_cls, prompts, args.appends, args.block_size))
+
+    results = []
+    for name, runs in timings.items():
+        t_allocate = min(t[0] for t in runs)
+        t_append = min(t[1] for t in runs)
+        results.append((t_allocate, t_append))
+        appends_per_s = args.seqs * args.appends / t_append
+        print(f">> {name}: allocate {t_allocate * 1e3:.2f} ms, append {t_append * 1e3:.1f} ms "
+              f"({appends_per_s / 1e6:.2f}M appends/s), cached tokens {runs[0][2]}")
+    (a0, p0), (a1, p1) = results
+    print(f">> speedup: allocate {a0 / a1:.2f}x, append {p0 / p1:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+CPU latency and output error of weight-only int8 / int4 quantization (`quantize_with_cache`) against fp32
+for the IndexTTS2 GPT blocks, `mel_head` and the s2mel DiT. Random weights, by default at the released
+widths with fewer GPT blocks (`--gpt_layers 24` for the full depth), e.g.
+
+    python -m tests.benchmark_quantization --threads 1
+
+GPT: a `--prefill` token prompt followed by `--decode` single-token steps with the kv cache, as in
+`inference_speech`; the error is measured on the final hidden states and as top-1 agreement of the
+mel_head logits. DiT: one estimator step over `--frames` mel frames with the CFG batch of 2.
+Each mode is quantized once and loaded a second time, which must come from the disk cache.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+
+from indextts.utils.quantization import QUANT_MODES, quantize_with_cache
+from tests.small_models import build_cfm, build_unified_voice
+
+
+def timed(fn, runs):
+    out = fn()  # warm-up
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings), out
+
+
+def relative_error(out, ref):
+    return ((out - ref).norm() / ref.norm()).item()
+
+
+def gpt_runner(model, prefill, decode):
+    generator = torch.Generator().manual_seed(2)
+    embeds = torch.randn(1, prefill + decode, model.model_dim, generator=generator)
+
+    def run():
+        out = model.gpt(inputs_embeds=embeds[:, :prefill], use_cache=True, return_dict=True)
+        hidden, past = [out.last_hidden_state], out.past_key_values
+        for i in range(prefill, prefill + decode):
+            out = model.gpt(inputs_embeds=embeds[:, i:i + 1], past_key_values=past, use_cache=True, return_dict=True)
+            hidden.append(out.last_hidden_state)
+            past = out.past_key_values
+        hidden = model.final_norm(torch.cat(hidden, dim=1))
+        return hidden, model.mel_head(hidden)
+
+    return run
+
+
+def gpt_error(out, ref):
+    agreement = (out[1].argmax(-1) == ref[1].argmax(-1)).float().mean().item()
+    return f"hidden relative error {relative_error(out[0], ref[0]):.2e}, top-1 mel code agreement {agreement:.1%}"
+
+
+def dit_runner(estimator, frames):
+    generator = torch.Generator().manual_seed(3)
+    batch = 2  # conditional + null branch of classifier-free guidance
+    x = torch.randn(batch, 80, frames, generator=generator)
+    prompt_x = torch.randn(batch, 80, frames, generator=generator)
+    prompt_x[:, :, frames // 3:] = 0
+    x_lens = torch.LongTensor([frames] * batch)
+    t = torch.full((batch,), 0.5)
+    style = torch.randn(batch, 192, generator=generator)
+    cond = torch.randn(batch, frames, 512, generator=generator)
+
+    def run():
+        return (estimator(x, prompt_x, x_lens, t, style, cond),)
+
+    return run
+
+
+def dit_error(out, ref):
+    return f"relative error {relative_error(out[0], ref[0]):.2e}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gpt_layers", type=int, default=4, help="the released GPT has 24")
+    parser.add_argument("--gpt_dim", type=int, default=1280)
+    parser.add_argument("--gpt_heads", type=int, default=20)
+    parser.add_argument("--prefill", type=int, default=200)
+    parser.add_argument("--decode", type=int, default=32)
+    parser.add_argument("--dit_depth", type=int, default=13)
+    parser.add_argument("--frames", type=int, default=400)
+    parser.add_argument("--groupsize", type=int, default=128)
+    parser.add_argument("--modes", default=",".join(QUANT_MODES))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    def build_gpt():
+        return build_unified_voice(layers=args.gpt_layers, model_dim=args.gpt_dim, heads=args.gpt_heads,
+                                   max_mel_tokens=args.prefill + args.decode + 8)
+
+    def build_dit():
+        return build_cfm(depth=args.dit_depth).estimator
+
+    stages = (
+        ("GPT blocks + mel_head", build_gpt, ["gpt.h", "mel_head"],
+         lambda m: gpt_runner(m, args.prefill, args.decode), gpt_error),
+        ("s2mel DiT", build_dit, [""], lambda m: dit_runner(m, args.frames), dit_error),
+    )
+    print(f">> {torch.get_num_threads()} threads; GPT {args.gpt_layers}x{args.gpt_dim}, {args.prefill} prompt + "
+          f"{args.decode} decoded tokens; DiT depth {args.dit_depth}, {args.frames} frames")
+    with tempfile.TemporaryDirectory() as directory, torch.inference_mode():
+        for i, (name, build, targets, runner, error) in enumerate(stages):
+            reference = build()
+            source_path = os.path.join(directory, f"stage{i}.pth")
+            torch.save(reference.state_dict(), source_path)
+            t_ref, ref_out = timed(runner(reference), args.runs)
+            print(f">> {name} fp32: {t_ref:.3f}s")
+            del reference
+
+            for mode in args.modes.split(","):
+                cache_path = os.path.join(directory, f"stage{i}.{mode}.pth")
+                t0 = time.perf_counter()
+                model = build()
+                from_cache = quantize_with_cache(model, targets, mode, cache_path, source_path, args.groupsize,
+                                                 load_source=lambda m: m.load_state_dict(torch.load(source_path)))
+                t_quantize = time.perf_counter() - t0
+                assert not from_cache
+                t_mode, out = timed(runner(model), args.runs)
+                del model
+
+                t0 = time.perf_counter()
+                cached = build()
+                from_cache = quantize_with_cache(cached, targets, mode, cache_path, source_path, args.groupsize)
+                t_cached = time.perf_counter() - t0
+                assert from_cache, f"second {mode} load did not come from {cache_path}"
+                cached_out = runner(cached)()
+                assert all(torch.equal(a, b) for a, b in zip(out, cached_out)), \
+                    f"{mode} weights loaded from the cache give different outputs"
+                del cached
+
+                print(f">> {name} {mode}: {t_mode:.3f}s ({t_ref / t_mode:.2f}x fp32), {error(out, ref_out)}; "
+                      f"build + quantize {t_quantize:.1f}s, build + load from cache {t_cached:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
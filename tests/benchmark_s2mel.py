@@ -0,0 +1,89 @@
+"""
+CPU latency of the s2mel flow-matching decoder (`CFM.solve_euler`) with the per-utterance inference session
+(`DiT.prepare_inference`, prompt / condition / style features and masks built once) against the previous
+path, which passed the raw inputs to the estimator and rebuilt them on every step. Random weights at the
+released width, e.g.
+
+    python -m tests.benchmark_s2mel --threads 1
+    python -m tests.benchmark_s2mel --frames 1800 --steps 25 --threads 4
+
+Both paths must give bitwise identical mels.
+"""
+import argparse
+import time
+
+import torch
+
+from tests.small_models import build_cfm, s2mel_inputs
+
+
+def solve_euler_without_session(cfm, x, x_lens, prompt, mu, style, t_span, inference_cfg_rate):
+    # `CFM.solve_euler` before the inference session: the estimator prepares its inputs on every step
+    prompt_len = prompt.size(-1)
+    prompt_x = torch.zeros_like(x)
+    prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
+    x[..., :prompt_len] = 0
+    if cfm.zero_prompt_speech_token:
+        mu[..., :prompt_len] = 0
+    t = t_span[0]
+    for step in range(1, len(t_span)):
+        dt = t_span[step] - t_span[step - 1]
+        if inference_cfg_rate > 0:
+            stacked_dphi_dt = cfm.estimator(
+                torch.cat([x, x], dim=0), torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0), x_lens,
+                torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0), torch.cat([style, torch.zeros_like(style)], dim=0),
+                torch.cat([mu, torch.zeros_like(mu)], dim=0),
+            )
+            dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+            dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+        else:
+            dphi_dt = cfm.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+        x = x + dt * dphi_dt
+        t = t + dt
+        x[:, :, :prompt_len] = 0
+    return x
+
+
+def timed(fn, runs):
+    out = fn()  # warm-up
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=13, help="DiT blocks, as released")
+    parser.add_argument("--frames", type=int, default=600, help="prompt + generated mel frames")
+    parser.add_argument("--prompt_frames", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=10, help="diffusion steps, `infer` uses 25")
+    parser.add_argument("--cfg_rate", type=float, default=0.7)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    cfm = build_cfm(depth=args.depth)
+    mu, x_lens, prompt, style = s2mel_inputs(args.frames, args.prompt_frames)
+    noise = torch.randn(1, cfm.in_channels, args.frames, generator=torch.Generator().manual_seed(2))
+    t_span = torch.linspace(0, 1, args.steps + 1)
+    print(f">> {torch.get_num_threads()} threads, DiT depth {args.depth}, {args.frames} frames "
+          f"({args.prompt_frames} prompt), {args.steps} steps, cfg rate {args.cfg_rate}")
+
+    with torch.inference_mode():
+        t_before, before = timed(lambda: solve_euler_without_session(
+            cfm, noise.clone(), x_lens, prompt, mu.clone(), style, t_span, args.cfg_rate), args.runs)
+        t_after, after = timed(lambda: cfm.solve_euler(
+            noise.clone(), x_lens, prompt, mu.clone(), style, None, t_span, args.cfg_rate), args.runs)
+    assert torch.equal(before, after), "the inference session changed the output"
+    print(f">> per-step inputs (before): {t_before:.3f}s, {t_before / args.steps * 1000:.1f} ms/step")
+    print(f">> inference session: {t_after:.3f}s, {t_after / args.steps * 1000:.1f} ms/step")
+    print(f">> speedup {t_before / t_after:.3f}x, outputs bitwise identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+CPU latency of the w2v-bert semantic feature: previous IndexTTS2.get_emb (all 24 layers with
+output_hidden_states) vs the model truncated at SEMANTIC_LAYER. Random weights with the w2v-bert 2.0
+architecture, so nothing is downloaded, e.g.
+
+    python -m tests.benchmark_semantic_model --frames 750 --threads 1
+"""
+import argparse
+import tempfile
+import time
+
+import torch
+
+from indextts.utils.maskgct_utils import SEMANTIC_LAYER, build_semantic_model
+from tests.test_semantic_model import build_random_w2v_bert, semantic_inputs
+
+
+def timed(fn, runs):
+    fn()  # warm-up
+    timings = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=750, help="feature frames, 750 is about 15 s of audio")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--small", action="store_true", help="hidden size 256 instead of the real 1024")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = dict(hidden_dropout=0.0, activation_dropout=0.0, attention_dropout=0.0)
+    if args.small:
+        config.update(hidden_size=256, intermediate_size=1024, output_hidden_size=256, num_attention_heads=8)
+    with tempfile.TemporaryDirectory() as directory:
+        full_model, stats_path = build_random_w2v_bert(directory, **config)
+        semantic_model, _, _ = build_semantic_model(stats_path, output_layer=SEMANTIC_LAYER, model_id=directory)
+    input_features, attention_mask = semantic_inputs(full_model.config, batch_size=1, frames=args.frames)
+
+    with torch.inference_mode():
+        def before():
+            return full_model(input_features=input_features, attention_mask=attention_mask,
+                              output_hidden_states=True).hidden_states[SEMANTIC_LAYER]
+
+        def after():
+            return semantic_model(input_features=input_features, attention_mask=attention_mask).last_hidden_state
+
+        assert torch.equal(before(), after())
+        t_before, t_after = timed(before, args.runs), timed(after, args.runs)
+
+    params = [sum(p.numel() for p in m.parameters()) for m in (full_model, semantic_model)]
+    print(f">> {args.frames} frames, {torch.get_num_threads()} threads")
+    print(f">> full model + hidden_states[{SEMANTIC_LAYER}]: {t_before:.3f}s, {params[0] / 1e6:.1f}M params")
+    print(f">> truncated at layer {SEMANTIC_LAYER}: {t_after:.3f}s, {params[1] / 1e6:.1f}M params")
+    print(f">> speedup {t_before / t_after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
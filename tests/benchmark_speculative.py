@@ -0,0 +1,91 @@
+"""
+CPU decoding speed of IndexTTS2 speculative decoding (`speculative_draft_layers`) against the `fast_sampling`
+loop it builds on, for several draft depths, over a set of texts. Reports the draft acceptance rate and
+tokens/s, e.g.
+
+    python -m tests.benchmark_speculative --threads 1
+    python -m tests.benchmark_speculative --model_dir checkpoints --draft_layers 4 6 8 --draft_tokens 4
+
+Without `--model_dir` the GPT has random weights (`--layers`, `--dim`, `--heads`), whose acceptance rates
+say nothing about the released GPT; it only measures the cost of drafting and verification. Sampling uses
+the `infer` settings (top_p 0.8, top_k 30, temperature 0.8, repetition_penalty 10), `--greedy` decodes
+greedily instead, in which case every mode must give the same codes.
+"""
+import argparse
+import time
+
+import torch
+
+from tests.benchmark_fast_sampling import TEXTS, load_released
+from tests.small_models import build_unified_voice, speech_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model_dir", default=None, help="directory with config.yaml, gpt.pth and bpe.model")
+    parser.add_argument("--layers", type=int, default=12, help="the released GPT has 24")
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--draft_layers", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--draft_tokens", type=int, default=4)
+    parser.add_argument("--max_mel_tokens", type=int, default=200)
+    parser.add_argument("--texts", nargs="*", default=TEXTS[:3])
+    parser.add_argument("--greedy", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.model_dir:
+        model, encode = load_released(args.model_dir)
+        description = f"released GPT from {args.model_dir}"
+    else:
+        max_text_tokens = max(len(text) for text in args.texts) + 8
+        model = build_unified_voice(layers=args.layers, model_dim=args.dim, heads=args.heads,
+                                    max_text_tokens=max_text_tokens, max_mel_tokens=args.max_mel_tokens + 8)
+        generator = torch.Generator().manual_seed(args.seed)
+        encode = lambda text: torch.randint(3, model.number_text_tokens - 1, (1, len(text)), generator=generator)
+        description = f"random GPT {args.layers}x{args.dim}"
+    cond, _, emo_cond = speech_inputs(model, cond_frames=150)
+    text_tokens = [encode(text) for text in args.texts]
+    sampling = dict(do_sample=False) if args.greedy else dict(do_sample=True, top_p=0.8, top_k=30, temperature=0.8)
+    generation = dict(sampling, num_beams=1, repetition_penalty=10.0, max_generate_length=args.max_mel_tokens)
+    modes = [("fast", dict(fast_sampling=True))]
+    modes += [(f"draft {layers} layers",
+               dict(speculative_draft_layers=layers, speculative_draft_tokens=args.draft_tokens))
+              for layers in args.draft_layers]
+    print(f">> {torch.get_num_threads()} threads, {description}, {len(args.texts)} texts, max {args.max_mel_tokens} "
+          f"mel tokens, {args.draft_tokens} draft tokens, {'greedy' if args.greedy else 'sampling'}")
+
+    results = {}
+    with torch.no_grad():
+        model.inference_speech(cond, text_tokens[0], emo_cond, **dict(generation, max_generate_length=8))
+        for name, kwargs in modes:
+            tokens, seconds, accepted, proposed, codes = 0, 0.0, 0, 0, []
+            for text in text_tokens:
+                torch.manual_seed(args.seed)
+                t0 = time.perf_counter()
+                out, _ = model.inference_speech(cond, text, emo_cond, **generation, **kwargs)
+                seconds += time.perf_counter() - t0
+                tokens += out.shape[-1]
+                codes.append(out)
+                if "speculative_draft_layers" in kwargs:
+                    accepted += model.inference_model.speculative_stats[0]
+                    proposed += model.inference_model.speculative_stats[1]
+            results[name] = (tokens, seconds, codes)
+            acceptance = f", accepted {accepted}/{proposed} draft tokens ({accepted / max(proposed, 1):.1%})" \
+                if proposed else ""
+            fast_rate = results["fast"][0] / results["fast"][1]
+            print(f">> {name}: {tokens} tokens in {seconds:.2f}s, {tokens / seconds:.2f} tokens/s "
+                  f"({tokens / seconds / fast_rate:.2f}x vs fast){acceptance}")
+
+    if args.greedy:
+        reference = results["fast"][2]
+        for name, (_, _, codes) in results.items():
+            assert all(torch.equal(a, b) for a, b in zip(codes, reference)), f"{name} differs from fast greedy codes"
+        print(">> greedy codes identical in every mode")
+
+
+if __name__ == "__main__":
+    main()
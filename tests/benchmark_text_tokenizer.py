@@ -0,0 +1,119 @@
+"""
+Throughput of `TextTokenizer.encode` over a subtitle corpus: without the encode cache, with a cold cache
+(first pass) and a warm cache (second pass, e.g. a retry or a re-dub). The corpus is read from .srt / .txt
+files, or synthesized with `--repeat` of its lines drawn from a pool of short stock lines, as subtitles
+repeat "Yes.", "What?", names and catch phrases, e.g.
+
+    python -m tests.benchmark_text_tokenizer --vocab checkpoints/bpe.model --lines 20000
+    python -m tests.benchmark_text_tokenizer --vocab checkpoints/bpe.model --corpus subs/*.srt
+
+Normalization needs WeTextProcessing (wetext on macOS / Windows); `--identity_normalizer` replaces the
+engines by an identity so the glossary, regex and tokenization costs can still be measured without it.
+Without `--vocab`, a small sentencepiece model is trained on the corpus.
+"""
+import argparse
+import glob
+import random
+import re
+import tempfile
+import time
+
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+STOCK_LINES = [
+    "Yes.", "No.", "What?", "Thank you.", "Let's go!", "I'm sorry.", "Are you okay?", "Come on!", "Wait.",
+    "好的。", "谢谢你。", "走吧！", "你说什么？", "对不起。", "我知道了。", "等一下。", "没事吧？",
+]
+WORDS_EN = ("the night is young and we have to find him before the train leaves the station at "
+            "nine o'clock because nobody else knows where the money is hidden in 2024").split()
+CHARS_ZH = "我们今天晚上必须找到他因为火车九点离开车站没有人知道钱藏在哪里这件事情非常重要"
+
+SRT_SKIP_RE = re.compile(r"^\s*(\d+|\d\d:\d\d:\d\d[,.]\d+\s*-->.*)?\s*$")
+
+
+class IdentityNormalizer:
+    def normalize(self, text):
+        return text
+
+
+def read_corpus(patterns):
+    lines = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "r", encoding="utf-8-sig") as f:
+                lines.extend(line.strip() for line in f if not SRT_SKIP_RE.match(line))
+    return lines
+
+
+def synthesize_corpus(num_lines, repeat, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(num_lines):
+        if rng.random() < repeat:
+            lines.append(rng.choice(STOCK_LINES))
+        elif rng.random() < 0.5:
+            lines.append(" ".join(rng.choices(WORDS_EN, k=rng.randint(4, 14))).capitalize() + ".")
+        else:
+            lines.append("".join(rng.choices(CHARS_ZH, k=rng.randint(6, 24))) + "。")
+    return lines
+
+
+def train_vocab(lines, directory):
+    import sentencepiece
+
+    corpus = f"{directory}/corpus.txt"
+    with open(corpus, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines).upper())
+    sentencepiece.SentencePieceTrainer.train(
+        input=corpus, model_prefix=f"{directory}/bpe", vocab_size=1000, model_type="bpe", character_coverage=1.0,
+        bos_id=0, eos_id=1, unk_id=2, pad_id=-1, minloglevel=2)
+    return f"{directory}/bpe.model"
+
+
+def make_tokenizer(vocab_file, identity_normalizer, cache_size):
+    normalizer = TextNormalizer(enable_glossary=True)
+    if identity_normalizer:
+        normalizer.zh_normalizer = normalizer.en_normalizer = IdentityNormalizer()
+    normalizer.load_glossary({"C++": {"en": "C plus plus", "zh": "C 加加"}, "PCIe": "PCIE"})
+    return TextTokenizer(vocab_file, normalizer, cache_size=cache_size)
+
+
+def encode_all(tokenizer, lines):
+    t0 = time.perf_counter()
+    for line in lines:
+        tokenizer.encode(line)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vocab", default=None, help="sentencepiece model, e.g. checkpoints/bpe.model")
+    parser.add_argument("--corpus", nargs="*", default=[], help=".srt / .txt files (globs), one line per cue line")
+    parser.add_argument("--lines", type=int, default=20000, help="lines of the synthesized corpus")
+    parser.add_argument("--repeat", type=float, default=0.3, help="fraction of stock lines in the synthesized corpus")
+    parser.add_argument("--cache_size", type=int, default=4096)
+    parser.add_argument("--identity_normalizer", action="store_true")
+    args = parser.parse_args()
+
+    lines = read_corpus(args.corpus) if args.corpus else synthesize_corpus(args.lines, args.repeat)
+    lines = [line for line in lines if line]
+    with tempfile.TemporaryDirectory() as directory:
+        vocab_file = args.vocab or train_vocab(lines, directory)
+        uncached = make_tokenizer(vocab_file, args.identity_normalizer, cache_size=0)
+        cached = make_tokenizer(vocab_file, args.identity_normalizer, cache_size=args.cache_size)
+
+        encode_all(uncached, lines[:100])  # warm-up, e.g. lazily built normalizer grammars
+        t_uncached = encode_all(uncached, lines)
+        t_cold = encode_all(cached, lines)
+        t_warm = encode_all(cached, lines)
+        assert [cached.encode(line) for line in lines[:1000]] == [uncached.encode(line) for line in lines[:1000]]
+
+    unique = len(set(lines))
+    print(f">> {len(lines)} lines, {unique} unique ({1 - unique / len(lines):.1%} repeated), "
+          f"cache size {args.cache_size}, {'identity' if args.identity_normalizer else 'WeTextProcessing'} normalizer")
+    for name, seconds in (("no cache", t_uncached), ("cold cache", t_cold), ("warm cache", t_warm)):
+        print(f">> {name}: {seconds:.3f}s, {len(lines) / seconds:,.0f} lines/s ({t_uncached / seconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
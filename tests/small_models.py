@@ -0,0 +1,115 @@
+"""
+Random-init IndexTTS / IndexTTS2 sub-models for tests and benchmarks, so no checkpoint is downloaded.
+"""
+import os
+from types import SimpleNamespace
+
+import torch
+
+from indextts.gpt import model as model_v1
+from indextts.gpt.model_v2 import UnifiedVoice
+
+# conformer-perceiver conditioning encoders, narrower than the released ones
+SMALL_CONDITION_MODULE = dict(output_size=128, linear_units=256, attention_heads=4, num_blocks=2,
+                              input_layer="conv2d2", perceiver_mult=2)
+
+
+def build_unified_voice(layers=4, model_dim=256, heads=4, seed=0, kv_cache=True, **kwargs):
+    """
+    IndexTTS2 GPT (`indextts.gpt.model_v2.UnifiedVoice`) in eval mode with the inference model set up.
+    The released model has 24 layers, model_dim 1280 and 20 heads.
+    """
+    torch.manual_seed(seed)
+    config = dict(max_text_tokens=60, max_mel_tokens=200, number_text_tokens=300, checkpointing=False,
+                  condition_type="conformer_perceiver", condition_module=SMALL_CONDITION_MODULE,
+                  emo_condition_module=SMALL_CONDITION_MODULE)
+    config.update(kwargs)
+    model = UnifiedVoice(layers=layers, model_dim=model_dim, heads=heads, **config).eval()
+    model.post_init_gpt2_config(use_deepspeed=False, kv_cache=kv_cache, half=False)
+    return model
+
+
+def speech_inputs(model, text_tokens=20, cond_frames=60, seed=1):
+    """(speech_condition, text_inputs, emo_speech_condition) for `UnifiedVoice.inference_speech`."""
+    generator = torch.Generator().manual_seed(seed)
+    cond = torch.randn(1, cond_frames, 1024, generator=generator)
+    text = torch.randint(3, model.number_text_tokens - 1, (1, text_tokens), generator=generator)
+    return cond, text, cond
+
+
+def build_unified_voice_v1(layers=4, model_dim=256, heads=4, seed=0, kv_cache=True, static_kv_cache=True, **kwargs):
+    """
+    IndexTTS v1 GPT (`indextts.gpt.model.UnifiedVoice`) in eval mode with the fp32 inference model set up
+    as `IndexTTS` does on CPU. The released 1.5 model has 24 layers, model_dim 1280 and 20 heads.
+    """
+    torch.manual_seed(seed)
+    config = dict(max_text_tokens=60, max_mel_tokens=250, number_text_tokens=300, checkpointing=False)
+    config.update(kwargs)
+    model = model_v1.UnifiedVoice(layers=layers, model_dim=model_dim, heads=heads, **config).eval()
+    model.post_init_gpt2_config(use_deepspeed=False, kv_cache=kv_cache, half=False, static_kv_cache=static_kv_cache)
+    return model
+
+
+def speech_inputs_v1(model, batch_size=1, text_tokens=20, cond_frames=100, seed=1):
+    """
+    (cond_mel, text_inputs) for the v1 `inference_speech`; text rows after the first are shorter, padded
+    with the stop text token.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    cond_mel = torch.randn(1, 100, cond_frames, generator=generator)
+    text = torch.randint(3, model.number_text_tokens - 1, (batch_size, text_tokens), generator=generator)
+    for i in range(1, batch_size):
+        text[i, text_tokens - 3 * i:] = model.stop_text_token
+    return cond_mel, text
+
+
+def s2mel_args(depth=13, hidden_dim=512):
+    """`CFM` arguments of the released s2mel model; `depth` and `hidden_dim` can be reduced."""
+    return SimpleNamespace(
+        dit_type="DiT",
+        reg_loss_type="l1",
+        style_encoder=SimpleNamespace(dim=192),
+        DiT=SimpleNamespace(
+            hidden_dim=hidden_dim, num_heads=8, depth=depth, class_dropout_prob=0.1, block_size=8192, in_channels=80,
+            style_condition=True, final_layer_type="wavenet", target="mel", content_dim=512,
+            content_codebook_size=1024, content_type="discrete", f0_condition=False, n_f0_bins=512,
+            content_codebooks=1, is_causal=False, long_skip_connection=True, zero_prompt_speech_token=False,
+            time_as_token=False, style_as_token=False, uvit_skip_connection=True, add_resblock_in_transformer=False,
+        ),
+        wavenet=SimpleNamespace(hidden_dim=hidden_dim, num_layers=8, kernel_size=5, dilation_rate=1, p_dropout=0.2,
+                                style_condition=True),
+    )
+
+
+def build_cfm(depth=13, hidden_dim=512, seed=0):
+    """s2mel flow-matching decoder (`CFM`) in eval mode, its `estimator` is the DiT."""
+    from indextts.s2mel.modules.flow_matching import CFM
+
+    torch.manual_seed(seed)
+    cfm = CFM(s2mel_args(depth, hidden_dim)).eval()
+    cfm.estimator.setup_caches(max_batch_size=2, max_seq_length=8192)
+    return cfm
+
+
+def s2mel_inputs(frames=300, prompt_frames=100, seed=1):
+    """(mu, x_lens, prompt, style) for `CFM.inference`."""
+    generator = torch.Generator().manual_seed(seed)
+    mu = torch.randn(1, frames, 512, generator=generator)
+    prompt = torch.randn(1, 80, prompt_frames, generator=generator)
+    style = torch.randn(1, 192, generator=generator)
+    return mu, torch.LongTensor([frames]), prompt, style
+
+
+def build_bigvgan(upsample_initial_channel=128, seed=0):
+    """
+    BigVGAN vocoder from the bundled s2mel config in eval mode with weight norm removed; the released one
+    has 1536 initial channels.
+    """
+    from indextts.s2mel.modules.bigvgan import bigvgan
+
+    torch.manual_seed(seed)
+    h = bigvgan.load_hparams_from_json(os.path.join(os.path.dirname(bigvgan.__file__), "config.json"))
+    h.upsample_initial_channel = upsample_initial_channel
+    model = bigvgan.BigVGAN(h).eval()
+    model.remove_weight_norm()
+    return model
@@ -0,0 +1,93 @@
+import pytest
+import torch
+
+from indextts.s2mel.modules.bigvgan.chunked import ChunkedVocoder
+from tests.small_models import build_bigvgan
+
+CHUNK_FRAMES = 64
+
+
+@pytest.fixture(scope="module")
+def model():
+    return build_bigvgan()
+
+
+@pytest.fixture(scope="module")
+def vocoder(model):
+    return ChunkedVocoder(model, chunk_frames=CHUNK_FRAMES)
+
+
+def random_mel(frames, batch_size=2, seed=1):
+    return torch.randn(batch_size, 80, frames, generator=torch.Generator().manual_seed(seed))
+
+
+def vocode(model, mel):
+    with torch.inference_mode():
+        return model(mel)
+
+
+def stream_all(stream, mel, feed_frames):
+    with torch.inference_mode():
+        wavs = [stream.feed(piece) for piece in mel.split(feed_frames, dim=-1)]
+        return torch.cat(wavs + [stream.flush()], dim=-1)
+
+
+def assert_close(wav, expected):
+    assert wav.shape == expected.shape
+    assert (wav - expected).abs().max().item() < 1e-4
+
+
+def test_window_sizes(vocoder):
+    # the 300-frame mels below then span several overlap-save windows
+    assert 0 < vocoder.context_frames < CHUNK_FRAMES
+    assert vocoder.hop_length == 256
+
+
+def test_chunked_matches_whole_mel(model, vocoder):
+    mel = random_mel(300)
+    with torch.inference_mode():
+        assert_close(vocoder(mel), vocode(model, mel))
+
+
+@pytest.mark.parametrize("feed_frames", [1, 37, CHUNK_FRAMES, 100, 300])
+def test_stream_matches_whole_mel(model, vocoder, feed_frames):
+    mel = random_mel(300)
+    assert_close(stream_all(vocoder.stream(), mel, feed_frames), vocode(model, mel))
+
+
+@pytest.mark.parametrize("frames", [1, 20, CHUNK_FRAMES, "window"])
+def test_short_mel_is_vocoded_in_a_single_call(model, vocoder, frames):
+    if frames == "window":
+        frames = CHUNK_FRAMES + vocoder.context_frames
+    calls = []
+    counting = ChunkedVocoder(lambda mel: calls.append(mel.size(-1)) or model(mel), chunk_frames=CHUNK_FRAMES,
+                              context_frames=vocoder.context_frames, hop_length=vocoder.hop_length)
+    mel = random_mel(frames)
+    with torch.inference_mode():
+        wav = counting(mel)
+    assert calls == [frames]
+    assert_close(wav, vocode(model, mel))
+
+
+def test_interleaved_streams_keep_separate_state(model, vocoder):
+    mels = [random_mel(250, batch_size=1, seed=1), random_mel(180, batch_size=1, seed=2)]
+    streams = [vocoder.stream(), vocoder.stream()]
+    wavs = [[], []]
+    with torch.inference_mode():
+        pieces = [mel.split(29, dim=-1) for mel in mels]
+        for step in range(max(len(p) for p in pieces)):
+            for i in (0, 1):
+                if step < len(pieces[i]):
+                    wavs[i].append(streams[i].feed(pieces[i][step]))
+        for i in (0, 1):
+            wavs[i].append(streams[i].flush())
+    for mel, wav in zip(mels, wavs):
+        assert_close(torch.cat(wav, dim=-1), vocode(model, mel))
+
+
+def test_flush_resets_the_stream(model, vocoder):
+    stream = vocoder.stream()
+    first, second = random_mel(150, seed=1), random_mel(90, seed=2)
+    assert_close(stream_all(stream, first, 50), vocode(model, first))
+    assert_close(stream_all(stream, second, 50), vocode(model, second))
+    assert stream.flush().size(-1) == 0
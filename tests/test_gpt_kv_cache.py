@@ -0,0 +1,42 @@
+import pytest
+import torch
+
+from tests.small_models import build_unified_voice_v1, speech_inputs_v1
+
+
+@pytest.fixture(scope="module")
+def model():
+    return build_unified_voice_v1()
+
+
+def generate(model, kv_cache, static_kv_cache=True, batch_size=1, **kwargs):
+    model.post_init_gpt2_config(use_deepspeed=False, kv_cache=kv_cache, half=False, static_kv_cache=static_kv_cache)
+    cond_mel, text = speech_inputs_v1(model, batch_size=batch_size)
+    generation = dict(do_sample=False, num_beams=1, max_generate_length=80, repetition_penalty=2.0)
+    generation.update(kwargs)
+    with torch.no_grad():
+        return model.inference_speech(cond_mel, text, **generation)
+
+
+@pytest.mark.parametrize("num_beams", [1, 3])
+def test_static_kv_cache_matches_uncached_decoding(model, num_beams):
+    expected = generate(model, kv_cache=False, num_beams=num_beams)
+    assert expected.shape[-1] > 20
+    # kv cache as IndexTTS sets it up for fp32 (CPU / MPS) inference
+    assert torch.equal(generate(model, kv_cache=True, num_beams=num_beams), expected)
+
+
+def test_static_kv_cache_matches_uncached_decoding_for_padded_batch(model):
+    expected = generate(model, kv_cache=False, batch_size=2, num_beams=3)
+    assert torch.equal(generate(model, kv_cache=True, batch_size=2, num_beams=3), expected)
+
+
+def test_static_kv_cache_is_reused_across_calls(model):
+    first = generate(model, kv_cache=True)
+    cache = model.inference_model._static_cache
+    assert cache is not None
+    with torch.no_grad():
+        second = model.inference_speech(*speech_inputs_v1(model), do_sample=False, num_beams=1,
+                                        max_generate_length=80, repetition_penalty=2.0)
+    assert model.inference_model._static_cache is cache
+    assert torch.equal(first, second)
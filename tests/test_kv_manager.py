@@ -0,0 +1,71 @@
+import torch
+
+from indextts.accel import kv_manager
+from indextts.accel.kv_manager import KVCacheManager, Seq
+
+BLOCK_SIZE = 4
+
+
+def make_manager(num_blocks=16):
+    return KVCacheManager(num_layers=1, num_heads=1, head_dim=1, block_size=BLOCK_SIZE,
+                          num_blocks=num_blocks, dtype=torch.float32)
+
+
+def new_seq(manager, token_ids):
+    seq = Seq(token_ids, block_size=BLOCK_SIZE)
+    manager.allocate(seq)
+    return seq
+
+
+def test_shared_prefix_is_reused():
+    manager = make_manager()
+    first = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8, 9])
+    second = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8, 10, 11])
+    assert second.num_cached_tokens == 2 * BLOCK_SIZE
+    assert second.block_table[:2] == first.block_table[:2]
+    assert second.block_table[2] != first.block_table[2]
+    assert manager.blocks[first.block_table[0]].ref_cnt == 2
+
+
+def test_same_block_after_different_prefix_is_not_reused():
+    manager = make_manager()
+    first = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8])
+    second = new_seq(manager, [9, 9, 9, 9, 5, 6, 7, 8])
+    assert second.num_cached_tokens == 0
+    assert not set(first.block_table) & set(second.block_table)
+
+
+def test_hash_collision_with_different_parent_is_a_miss(monkeypatch):
+    # a hash that ignores the parent block makes "5 6 7 8" collide whatever precedes it
+    monkeypatch.setattr(kv_manager, "hash_block", lambda token_ids, parent_hash=None: hash(tuple(token_ids)))
+    manager = make_manager()
+    new_seq(manager, [1, 2, 3, 4])
+    other = new_seq(manager, [9, 9, 9, 9, 5, 6, 7, 8])
+    # the first block is a real hit, the second one only collides with the block of `other`
+    seq = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8])
+    assert seq.get_block_hash(1) == other.get_block_hash(1)
+    assert seq.num_cached_tokens == BLOCK_SIZE
+    assert seq.block_table[1] != other.block_table[1]
+
+
+def test_blocks_filled_by_decoding_are_reused():
+    manager = make_manager()
+    first = new_seq(manager, [1, 2, 3, 4, 5, 6])
+    for token_id in (7, 8, 9):
+        first.append_token(token_id)
+        manager.append_to_seq(first)
+    assert len(first.block_table) == 3
+    second = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8, 0])
+    assert second.num_cached_tokens == 2 * BLOCK_SIZE
+    assert second.block_table[:2] == first.block_table[:2]
+
+
+def test_freed_blocks_taken_over_are_not_reused():
+    manager = make_manager(num_blocks=2)
+    first = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8])
+    manager.remove_seq(first)
+    # takes over both freed blocks, the hashes of the first sequence now point at other tokens
+    other = new_seq(manager, [9, 9, 9, 9, 0, 0, 0, 0])
+    manager.remove_seq(other)
+    second = new_seq(manager, [1, 2, 3, 4, 5, 6, 7, 8])
+    assert second.num_cached_tokens == 0
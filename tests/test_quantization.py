@@ -0,0 +1,67 @@
+import os
+
+import torch
+
+from indextts.s2mel.modules.gpt_fast.quantize import WeightOnlyInt8Linear
+from indextts.utils.quantization import WeightOnlyInt4GroupLinear, quantize_with_cache
+from tests.small_models import build_unified_voice, speech_inputs
+
+TARGETS = ["gpt.h", "mel_head"]
+
+
+def generate(model):
+    cond, text, emo = speech_inputs(model)
+    with torch.no_grad():
+        codes, _ = model.inference_speech(cond, text, emo, max_generate_length=30, num_beams=1, do_sample=False,
+                                          fast_sampling=True)
+    return codes
+
+
+def quantized_model(mode, cache_path, source_path, **kwargs):
+    model = build_unified_voice(kv_cache=False, **kwargs)
+    from_cache = quantize_with_cache(model, TARGETS, mode, cache_path, source_path, groupsize=64,
+                                     load_source=lambda m: m.load_state_dict(torch.load(source_path)))
+    model.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    return model, from_cache
+
+
+def test_second_load_comes_from_the_disk_cache(tmp_path):
+    source_path = str(tmp_path / "gpt.pth")
+    torch.save(build_unified_voice().state_dict(), source_path)
+    for mode, layer_type in (("int8", WeightOnlyInt8Linear), ("int4", WeightOnlyInt4GroupLinear)):
+        cache_path = str(tmp_path / f"gpt.{mode}.pth")
+        # a different seed: the weights must come from `load_source` or the cache, not the constructor
+        first, from_cache = quantized_model(mode, cache_path, source_path, seed=1)
+        assert not from_cache and os.path.isfile(cache_path)
+        second, from_cache = quantized_model(mode, cache_path, source_path, seed=2)
+        assert from_cache
+        assert isinstance(second.gpt.h[0].mlp.c_fc, layer_type) and isinstance(second.mel_head, layer_type)
+        for key, value in first.state_dict().items():
+            assert torch.equal(value, second.state_dict()[key]), key
+        assert torch.equal(generate(first), generate(second))
+
+
+def test_stale_cache_is_requantized(tmp_path):
+    source_path = str(tmp_path / "gpt.pth")
+    cache_path = str(tmp_path / "gpt.int8.pth")
+    torch.save(build_unified_voice().state_dict(), source_path)
+    quantized_model("int8", cache_path, source_path)
+    # a new checkpoint at the same path invalidates the cache
+    torch.save(build_unified_voice(seed=3).state_dict(), source_path)
+    os.utime(source_path, (0, 0))
+    model, from_cache = quantized_model("int8", cache_path, source_path)
+    assert not from_cache
+    _, from_cache = quantized_model("int8", cache_path, source_path)
+    assert from_cache
+
+
+def test_int8_stays_close_to_fp32(tmp_path):
+    source_path = str(tmp_path / "gpt.pth")
+    reference = build_unified_voice()
+    torch.save(reference.state_dict(), source_path)
+    model, _ = quantized_model("int8", str(tmp_path / "gpt.int8.pth"), source_path)
+    hidden = torch.randn(1, 50, reference.model_dim)
+    with torch.no_grad():
+        expected = reference.gpt(inputs_embeds=hidden).last_hidden_state
+        out = model.gpt(inputs_embeds=hidden).last_hidden_state
+    assert ((out - expected).norm() / expected.norm()).item() < 2e-2
@@ -0,0 +1,74 @@
+import torch
+from transformers import Wav2Vec2BertConfig, Wav2Vec2BertModel
+
+from indextts.utils.maskgct_utils import SEMANTIC_LAYER, build_semantic_model
+
+
+def build_random_w2v_bert(directory, **config_kwargs):
+    """
+    Save a random-init 24-layer w2v-bert (with adapter, like a full checkpoint) and its feature stats to
+    `directory`. Returns (full model, stats path).
+    """
+    torch.manual_seed(0)
+    config = Wav2Vec2BertConfig(**config_kwargs)
+    model = Wav2Vec2BertModel(config).eval()
+    model.save_pretrained(directory)
+    stats_path = f"{directory}/wav2vec2bert_stats.pt"
+    hidden_size = config.hidden_size
+    torch.save({"mean": torch.randn(hidden_size), "var": torch.rand(hidden_size) + 0.5}, stats_path)
+    return model, stats_path
+
+
+def semantic_inputs(config, batch_size=2, frames=200):
+    torch.manual_seed(1)
+    input_features = torch.randn(batch_size, frames, config.feature_projection_input_dim)
+    attention_mask = torch.ones(batch_size, frames, dtype=torch.long)
+    attention_mask[1:, frames * 3 // 4:] = 0  # padded second item
+    return input_features, attention_mask
+
+
+SMALL_CONFIG = dict(
+    hidden_size=64,
+    num_hidden_layers=24,
+    num_attention_heads=4,
+    intermediate_size=128,
+    output_hidden_size=64,
+    add_adapter=True,
+    use_intermediate_ffn_before_adapter=True,
+    hidden_dropout=0.0,
+    activation_dropout=0.0,
+    attention_dropout=0.0,
+)
+
+
+def test_truncated_model_matches_full_hidden_state(tmp_path):
+    full_model, stats_path = build_random_w2v_bert(str(tmp_path), **SMALL_CONFIG)
+    semantic_model, semantic_mean, semantic_std = build_semantic_model(
+        stats_path, output_layer=SEMANTIC_LAYER, model_id=str(tmp_path))
+
+    assert len(semantic_model.encoder.layers) == SEMANTIC_LAYER
+    assert semantic_model.adapter is None and semantic_model.intermediate_ffn is None
+    assert not semantic_model.training
+
+    input_features, attention_mask = semantic_inputs(full_model.config)
+    with torch.no_grad():
+        # previous IndexTTS2.get_emb: all layers, hidden state of the tap layer
+        expected = full_model(input_features=input_features, attention_mask=attention_mask,
+                              output_hidden_states=True).hidden_states[SEMANTIC_LAYER]
+        out = semantic_model(input_features=input_features, attention_mask=attention_mask).last_hidden_state
+    assert torch.equal(out, expected)
+    # normalization stats are unchanged
+    stats = torch.load(stats_path)
+    assert torch.equal(semantic_mean, stats["mean"])
+    assert torch.equal(semantic_std, torch.sqrt(stats["var"]))
+
+
+def test_full_model_without_output_layer(tmp_path):
+    full_model, stats_path = build_random_w2v_bert(str(tmp_path), **SMALL_CONFIG)
+    semantic_model, _, _ = build_semantic_model(stats_path, model_id=str(tmp_path))
+    assert len(semantic_model.encoder.layers) == SMALL_CONFIG["num_hidden_layers"]
+    input_features, attention_mask = semantic_inputs(full_model.config)
+    with torch.no_grad():
+        expected = full_model(input_features=input_features, attention_mask=attention_mask).last_hidden_state
+        out = semantic_model(input_features=input_features, attention_mask=attention_mask).last_hidden_state
+    assert torch.equal(out, expected)
@@ -0,0 +1,163 @@
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.utils.common import remove_long_silence, stop_token_lengths
+
+STOP = 8193
+SILENT = 52
+
+
+def reference_remove_long_silence(codes, stop_token, silent_token=52, max_consecutive=30):
+    # per-row loop that IndexTTS/IndexTTS2.remove_long_silence used before the vectorized version
+    code_lens = []
+    codes_list = []
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    return codes, torch.tensor(code_lens, dtype=torch.long)
+
+
+def reference_stop_token_lengths(codes, stop_token):
+    code_lens = []
+    for code in codes:
+        if stop_token not in code:
+            code_lens.append(len(code))
+        else:
+            code_lens.append((code == stop_token).nonzero(as_tuple=False)[0][0].item())
+    return torch.LongTensor(code_lens)
+
+
+def row(*parts, length=None):
+    """Concatenate (token, count) runs into one row, padded with `STOP` up to `length`."""
+    tokens = [token for token, count in parts for _ in range(count)]
+    if length is not None:
+        tokens += [STOP] * (length - len(tokens))
+    return tokens
+
+
+def assert_matches_reference(codes, **kwargs):
+    codes = torch.tensor(codes, dtype=torch.long)
+    expected_codes, expected_lens = reference_remove_long_silence(codes, STOP, **kwargs)
+    out_codes, out_lens = remove_long_silence(codes, STOP, **kwargs)
+    assert torch.equal(out_lens, expected_lens)
+    assert out_codes.shape == expected_codes.shape
+    assert torch.equal(out_codes, expected_codes)
+    return out_codes, out_lens
+
+
+def test_stop_token_lengths_first_stop_per_row():
+    codes = torch.tensor([
+        row((1, 3), (STOP, 1), (2, 2), (STOP, 2)),  # first of several stop tokens
+        row((STOP, 8)),  # stop token at position 0
+        row((1, 4), (2, 4)),  # no stop token: full length
+        row((1, 7), (STOP, 1)),
+    ])
+    lens = stop_token_lengths(codes, STOP)
+    assert lens.dtype == torch.long
+    assert lens.tolist() == [3, 0, 8, 7]
+    assert torch.equal(lens, reference_stop_token_lengths(codes, STOP))
+
+
+def test_no_compression_clips_to_longest_length():
+    # at most max_consecutive silent tokens per row: codes are only clipped, never padded or rewritten
+    codes = [
+        row((1, 5), (SILENT, 20), (2, 3), (STOP, 2)),
+        row((1, 4), (STOP, 26)),
+        row((SILENT, 30), (STOP, 30))[:30],
+    ]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_lens.tolist() == [28, 4, 30]
+    assert out_codes.shape == (3, 30)
+    # rows shorter than the longest keep their original tokens past the stop token
+    assert out_codes[1, 4:].tolist() == [STOP] * 26
+
+
+def test_no_stop_token_rows_are_kept_whole():
+    codes = [row((1, 10), (2, 10)), row((3, 15), (STOP, 5))]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_lens.tolist() == [20, 15]
+    assert out_codes.shape == (2, 20)
+
+
+def test_threshold_counts_silent_tokens_over_whole_row():
+    # 31 silent tokens split in short runs, some after the stop token, still trigger compression
+    codes = [row((SILENT, 8), (1, 1), (SILENT, 8), (1, 1), (SILENT, 8), (STOP, 1), (SILENT, 7))]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_lens.tolist() == [26]
+    # exactly max_consecutive silent tokens do not
+    codes = [row((SILENT, 15), (1, 1), (SILENT, 15), (STOP, 1))]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_lens.tolist() == [31]
+
+
+def test_keeps_first_ten_tokens_of_each_silent_run():
+    codes = [row((1, 2), (SILENT, 25), (2, 1), (SILENT, 12), (3, 1), (SILENT, 4), (STOP, 3))]
+    out_codes, out_lens = assert_matches_reference(codes)
+    expected = row((1, 2), (SILENT, 10), (2, 1), (SILENT, 10), (3, 1), (SILENT, 4))
+    assert out_lens.tolist() == [len(expected)]
+    assert out_codes[0].tolist() == expected
+
+
+def test_pads_with_stop_token_only_when_a_row_was_compressed():
+    codes = [
+        row((1, 3), (SILENT, 40), (2, 3), length=60),  # compressed to 16 tokens
+        row((4, 30), (STOP, 1), length=60),  # untouched, 30 tokens
+        row((5, 2), (STOP, 1), (6, 5), length=60),  # untouched, 2 tokens
+    ]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_lens.tolist() == [16, 30, 2]
+    assert out_codes.shape == (3, 30)
+    assert out_codes[0, 16:].tolist() == [STOP] * 14
+    # tokens after the stop token are replaced by padding, unlike the clip-only path
+    assert out_codes[2, 2:].tolist() == [STOP] * 28
+
+
+def test_single_compressed_row():
+    codes = [row((SILENT, 50), (1, 2), (STOP, 8))]
+    out_codes, out_lens = assert_matches_reference(codes)
+    assert out_codes[0].tolist() == row((SILENT, 10), (1, 2))
+
+
+def test_random_batches_match_reference():
+    generator = torch.Generator().manual_seed(0)
+    for _ in range(200):
+        batch = int(torch.randint(1, 5, (1,), generator=generator))
+        length = int(torch.randint(1, 120, (1,), generator=generator))
+        codes = torch.randint(0, 4, (batch, length), generator=generator)
+        # token 0 -> silent, 1 -> stop (rarely), others voiced
+        silent_p, stop_p = torch.rand(2, generator=generator) * torch.tensor([0.9, 0.05])
+        u = torch.rand(batch, length, generator=generator)
+        codes = torch.where(u < silent_p, SILENT, codes + 100)
+        codes = torch.where(torch.rand(batch, length, generator=generator) < stop_p, STOP, codes)
+        assert_matches_reference(codes.tolist())
@@ -0,0 +1,59 @@
+import pytest
+import torch
+
+from tests.small_models import build_unified_voice, speech_inputs
+
+LAYERS = 4
+
+
+@pytest.fixture(scope="module")
+def model():
+    return build_unified_voice(layers=LAYERS)
+
+
+def generate(model, **kwargs):
+    generation = dict(do_sample=False, num_beams=1, max_generate_length=100, repetition_penalty=10.0)
+    generation.update(kwargs)
+    torch.manual_seed(0)
+    with torch.no_grad():
+        codes, _ = model.inference_speech(*speech_inputs(model), **generation)
+    return codes
+
+
+@pytest.fixture(scope="module")
+def greedy_codes(model):
+    codes = generate(model)
+    assert codes.shape[-1] > 20
+    return codes
+
+
+def test_fast_sampling_matches_greedy_generate(model, greedy_codes):
+    assert torch.equal(generate(model, fast_sampling=True), greedy_codes)
+
+
+@pytest.mark.parametrize("draft_layers", [1, LAYERS - 1])
+@pytest.mark.parametrize("draft_tokens", [1, 2, 3])
+def test_speculative_decoding_matches_greedy_generate(model, greedy_codes, draft_layers, draft_tokens):
+    codes = generate(model, speculative_draft_layers=draft_layers, speculative_draft_tokens=draft_tokens)
+    assert torch.equal(codes, greedy_codes)
+    accepted, proposed = model.inference_model.speculative_stats
+    assert 0 <= accepted <= proposed and proposed > 0
+
+
+def test_full_depth_draft_accepts_every_sampled_token(model, monkeypatch):
+    # a draft running every block proposes from the verifier's own distribution, so nothing is rejected
+    inference_model = model.inference_model
+    draft = inference_model.get_draft_model(LAYERS - 1)
+    monkeypatch.setattr(draft.transformer, "h", inference_model.transformer.h)
+    monkeypatch.setattr(draft.transformer.config, "n_layer", LAYERS)
+    monkeypatch.setattr(inference_model, "_draft_model", (LAYERS, draft))
+    codes = generate(model, do_sample=True, top_k=30, top_p=0.8, temperature=0.8,
+                     speculative_draft_layers=LAYERS, speculative_draft_tokens=4)
+    accepted, proposed = inference_model.speculative_stats
+    assert codes.shape[-1] > 20
+    assert accepted == proposed > 0
+
+
+def test_invalid_draft_depth_is_rejected(model):
+    with pytest.raises(ValueError):
+        model.inference_model.get_draft_model(LAYERS)
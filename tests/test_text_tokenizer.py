@@ -0,0 +1,126 @@
+import pytest
+import sentencepiece
+
+from indextts.utils.front import TextNormalizer, TextTokenizer
+
+CORPUS = [
+    "I use C plus plus and C# every day.",
+    "The PCIE five SSD is fast, the M dot two slot too.",
+    "What is the weather like today? It is sunny.",
+    "Please write the report in CMake and Python.",
+    "we met at the station and talked for hours",
+]
+
+
+class IdentityNormalizer:
+    # stands in for the WeTextProcessing / wetext engines, the glossary is applied before them
+    def normalize(self, text):
+        return text
+
+
+def sample_lines():
+    return ["I love C++ and C#.", "Is PCIe fast?", "Hello world, how are you?"]
+
+
+@pytest.fixture(scope="module")
+def vocab_file(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("bpe")
+    corpus = directory / "corpus.txt"
+    corpus.write_text("\n".join(CORPUS * 20).upper() + "\n", encoding="utf-8")
+    sentencepiece.SentencePieceTrainer.train(
+        input=str(corpus), model_prefix=str(directory / "bpe"), vocab_size=120, model_type="bpe",
+        character_coverage=1.0, bos_id=0, eos_id=1, unk_id=2, pad_id=-1, minloglevel=2)
+    return str(directory / "bpe.model")
+
+
+def make_tokenizer(vocab_file, cache_size=4096):
+    normalizer = TextNormalizer(enable_glossary=True)
+    normalizer.zh_normalizer = normalizer.en_normalizer = IdentityNormalizer()
+    return TextTokenizer(vocab_file, normalizer, cache_size=cache_size)
+
+
+def count_preprocess(monkeypatch, tokenizer):
+    calls = []
+    preprocess = tokenizer.preprocess
+    monkeypatch.setattr(tokenizer, "preprocess", lambda text: calls.append(text) or preprocess(text))
+    return calls
+
+
+def test_repeated_lines_are_encoded_once(vocab_file, monkeypatch):
+    tokenizer = make_tokenizer(vocab_file)
+    calls = count_preprocess(monkeypatch, tokenizer)
+    first = [tokenizer.encode(line) for line in sample_lines()]
+    assert [tokenizer.encode(line) for line in sample_lines()] == first
+    assert tokenizer.batch_encode(sample_lines()) == first
+    assert len(calls) == len(sample_lines())
+    # callers get a copy, not the cached entry
+    first[0].append(-1)
+    assert tokenizer.encode(sample_lines()[0]) == first[0][:-1]
+
+
+def test_cache_matches_uncached_encoding(vocab_file):
+    cached, uncached = make_tokenizer(vocab_file), make_tokenizer(vocab_file, cache_size=0)
+    for out_type in (int, str):
+        for _ in range(2):
+            assert [cached.encode(line, out_type=out_type) for line in sample_lines()] == \
+                   [uncached.encode(line, out_type=out_type) for line in sample_lines()]
+    assert len(uncached._encode_cache) == 0
+
+
+def test_load_glossary_invalidates_cached_encodings(vocab_file):
+    tokenizer = make_tokenizer(vocab_file)
+    reference = make_tokenizer(vocab_file, cache_size=0)
+    line = "I love C++ and C#."
+    before = tokenizer.encode(line)
+    before_batch = tokenizer.batch_encode([line])
+
+    glossary = {"C++": {"en": "C plus plus", "zh": "C 加加"}, "C#": "C sharp"}
+    tokenizer.normalizer.load_glossary(glossary)
+    reference.normalizer.load_glossary(glossary)
+    expected = reference.encode(line)
+    assert expected != before
+    assert tokenizer.encode(line) == expected
+    assert tokenizer.batch_encode([line]) == [expected] != before_batch
+    assert tokenizer.tokenize(line) == reference.tokenize(line)
+
+    # loading the same terms again keeps the cache valid
+    version = tokenizer.normalizer.glossary_version
+    tokenizer.normalizer.load_glossary({"C#": "C sharp"})
+    assert tokenizer.normalizer.glossary_version == version
+    assert tokenizer.encode(line) == expected
+
+
+def test_assigning_term_glossary_invalidates_cached_encodings(vocab_file):
+    tokenizer = make_tokenizer(vocab_file)
+    line = "Is PCIe fast?"
+    tokenizer.normalizer.term_glossary = {"PCIe": {"en": "PCIE five"}}
+    with_glossary = tokenizer.encode(line)
+    tokenizer.normalizer.term_glossary = {}
+    without_glossary = tokenizer.encode(line)
+    assert without_glossary != with_glossary
+    assert without_glossary == make_tokenizer(vocab_file, cache_size=0).encode(line)
+
+
+def test_disabling_glossary_invalidates_cached_encodings(vocab_file):
+    tokenizer = make_tokenizer(vocab_file)
+    tokenizer.normalizer.load_glossary({"C#": "C sharp"})
+    line = "I love C#."
+    with_glossary = tokenizer.encode(line)
+    tokenizer.normalizer.enable_glossary = False
+    assert tokenizer.encode(line) != with_glossary
+
+
+def test_extra_sentencepiece_kwargs_bypass_the_cache(vocab_file):
+    tokenizer = make_tokenizer(vocab_file)
+    line = sample_lines()[2]
+    tokenizer.encode(line, add_bos=True)
+    assert len(tokenizer._encode_cache) == 0
+    assert tokenizer.encode(line, add_bos=True)[0] == tokenizer.bos_token_id
+    assert tokenizer.encode(line)[0] != tokenizer.bos_token_id
+
+
+def test_cache_is_bounded(vocab_file):
+    tokenizer = make_tokenizer(vocab_file, cache_size=2)
+    for line in sample_lines():
+        tokenizer.encode(line)
+    assert len(tokenizer._encode_cache) == 2
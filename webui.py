@@ -28,6 +28,7 @@ parser.add_argument("--model_dir", type=str, default="./checkpoints", help="Mode
 parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
 parser.add_argument("--deepspeed", action="store_true", default=False, help="Use DeepSpeed to accelerate if available")
 parser.add_argument("--cuda_kernel", action="store_true", default=False, help="Use CUDA kernel for inference if available")
+parser.add_argument("--quantize", type=str, default=None, choices=["int8", "int4"], help="Weight-only quantization of the GPT and DiT for CPU inference")
 parser.add_argument("--gui_seg_tokens", type=int, default=120, help="GUI: Max tokens per generation segment")
 cmd_args = parser.parse_args()
 
@@ -58,6 +59,7 @@ tts = IndexTTS2(model_dir=cmd_args.model_dir,
                 use_fp16=cmd_args.fp16,
                 use_deepspeed=cmd_args.deepspeed,
                 use_cuda_kernel=cmd_args.cuda_kernel,
+                quantize=cmd_args.quantize,
                 )
 # 支持的语言列表
 LANGUAGES = {
@@ -136,7 +138,7 @@ def gen_single(emo_control_method,prompt, text,
     # set gradio progress
     tts.gr_progress = progress
     do_sample, top_p, top_k, temperature, \
-        length_penalty, num_beams, repetition_penalty, max_mel_tokens = args
+        length_penalty, num_beams, repetition_penalty, max_mel_tokens, fast_sampling = args
     kwargs = {
         "do_sample": bool(do_sample),
         "top_p": float(top_p),
@@ -146,6 +148,7 @@ def gen_single(emo_control_method,prompt, text,
         "num_beams": num_beams,
         "repetition_penalty": float(repetition_penalty),
         "max_mel_tokens": int(max_mel_tokens),
+        "fast_sampling": bool(fast_sampling),
         # "typical_sampling": bool(typical_sampling),
         # "typical_mass": float(typical_mass),
     }
@@ -300,6 +303,7 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                         repetition_penalty = gr.Number(label="repetition_penalty", precision=None, value=10.0, minimum=0.1, maximum=20.0, step=0.1)
                         length_penalty = gr.Number(label="length_penalty", precision=None, value=0.0, minimum=-2.0, maximum=2.0, step=0.1)
                     max_mel_tokens = gr.Slider(label="max_mel_tokens", value=1500, minimum=50, maximum=tts.cfg.gpt.max_mel_tokens, step=10, info=i18n("生成Token最大数量，过小导致音频被截断"), key="max_mel_tokens")
+                    fast_sampling = gr.Checkbox(label="fast_sampling", value=False, info=i18n("不使用beam search的快速采样，忽略num_beams和length_penalty"))
                     # with gr.Row():
                     #     typical_sampling = gr.Checkbox(label="typical_sampling", value=False, info="不建议使用")
                     #     typical_mass = gr.Slider(label="typical_mass", value=0.9, minimum=0.0, maximum=1.0, step=0.1)
@@ -319,7 +323,7 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
                         )
             advanced_params = [
                 do_sample, top_p, top_k, temperature,
-                length_penalty, num_beams, repetition_penalty, max_mel_tokens,
+                length_penalty, num_beams, repetition_penalty, max_mel_tokens, fast_sampling,
                 # typical_sampling, typical_mass,
             ]
 
@@ -419,7 +423,7 @@ with gr.Blocks(title="IndexTTS Demo") as demo:
             reading = reading_zh or reading_en
 
         # 添加到词汇表
-        tts.normalizer.term_glossary[term] = reading
+        tts.normalizer.load_glossary({term: reading})
 
         # 自动保存到文件
         try: